@@ -1,90 +1,1260 @@
-import glob
+import hashlib
+import io
+import json
+import logging
 import os
+import shutil
+import tarfile
+import threading
+import time
 import uuid
+from multiprocessing.pool import ThreadPool
 
-import yaml
+try:
+    from urllib.error import HTTPError
+    from urllib.parse import urlparse
+    from urllib.request import Request
+except ImportError:
+    from urllib2 import HTTPError, Request
+    from urlparse import urlparse
 
+from cekit.cache.index import CacheIndex
+from cekit.cache.repository import RepositoryCache
+from cekit.cache.tier import create_tiers
 from cekit.config import Config
-from cekit.crypto import SUPPORTED_HASH_ALGORITHMS, get_sum
+from cekit.connections import urlopen
+from cekit.crypto import BUFFER_SIZE, SUPPORTED_HASH_ALGORITHMS, check_sums, get_sums
 from cekit.errors import CekitError
+from cekit.tools import FileLock, get_brew_urls, parse_duration, parse_size, reflink
 
+logger = logging.getLogger('cekit')
 CONFIG = Config()
 
+LAYOUT_UUID = 'uuid'
+LAYOUT_CONTENT = 'content'
+
+# Results of the cached artifact verification
+VERIFY_OK = 'ok'
+VERIFY_CORRUPTED = 'corrupted'
+VERIFY_MISSING = 'missing'
+VERIFY_BUSY = 'busy'
+
+# How long is remembered that an artifact was not found in a source
+DEFAULT_NEGATIVE_TTL = '1h'
+
+# How long are Brew download URLs of artifacts remembered
+DEFAULT_BREW_URL_TTL = '1d'
+
+# Name of the file with artifact entries in exported bundles and version of the bundle format
+BUNDLE_INDEX = 'index.json'
+BUNDLE_VERSION = 1
+
+# Directory with staging files of artifacts being fetched, and the suffix
+# of files describing how to resume an interrupted download
+PARTIAL_DIR = 'partial'
+PARTIAL_STATE_SUFFIX = '.json'
+
+# Staging files not modified for longer than this (in seconds) are removed by gc()
+STALE_FILE_AGE = 7 * 86400
+
+# Statistics recorded for artifacts
+STATS_COUNTERS = ['hits', 'misses', 'bytes_served', 'bytes_downloaded', 'download_time', 'hash_time']
+
+# Name of the local cache tier used in statistics
+LOCAL_TIER = 'local'
+
+# Hosts serving artifacts (origins and mirrors) are probed again once their latency
+# measurement is older than this (in seconds), a probe waits at most MIRROR_PROBE_TIMEOUT seconds
+MIRROR_LATENCY_TTL = 86400
+MIRROR_PROBE_TIMEOUT = 5
+
+# Latency recorded for a host which did not respond, and the weight of a new
+# measurement in the moving average of the latency
+MIRROR_FAILED_LATENCY = 60.0
+MIRROR_LATENCY_WEIGHT = 0.3
+
+MATERIALIZE_HARDLINK = 'hardlink'
+MATERIALIZE_REFLINK = 'reflink'
+MATERIALIZE_COPY = 'copy'
+
+# Materialization strategies, if a strategy is not supported the next one is used
+MATERIALIZE_STRATEGIES = [MATERIALIZE_HARDLINK, MATERIALIZE_REFLINK, MATERIALIZE_COPY]
+
+
+def _file_identity(path):
+    """
+    Returns a tuple identifying the content of the file without reading it:
+    inode, size and modification time in nanoseconds.
+    """
+
+    stat = os.stat(path)
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+
+    if mtime_ns is None:
+        # Python 2
+        mtime_ns = int(stat.st_mtime * 1000000000)
+
+    return stat.st_ino, stat.st_size, mtime_ns
+
+
+class _NoLock(object):
+    """ Context manager used in place of a lock where locking is not needed """
+
+    def __enter__(self):
+        return True
+
+    def __exit__(self, etype, value, traceback):
+        pass
+
 
 class ArtifactCache:
     """
     Represents Artifact cache for cekit. All cached resource are saved into cache subdirectory
-    of a Cekit 'work_dir'. All files are stored by random generated uuid with an yaml file
-    indexing it.
+    of a Cekit 'work_dir'. All files are indexed in the cache index database (see CacheIndex).
+
+    Depending on the 'cache_layout' configuration option, files are stored either by random
+    generated uuid ('uuid' layout, default) or by their content ('content' layout). In the latter
+    case every file is stored as a blob named after its sha256 checksum:
+
+        cache/blobs/sha256/ab/abcdef...
+
+    and for every other supported algorithm there is an alias (symlink) pointing to the blob:
+
+        cache/blobs/md5/12/1234...
     """
 
+    # Statistics collected for the build report, shared by all instances
+    _report = {}
+    _report_lock = threading.Lock()
+
     def __init__(self):
         self.cache_dir = os.path.expanduser(
             os.path.join(CONFIG.get('common', 'work_dir'), 'cache'))
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
+        self._index = None
+        self.layout = CONFIG.get('common', 'cache_layout') or LAYOUT_UUID
+
+        if self.layout not in [LAYOUT_UUID, LAYOUT_CONTENT]:
+            raise CekitError("Unsupported artifact cache layout: '{}', supported layouts: {}".format(
+                self.layout, ", ".join([LAYOUT_UUID, LAYOUT_CONTENT])))
 
-    def _get_cache(self):
-        cache = {}
-        for index_file in glob.glob(os.path.join(self.cache_dir, '*.yaml')):
-            with open(index_file, 'r') as file_:
-                cache[os.path.basename(index_file)] = yaml.safe_load(file_)
+        self.materialization = CONFIG.get('common', 'cache_materialize') or MATERIALIZE_REFLINK
 
-        return cache
+        if self.materialization not in MATERIALIZE_STRATEGIES:
+            raise CekitError("Unsupported artifact materialization strategy: '{}', supported strategies: {}".format(
+                self.materialization, ", ".join(MATERIALIZE_STRATEGIES)))
 
-    def _update_cache(self, cache_entry, artifact_id):
-        index_file = os.path.join(self.cache_dir, artifact_id + '.yaml')
-        tmp_cache_file = index_file + str(os.getpid())
-        with open(tmp_cache_file, 'w') as file_:
-            yaml.safe_dump(cache_entry, file_)
-            os.rename(tmp_cache_file, index_file)
+        self.tiers = create_tiers(CONFIG.get('common', 'cache_tiers'))
+
+    @property
+    def index(self):
+        """
+        Cache index, opened lazily, so that creating the cache object is cheap.
+        """
+        if not self._index:
+            self._index = CacheIndex(self.cache_dir)
+        return self._index
 
     def list(self):
-        return self._get_cache()
+        return self.index.list()
+
+    def _lock_file(self, algorithm, checksum):
+        return os.path.join(self.cache_dir, 'locks', "{}-{}.lock".format(algorithm, checksum.lower()))
+
+    def lock(self, artifact):
+        """
+        Returns a context manager holding an exclusive lock for the provided artifact.
+
+        Only one process (or thread) at a time can hold the lock for the same artifact,
+        others wait until the lock is released. This makes sure that the same artifact
+        is not fetched into the cache multiple times at the same time.
+
+        Artifact is identified by the first supported checksum it defines. If it does not
+        define any, locking is not needed, because such artifact is never cached.
+        """
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            if artifact.get(alg):
+                return FileLock(self._lock_file(alg, artifact[alg]),
+                                description="artifact '{}'".format(artifact['name']))
+
+        return _NoLock()
 
     def add(self, artifact):
         if not set(SUPPORTED_HASH_ALGORITHMS).intersection(artifact):
             raise ValueError('Cannot cache artifact without checksum')
 
-        if self.cached(artifact):
-            raise CekitError('Artifact is already cached!')
+        with self.lock(artifact):
+            if self.cached(artifact):
+                raise CekitError('Artifact is already cached!')
 
+            return self._add(artifact)
+
+    def _add(self, artifact):
         artifact_id = str(uuid.uuid4())
 
         artifact_file = os.path.expanduser(os.path.join(self.cache_dir, artifact_id))
+        missed_tiers = []
+        known_sums = None
+
         if not os.path.exists(artifact_file):
-            artifact.guarded_copy(artifact_file)
+            # Download to a staging file first, so that incomplete
+            # files never appear under the final name
+            staging_file = self.partial_path(artifact)
+
+            try:
+                missed_tiers = self._fetch_from_tiers(artifact, staging_file)
+
+                if missed_tiers == self.tiers:
+                    artifact.guarded_copy(staging_file)
+
+                # Checksums were usually computed while the artifact was fetched
+                known_sums = self.known_sums(staging_file)
+
+                os.rename(staging_file, artifact_file)
+                self.discard_partial(staging_file)
+            finally:
+                # Interrupted downloads which can be resumed later are kept
+                if os.path.isdir(staging_file):
+                    shutil.rmtree(staging_file)
+                elif os.path.exists(staging_file) and not self.load_partial(staging_file):
+                    os.remove(staging_file)
+                    self.discard_partial(staging_file)
 
         cache_entry = {'names': [artifact['name']],
                        'cached_path': artifact_file}
 
         # We should populate the cache entry with checksums for all supported algorithms
-        for alg in SUPPORTED_HASH_ALGORITHMS:
-            cache_entry.update({alg: get_sum(artifact_file, alg)})
+        if known_sums:
+            cache_entry.update(known_sums)
+        else:
+            start = time.time()
+            cache_entry.update(get_sums(artifact_file, SUPPORTED_HASH_ALGORITHMS))
+            self.record(artifact['name'], hash_time=time.time() - start)
+
+        if CONFIG.get('common', 'cache_publish'):
+            self._publish_to_tiers(artifact_file, cache_entry, missed_tiers)
+
+        # The same content could be already cached under a different checksum or name,
+        # we do not want to store it twice
+        existing_id, existing_entry = self.index.find('sha256', cache_entry['sha256'])
+
+        if existing_entry and os.path.exists(existing_entry['cached_path']):
+            logger.debug("Content of artifact '{}' is already cached with UUID '{}'".format(
+                artifact['name'], existing_id))
+
+            os.remove(artifact_file)
+
+            if artifact['name'] not in existing_entry['names']:
+                existing_entry['names'].append(artifact['name'])
+                self.index.add(existing_id, existing_entry)
+
+            return existing_id
+
+        if self.layout == LAYOUT_CONTENT:
+            cache_entry['cached_path'] = self._store_blob(artifact_file, cache_entry)
+
+        self.index.add(artifact_id, cache_entry)
+
+        max_size = CONFIG.get('common', 'cache_max_size')
+        max_age = CONFIG.get('common', 'cache_max_age')
+
+        if max_size or max_age:
+            self.gc(max_size=parse_size(max_size) if max_size else None,
+                    max_age=parse_duration(max_age) if max_age else None,
+                    keep=[artifact_id])
 
-        self._update_cache(cache_entry, artifact_id)
         return artifact_id
 
-    def delete(self, artifact_uuid):
-        # check if artifact exists
-        self._get_cache()
-        os.remove(os.path.join(self.cache_dir, artifact_uuid))
-        os.remove(os.path.join(self.cache_dir, artifact_uuid + '.yaml'))
+    def _fetch_from_tiers(self, artifact, destination):
+        """
+        Tries to fetch the artifact from cache tiers, in the configured order. Artifacts fetched
+        from a tier are verified, an artifact with mismatching checksum is treated as a miss.
+
+        Returns list of tiers which did not contain the artifact. If it is the list of all tiers,
+        the artifact was not fetched and needs to be fetched from its origin.
+        """
+
+        checksums = dict((alg, artifact[alg]) for alg in SUPPORTED_HASH_ALGORITHMS if artifact.get(alg))
+
+        # Tiers do not write to the destination directly, it could contain a partial download
+        tier_file = destination + '.tier'
+
+        for i, tier in enumerate(self.tiers):
+            try:
+                start = time.time()
+                hit = tier.fetch(checksums, tier_file)
+
+                if hit:
+                    self.record(artifact['name'], downloaded=os.path.getsize(tier_file),
+                                download_time=time.time() - start)
+
+                    # All checksums are computed, so that the file is not read again when it is cached
+                    start = time.time()
+                    sums = get_sums(tier_file, SUPPORTED_HASH_ALGORITHMS)
+                    hit = all(sums[alg] == checksum.lower() for alg, checksum in checksums.items())
+                    self.record(artifact['name'], hash_time=time.time() - start)
+
+                    if not hit:
+                        logger.warning("Artifact '{}' fetched from '{}' cache tier has a wrong checksum".format(
+                            artifact['name'], tier))
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.warning("Could not fetch artifact '{}' from '{}' cache tier: {}".format(
+                    artifact['name'], tier, ex))
+                hit = False
+
+            self.index.record_tier_lookup(str(tier), hit)
+
+            if not hit and os.path.exists(tier_file):
+                os.remove(tier_file)
+
+            if hit:
+                os.rename(tier_file, destination)
+                self.mark_verified(destination, sums)
+                logger.info("Artifact '{}' fetched from '{}' cache tier".format(artifact['name'], tier))
+                return self.tiers[:i]
+
+        return self.tiers
+
+    def partial_path(self, artifact):
+        """
+        Returns path of the staging file the artifact is fetched to before it is added
+        to the cache. The path depends only on the artifact checksum, so that an interrupted
+        download can be resumed by a retry or by a later run.
+        """
+
+        partial_dir = os.path.join(self.cache_dir, PARTIAL_DIR)
+
+        try:
+            os.makedirs(partial_dir)
+        except OSError:
+            if not os.path.isdir(partial_dir):
+                raise
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            if artifact.get(alg):
+                return os.path.join(partial_dir, "{}-{}".format(alg, artifact[alg].lower()))
+
+        return os.path.join(partial_dir, str(uuid.uuid4()))
+
+    def resumable(self, path):
+        """
+        Returns True if the download to the provided path can be resumed later, which
+        is the case for staging files of artifacts (see partial_path()).
+        """
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(os.path.join(self.cache_dir, PARTIAL_DIR))
+
+    def save_partial(self, path, url, size, validator):
+        """
+        Stores information needed to resume the download of 'url' to the provided path:
+        expected size of the complete file and the validator (ETag or Last-Modified
+        value) used to make sure the remote file did not change in the meantime.
+        """
+
+        with open(path + PARTIAL_STATE_SUFFIX, 'w') as state_file:
+            json.dump({'url': url, 'size': size, 'validator': validator}, state_file)
+
+    def load_partial(self, path, url=None):
+        """
+        Returns information stored with save_partial() if the partially downloaded file
+        exists and (if provided) was downloaded from the same URL, None otherwise.
+        """
+
+        if not os.path.isfile(path) or not os.path.exists(path + PARTIAL_STATE_SUFFIX):
+            return None
+
+        try:
+            with open(path + PARTIAL_STATE_SUFFIX) as state_file:
+                state = json.load(state_file)
+        except ValueError:
+            return None
+
+        if url and state.get('url') != url:
+            return None
+
+        if os.path.getsize(path) >= state.get('size', 0):
+            return None
+
+        return state
+
+    def discard_partial(self, path):
+        """
+        Removes information about partially downloaded file at the provided path.
+        """
+
+        if os.path.exists(path + PARTIAL_STATE_SUFFIX):
+            os.remove(path + PARTIAL_STATE_SUFFIX)
+
+    def _publish_to_tiers(self, artifact_file, checksums, tiers):
+        """
+        Publishes the artifact to provided cache tiers. Failures are not fatal.
+        """
+
+        for tier in tiers:
+            logger.debug("Publishing artifact '{}' to '{}' cache tier".format(artifact_file, tier))
+
+            try:
+                tier.publish(artifact_file, checksums)
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.warning("Could not publish artifact to '{}' cache tier: {}".format(tier, ex))
+
+    def url_path(self, url):
+        """
+        Returns path where the artifact cached by URL is stored, the parent directory is created if needed.
+        """
+        urls_dir = os.path.join(self.cache_dir, 'urls')
+
+        if not os.path.exists(urls_dir):
+            os.makedirs(urls_dir)
+
+        return os.path.join(urls_dir, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def lock_url(self, url):
+        """
+        Returns a context manager holding an exclusive lock for the artifact cached by URL.
+        """
+        return FileLock(self._lock_file('url', hashlib.sha256(url.encode('utf-8')).hexdigest()),
+                        description="artifact '{}'".format(url))
+
+    def get_url(self, url):
+        """
+        Returns the entry (a dictionary with 'cached_path', 'etag' and 'last_modified' keys)
+        for the artifact cached by URL, None if such artifact is not cached.
+        """
+
+        cached_url = self.index.get_url(url)
+
+        if cached_url and os.path.isfile(cached_url['cached_path']):
+            return cached_url
+
+        return None
+
+    def add_url(self, url, path, etag, last_modified):
+        """
+        Moves the file downloaded from the URL into the cache, together with headers
+        needed to revalidate it later. Returns the cache entry.
+        """
+
+        cached_path = self.url_path(url)
+        os.rename(path, cached_path)
+        self.index.add_url(url, cached_path, etag, last_modified)
+
+        return self.get_url(url)
+
+    def get_url_checksums(self, url):
+        """
+        Returns the entry (a dictionary with 'checksums', 'etag' and 'last_modified' keys)
+        with remembered checksums of the file at the URL, None if these are not known.
+        """
+        return self.index.get_url_checksums(url)
+
+    def add_url_checksums(self, url, checksums, etag, last_modified):
+        """
+        Remembers checksums of the file at the URL, together with headers needed to revalidate them.
+        """
+        self.index.add_url_checksums(url, checksums, etag, last_modified)
+
+    def rank_urls(self, urls):
+        """
+        Orders URLs of an artifact (its origin and mirrors) from the fastest host to the slowest
+        one, using the latency history. Hosts without a recent latency measurement are probed
+        with a HEAD request first.
+        """
+
+        latencies = self.index.latencies()
+        now = time.time()
+        stale = [url for url in urls if urlparse(url).scheme in ['http', 'https'] and
+                 now - latencies.get(urlparse(url).netloc, (None, 0))[1] > MIRROR_LATENCY_TTL]
+
+        if stale:
+            pool = ThreadPool(len(stale))
+
+            try:
+                pool.map(self._probe, stale)
+            finally:
+                pool.close()
+                pool.join()
+
+            latencies = self.index.latencies()
+
+        # Sorting is stable, hosts without any measurement keep their order
+        return sorted(urls, key=lambda url: latencies.get(urlparse(url).netloc, (MIRROR_FAILED_LATENCY,))[0])
+
+    def _probe(self, url):
+        logger.debug("Probing latency of '{}'".format(url))
+
+        request = Request(url)
+        request.get_method = lambda: 'HEAD'
+        start = time.time()
+
+        try:
+            urlopen(request, timeout=MIRROR_PROBE_TIMEOUT).close()
+        except HTTPError as ex:
+            # Host responded, but does not have the artifact (or does not support HEAD requests)
+            if ex.code == 404:
+                self.record_latency(url, None)
+                return
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.debug("Host serving '{}' did not respond: {}".format(url, ex))
+            self.record_latency(url, None)
+            return
+
+        self.record_latency(url, time.time() - start)
+
+    def record_latency(self, url, latency):
+        """
+        Records latency (in seconds) of the host serving the URL, None if the host did not respond.
+        """
+
+        self.index.record_latency(urlparse(url).netloc,
+                                  MIRROR_FAILED_LATENCY if latency is None else latency, MIRROR_LATENCY_WEIGHT)
+
+    def brew_urls(self, md5s):
+        """
+        Returns dictionary of Brew download URLs of artifacts with provided md5 checksums
+        (see tools.get_brew_urls()). URLs not known yet are resolved in a single batch and
+        remembered for the time set by the 'brew_url_ttl' configuration option (1 day by default).
+        """
+
+        ttl = parse_duration(CONFIG.get('common', 'brew_url_ttl') or DEFAULT_BREW_URL_TTL)
+        urls = {}
+        unknown = []
+
+        for md5 in md5s:
+            url = self.index.get_brew_url(md5) if ttl else None
+
+            if url:
+                urls[md5] = url
+            elif md5 not in unknown:
+                unknown.append(md5)
+
+        for md5, url in get_brew_urls(unknown).items():
+            urls[md5] = url
+
+            if ttl and not isinstance(url, CekitError):
+                self.index.add_brew_url(md5, url, ttl)
+
+        return urls
+
+    def brew_url(self, md5):
+        """
+        Returns Brew download URL of the artifact with provided md5 checksum, see brew_urls().
+        """
+
+        url = self.brew_urls([md5])[md5]
+
+        if isinstance(url, CekitError):
+            raise url
+
+        return url
+
+    def known_miss(self, source, checksum):
+        """
+        Returns True if the artifact identified by the checksum was recently not found
+        in the source (for example cacher or Brew), so it is not worth to try it again.
+        """
+        if not checksum:
+            return False
+
+        return self.index.is_miss(source, checksum)
+
+    def record_miss(self, source, checksum):
+        """
+        Records that the artifact identified by the checksum was not found in the source. The record
+        expires after time set by the 'cache_negative_ttl' configuration option (1 hour by default).
+        """
+        ttl = parse_duration(CONFIG.get('common', 'cache_negative_ttl') or DEFAULT_NEGATIVE_TTL)
+
+        if not checksum or not ttl:
+            return
+
+        logger.debug("Recording that artifact '{}' was not found in '{}' for {} second(s)".format(
+            checksum, source, ttl))
+        self.index.add_miss(source, checksum, ttl)
+
+    def flush_misses(self):
+        """
+        Forgets all recorded misses, returns number of removed records.
+        """
+        return self.index.flush_misses()
+
+    def record(self, name, hit=None, served=0, downloaded=0, download_time=0.0, hash_time=0.0):
+        """
+        Records statistics for the artifact with the provided name:
+
+            hit: True if the artifact was found in the local cache, False if not,
+                 None if the record is not related to a cache lookup,
+            served: number of bytes served from the local cache,
+            downloaded: number of bytes downloaded (from origin or a cache tier),
+            download_time: time spent downloading, in seconds,
+            hash_time: time spent computing checksums, in seconds.
+
+        Statistics are persisted in the cache index and collected in the build report too.
+        """
+
+        values = {'hits': 1 if hit else 0,
+                  'misses': 1 if hit is False else 0,
+                  'bytes_served': served,
+                  'bytes_downloaded': downloaded,
+                  'download_time': download_time,
+                  'hash_time': hash_time}
+
+        if hit is not None:
+            self.index.record_tier_lookup(LOCAL_TIER, hit)
+
+        self.index.record_artifact_stats(name, values)
+
+        with ArtifactCache._report_lock:
+            report = ArtifactCache._report.setdefault(name, dict((key, 0) for key in STATS_COUNTERS))
+
+            for key, value in values.items():
+                report[key] += value
+
+    @staticmethod
+    def reset_report():
+        """
+        Starts collecting statistics for a new build report.
+        """
+        with ArtifactCache._report_lock:
+            ArtifactCache._report = {}
+
+    @staticmethod
+    def write_report(path):
+        """
+        Writes statistics collected since the last reset_report() call into a JSON file.
+        """
+
+        with ArtifactCache._report_lock:
+            artifacts = dict((name, dict(values)) for name, values in ArtifactCache._report.items())
+
+        totals = dict((key, sum(values[key] for values in artifacts.values())) for key in STATS_COUNTERS)
+
+        with open(path, 'w') as report_file:
+            json.dump({'totals': totals, 'artifacts': artifacts}, report_file, indent=2, sort_keys=True)
+
+    def stats(self):
+        """
+        Returns dictionary of persisted statistics for every artifact name (see record()).
+        """
+        return self.index.artifact_stats()
+
+    def tier_stats(self):
+        """
+        Returns list of (tier, hits, misses) tuples for the local cache and all configured tiers.
+        """
+
+        stats = self.index.tier_stats()
+
+        return [(tier,) + stats.get(tier, (0, 0)) for tier in [LOCAL_TIER] + [str(t) for t in self.tiers]]
+
+    def gc(self, max_size=None, max_age=None, keep=None, dry_run=False):
+        """
+        Evicts artifacts from the cache. First, all artifacts not accessed for more than max_age
+        seconds are removed. Afterwards, least recently used artifacts are removed until
+        the total size of the cache is lower or equal to max_size bytes.
+
+        Artifacts cached by URL are evicted the same way, these are identified by their URL.
+        Mirrors and snapshots of Git repositories (see RepositoryCache) too, these are identified
+        by their path relative to the cache directory, for example 'git/snapshots/<commit>'.
+
+        Staging files of downloads which did not progress for STALE_FILE_AGE seconds
+        and lock files which are not held are removed too.
+
+        Artifacts with ids listed in the keep list are never removed.
+
+        Returns list of (artifact id, size) tuples of evicted artifacts.
+        """
+
+        keep = keep or []
+        usage = []
+
+        for artifact_id, cached_path, size, last_access in self.index.usage():
+            if size is None:
+                if not os.path.exists(cached_path):
+                    # The file is gone, nothing to keep in the index
+                    size = 0
+                else:
+                    size = os.path.getsize(cached_path)
+
+            usage.append((artifact_id, size, last_access, self._evict))
+
+        for url, cached_path, last_access in self.index.url_usage():
+            size = os.path.getsize(cached_path) if os.path.exists(cached_path) else 0
+            usage.append((url, size, last_access, self._evict_url))
+
+        repositories = RepositoryCache()
+
+        for path, size, last_access in repositories.usage():
+            entry_id = os.path.relpath(path, self.cache_dir).replace(os.sep, '/')
+            usage.append((entry_id, size, last_access, lambda _, path=path: repositories.evict(path)))
+
+        usage.sort(key=lambda entry: entry[2])
+
+        evicted = []
+        total_size = sum(entry[1] for entry in usage)
+
+        for artifact_id, size, last_access, evict in usage:
+            if artifact_id in keep:
+                continue
+
+            expired = max_age is not None and last_access < time.time() - max_age
+            oversized = max_size is not None and total_size > max_size
+
+            if not expired and not oversized:
+                continue
+
+            if not dry_run and not evict(artifact_id):
+                logger.debug("Artifact '{}' is currently in use, it will not be evicted".format(artifact_id))
+                continue
+
+            logger.debug("Evicted artifact '{}' ({} bytes) from cache".format(artifact_id, size))
+
+            evicted.append((artifact_id, size))
+            total_size -= size
+
+        if not dry_run:
+            self._remove_stale_files()
+
+        return evicted
+
+    def _evict_url(self, url):
+        """
+        Removes the artifact cached by URL, but only if it is not used at the moment.
+        Returns True if the artifact was removed.
+        """
+
+        lock = FileLock(self._lock_file('url', hashlib.sha256(url.encode('utf-8')).hexdigest()), blocking=False)
+
+        if not lock.__enter__():
+            return False
+
+        try:
+            cached_url = self.index.get_url(url)
+            self.index.delete_url(url)
+
+            if cached_url and os.path.exists(cached_url['cached_path']):
+                os.remove(cached_url['cached_path'])
+        finally:
+            lock.__exit__(None, None, None)
+
+        return True
+
+    def _remove_stale_files(self):
+        """
+        Removes staging files of interrupted downloads (these could be resumed, but did not
+        progress for STALE_FILE_AGE seconds) and lock files which are not held by anybody.
+        """
+
+        stale = time.time() - STALE_FILE_AGE
+        staging_files = []
+
+        # Staging files are named after the artifact (its checksum or URL hash),
+        # the lock of the artifact is held while these are used
+        partial_dir = os.path.join(self.cache_dir, PARTIAL_DIR)
+
+        if os.path.isdir(partial_dir):
+            for name in os.listdir(partial_dir):
+                staging_files.append((os.path.join(partial_dir, name),
+                                      "{}.lock".format(name.split('.', 1)[0])))
+
+        urls_dir = os.path.join(self.cache_dir, 'urls')
+
+        if os.path.isdir(urls_dir):
+            for name in os.listdir(urls_dir):
+                if name.endswith('.part'):
+                    staging_files.append((os.path.join(urls_dir, name),
+                                          "url-{}.lock".format(name[:-len('.part')])))
+
+        for path, lock_name in staging_files:
+            try:
+                if os.path.getmtime(path) >= stale:
+                    continue
+            except OSError:
+                # Removed concurrently
+                continue
+
+            lock = FileLock(os.path.join(self.cache_dir, 'locks', lock_name), blocking=False)
+
+            if not lock.__enter__():
+                continue
+
+            try:
+                logger.debug("Removing stale staging file '{}'".format(path))
+
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            finally:
+                lock.__exit__(None, None, None)
+
+        locks_dir = os.path.join(self.cache_dir, 'locks')
+
+        if not os.path.isdir(locks_dir):
+            return
+
+        for name in os.listdir(locks_dir):
+            lock = FileLock(os.path.join(locks_dir, name), blocking=False)
+
+            if lock.__enter__():
+                try:
+                    lock.remove()
+                finally:
+                    lock.__exit__(None, None, None)
+
+    def _evict(self, artifact_id, quarantine=False):
+        """
+        Removes the artifact from the cache, but only if it is not used at the moment
+        (none of the artifact locks is held). Returns True if the artifact was removed.
+
+        If quarantine is True, the cached file is moved to the quarantine directory instead.
+        """
+
+        cache_entry = self.index.get(artifact_id)
+
+        if not cache_entry:
+            return False
+
+        locks = []
+
+        try:
+            for alg in SUPPORTED_HASH_ALGORITHMS:
+                if cache_entry.get(alg):
+                    lock = FileLock(self._lock_file(alg, cache_entry[alg]), blocking=False)
+
+                    if not lock.__enter__():
+                        return False
+
+                    locks.append(lock)
+
+            self.delete(artifact_id, quarantine=quarantine)
+        finally:
+            for lock in reversed(locks):
+                lock.__exit__(None, None, None)
+
+        return True
+
+    def _blob_path(self, algorithm, checksum):
+        checksum = checksum.lower()
+        return os.path.join(self.cache_dir, 'blobs', algorithm, checksum[:2], checksum)
+
+    def _store_blob(self, artifact_file, cache_entry):
+        """
+        Moves the artifact file into the content addressed storage and creates
+        aliases for all checksums other than sha256. Returns path to the blob.
+        """
+
+        blob_path = self._blob_path('sha256', cache_entry['sha256'])
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            path = self._blob_path(alg, cache_entry[alg])
+
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(path)):
+                    raise
+
+            if alg == 'sha256':
+                os.rename(artifact_file, path)
+                continue
+
+            try:
+                os.symlink(os.path.relpath(blob_path, os.path.dirname(path)), path)
+            except OSError:
+                # Alias could be created already by other process
+                if not os.path.lexists(path):
+                    raise
+
+        return blob_path
+
+    def delete(self, artifact_uuid, quarantine=False):
+        cache_entry = self.index.get(artifact_uuid)
+
+        if not cache_entry:
+            raise CekitError("Artifact with UUID '{}' is not cached.".format(artifact_uuid))
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            if alg == 'sha256' or not cache_entry.get(alg):
+                continue
+
+            alias = self._blob_path(alg, cache_entry[alg])
+
+            if os.path.islink(alias):
+                os.remove(alias)
+
+        if os.path.exists(cache_entry['cached_path']):
+            if quarantine:
+                quarantine_dir = os.path.join(self.cache_dir, 'quarantine')
+
+                if not os.path.exists(quarantine_dir):
+                    os.makedirs(quarantine_dir)
+
+                logger.warning("Moving artifact with UUID '{}' to '{}' quarantine directory".format(
+                    artifact_uuid, quarantine_dir))
+                os.rename(cache_entry['cached_path'], os.path.join(quarantine_dir, artifact_uuid))
+            else:
+                os.remove(cache_entry['cached_path'])
+
+        self.index.delete(artifact_uuid)
+
+    def verify(self, jobs=1, resume=False):
+        """
+        Verifies integrity of all cached artifacts by computing their checksums
+        again, using 'jobs' threads. Artifacts with checksums that do not match
+        are moved to the quarantine directory, entries of artifacts which files
+        are missing are removed from the index.
+
+        Progress is recorded in the index, if resume is True, artifacts verified
+        by a previous (interrupted) run are skipped.
+
+        Yields (artifact id, status) tuples, where status is one of VERIFY_* values.
+        """
+
+        if not resume:
+            self.index.clear_checkpoint()
+
+        checkpoint = self.index.checkpoint()
+        artifact_ids = [artifact_id for artifact_id in self.index.list() if artifact_id not in checkpoint]
+
+        if checkpoint:
+            logger.info("Resuming verification, {} artifact(s) already verified".format(len(checkpoint)))
+
+        pool = ThreadPool(jobs)
+
+        try:
+            for artifact_id, status in pool.imap_unordered(self._verify_artifact, artifact_ids):
+                self.index.add_checkpoint(artifact_id, status)
+                yield artifact_id, status
+        finally:
+            # When interrupted, artifacts not verified yet are left for the next run
+            pool.terminate()
+            pool.join()
+
+        # Finished, next run starts from the beginning
+        self.index.clear_checkpoint()
+
+    def _verify_artifact(self, artifact_id):
+        cache_entry = self.index.get(artifact_id)
+
+        if not cache_entry:
+            # Removed in the meantime
+            return artifact_id, VERIFY_OK
+
+        cached_path = cache_entry['cached_path']
+
+        if not os.path.isfile(cached_path):
+            logger.warning("File '{}' of cached artifact with UUID '{}' is missing".format(cached_path, artifact_id))
+            status = VERIFY_MISSING
+        else:
+            expected = dict((alg, cache_entry[alg]) for alg in SUPPORTED_HASH_ALGORITHMS if cache_entry.get(alg))
+
+            if check_sums(cached_path, expected, artifact_id):
+                return artifact_id, VERIFY_OK
+
+            status = VERIFY_CORRUPTED
+
+        if not self._evict(artifact_id, quarantine=status == VERIFY_CORRUPTED):
+            logger.warning("Cached artifact with UUID '{}' is in use, it will be removed later".format(artifact_id))
+            return artifact_id, VERIFY_BUSY
+
+        return artifact_id, status
+
+    def verified(self, path, checksums):
+        """
+        Returns True if all provided checksums (a dictionary keyed by algorithm)
+        were already verified for the file at the provided path and the file did not change since.
+        """
+
+        path = os.path.abspath(path)
+
+        try:
+            identity = _file_identity(path)
+        except OSError:
+            return False
+
+        verified = self.index.get_verified(path, identity)
+
+        return bool(verified) and all(verified.get(alg) == checksum.lower() for alg, checksum in checksums.items())
+
+    def mark_verified(self, path, checksums):
+        """
+        Records that provided checksums (a dictionary keyed by algorithm) were
+        successfully verified for the file at the provided path.
+        """
+
+        path = os.path.abspath(path)
+
+        try:
+            identity = _file_identity(path)
+        except OSError:
+            logger.debug("Could not record verified checksums for '{}', file is not available".format(path))
+            return
+
+        # Keep checksums verified previously, if the file did not change
+        verified = self.index.get_verified(path, identity)
+        verified.update(dict((alg, checksum.lower()) for alg, checksum in checksums.items()))
+
+        self.index.set_verified(path, identity, verified)
+
+    def known_sums(self, path):
+        """
+        Returns dictionary of checksums for all supported algorithms recorded for the file
+        at the provided path (see mark_verified()), if the file did not change since.
+        None otherwise.
+        """
+
+        path = os.path.abspath(path)
+
+        try:
+            identity = _file_identity(path)
+        except OSError:
+            return None
+
+        verified = self.index.get_verified(path, identity)
+
+        if not all(verified.get(alg) for alg in SUPPORTED_HASH_ALGORITHMS):
+            return None
+
+        return dict((alg, verified[alg]) for alg in SUPPORTED_HASH_ALGORITHMS)
+
+    def materialize(self, cached_path, target):
+        """
+        Makes the cached artifact available at the target path using the materialization
+        strategy selected with the 'cache_materialize' configuration option:
+
+            hardlink: target is a hard link to the cached file,
+            reflink: target is a copy-on-write clone of the cached file,
+            copy: content of the cached file is copied to the target.
+
+        If the filesystem does not support the selected strategy (for example the target
+        is located on a different filesystem), the next one from the list above is used.
+        """
+
+        # Never write into an existing file, it could be a link to the cached file
+        if os.path.lexists(target):
+            os.remove(target)
+
+        strategies = MATERIALIZE_STRATEGIES[MATERIALIZE_STRATEGIES.index(self.materialization):]
+
+        for strategy in strategies:
+            try:
+                if strategy == MATERIALIZE_HARDLINK:
+                    os.link(cached_path, target)
+                elif strategy == MATERIALIZE_REFLINK:
+                    reflink(cached_path, target)
+                else:
+                    shutil.copy(cached_path, target)
+            except (IOError, OSError) as ex:
+                if strategy == MATERIALIZE_COPY:
+                    raise
+
+                logger.debug("Could not {} '{}' to '{}', falling back to the next strategy: {}".format(
+                    strategy, cached_path, target, ex))
+                continue
+
+            logger.debug("Artifact '{}' materialized at '{}' using {} strategy".format(
+                cached_path, target, strategy))
+            return strategy
+
+    def export_bundle(self, artifacts, output):
+        """
+        Writes cached content of provided artifacts, together with their cache entries, into
+        a tar archive (bundle) at the output path. Every content is stored only once, the archive
+        is written as a stream, so it can be written to a pipe too.
+
+        Returns tuple of the number of exported artifacts and list of artifacts which are not cached.
+        """
+
+        entries = {}
+        missing = []
+
+        for artifact in artifacts:
+            artifact_id, cache_entry = None, None
+
+            for alg in SUPPORTED_HASH_ALGORITHMS:
+                if artifact.get(alg):
+                    artifact_id, cache_entry = self.index.find(alg, artifact[alg])
+                    break
+
+            if not cache_entry or not os.path.isfile(cache_entry['cached_path']):
+                missing.append(artifact)
+                continue
+
+            entries[artifact_id] = cache_entry
+
+        if missing:
+            return 0, missing
+
+        blobs = {}
+
+        for cache_entry in entries.values():
+            if cache_entry['sha256'] in blobs:
+                blobs[cache_entry['sha256']]['names'].extend(
+                    name for name in cache_entry['names'] if name not in blobs[cache_entry['sha256']]['names'])
+            else:
+                blobs[cache_entry['sha256']] = cache_entry
+
+        index = json.dumps({'version': BUNDLE_VERSION,
+                            'artifacts': [dict((key, value) for key, value in cache_entry.items()
+                                               if key != 'cached_path') for cache_entry in blobs.values()]},
+                           indent=2, sort_keys=True).encode('utf-8')
+
+        with tarfile.open(output, 'w|') as tar:
+            # Index goes first, so that the import can process blobs as they come
+            info = tarfile.TarInfo(BUNDLE_INDEX)
+            info.size = len(index)
+            info.mtime = time.time()
+            tar.addfile(info, io.BytesIO(index))
+
+            for checksum, cache_entry in blobs.items():
+                logger.debug("Exporting artifact '{}'".format(cache_entry['cached_path']))
+                tar.add(cache_entry['cached_path'], arcname=os.path.join('blobs', checksum))
+
+        return len(blobs), []
+
+    def import_bundle(self, bundle):
+        """
+        Imports artifacts from the bundle created by export_bundle(). Bundle can be
+        a tar archive or a directory with an extracted archive. In the latter case
+        files are hard linked into the cache if possible.
+
+        Yields (artifact id, names, imported) tuples, imported is False for artifacts
+        which content was already cached.
+        """
+
+        if os.path.isdir(bundle):
+            with open(os.path.join(bundle, BUNDLE_INDEX), 'r') as index_file:
+                entries = self._bundle_entries(json.load(index_file))
+
+            for checksum, entry in entries.items():
+                path = os.path.join(bundle, 'blobs', checksum)
+                yield self._import(entry, lambda staging_file, path=path: self._link_or_copy(path, staging_file))
+
+            return
+
+        with tarfile.open(bundle, 'r|*') as tar:
+            entries = None
+
+            for member in tar:
+                if member.name == BUNDLE_INDEX:
+                    entries = self._bundle_entries(json.loads(tar.extractfile(member).read().decode('utf-8')))
+                    continue
+
+                if entries is None:
+                    raise CekitError("Invalid bundle '{}', the index must be the first file".format(bundle))
+
+                entry = entries.get(os.path.basename(member.name))
+
+                if not member.isfile() or not entry:
+                    logger.warning("Skipping unexpected '{}' file in bundle".format(member.name))
+                    continue
+
+                def extract(staging_file, member=member):
+                    with open(staging_file, 'wb') as target:
+                        shutil.copyfileobj(tar.extractfile(member), target, BUFFER_SIZE)
+
+                yield self._import(entry, extract)
+
+    @staticmethod
+    def _bundle_entries(index):
+        if not isinstance(index, dict) or index.get('version') != BUNDLE_VERSION:
+            raise CekitError("Unsupported bundle format")
+
+        return dict((entry['sha256'], entry) for entry in index['artifacts'])
+
+    @staticmethod
+    def _link_or_copy(source, destination):
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copy(source, destination)
+
+    def _import(self, entry, write):
+        """
+        Adds the artifact described by the bundle entry to the cache. Content is written
+        to the provided path by the write function. Checksums of the content are verified.
+        """
+
+        with FileLock(self._lock_file('sha256', entry['sha256'])):
+            existing_id, existing_entry = self.index.find('sha256', entry['sha256'])
+
+            if existing_entry and os.path.exists(existing_entry['cached_path']):
+                names = [name for name in entry['names'] if name not in existing_entry['names']]
+
+                if names:
+                    existing_entry['names'].extend(names)
+                    self.index.add(existing_id, existing_entry)
+
+                return existing_id, existing_entry['names'], False
+
+            artifact_id = str(uuid.uuid4())
+            artifact_file = os.path.join(self.cache_dir, artifact_id)
+            staging_file = artifact_file + '.part'
+
+            try:
+                write(staging_file)
+                checksums = get_sums(staging_file, SUPPORTED_HASH_ALGORITHMS)
+
+                for alg, checksum in checksums.items():
+                    if entry.get(alg) and entry[alg].lower() != checksum:
+                        raise CekitError("Content of artifact '{}' in bundle does not match its {} checksum".format(
+                            entry['sha256'], alg))
+
+                os.rename(staging_file, artifact_file)
+            finally:
+                if os.path.exists(staging_file):
+                    os.remove(staging_file)
+
+            cache_entry = {'names': entry['names'], 'cached_path': artifact_file}
+            cache_entry.update(checksums)
+
+            if self.layout == LAYOUT_CONTENT:
+                cache_entry['cached_path'] = self._store_blob(artifact_file, cache_entry)
+
+            self.index.add(artifact_id, cache_entry)
+
+            return artifact_id, entry['names'], True
 
     def get(self, artifact):
         for alg in SUPPORTED_HASH_ALGORITHMS:
             if alg in artifact:
+                if self.layout == LAYOUT_CONTENT:
+                    # Content addressed blobs can be found without looking into the index.
+                    # Only the path and the requested checksum are returned in such case.
+                    path = self._blob_path(alg, artifact[alg])
+
+                    if os.path.exists(path):
+                        # Aliases point to the blob named after its sha256 checksum, the blob path
+                        # is built the same way as when it was stored, so that it matches the index
+                        cached_path = self._blob_path('sha256', os.path.basename(os.path.realpath(path)))
+                        self.index.touch(cached_path)
+                        return {'cached_path': cached_path, alg: artifact[alg]}
+
                 return self._find_artifact(alg, artifact[alg])
         raise CekitError('Artifact is not cached.')
 
     def _find_artifact(self, alg, chksum):
-        cache = self._get_cache()
-        for _, artifact in cache.items():
-            if alg in artifact and artifact[alg] == chksum:
-                return artifact
+        _, artifact = self.index.find(alg, chksum)
+
+        if artifact:
+            self.index.touch(artifact['cached_path'])
+            return artifact
 
         raise CekitError('Artifact is not cached.')
 
+    def touch(self, artifact):
+        """
+        Records use of the artifact (identified by its first supported checksum) without
+        accessing the cached file, for example when a copy of it made earlier is reused.
+        """
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            if artifact.get(alg):
+                self.index.touch_checksum(alg, artifact[alg])
+                return
+
     def cached(self, artifact):
         try:
             return self.get(artifact)
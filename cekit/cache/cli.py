@@ -1,15 +1,23 @@
 import logging
+import os
 import shutil
 import sys
+import tarfile
+import tempfile
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 import click
+import yaml
 
-from cekit.cache.artifact import ArtifactCache
+from cekit.cache.artifact import ArtifactCache, VERIFY_BUSY, VERIFY_CORRUPTED, VERIFY_MISSING, VERIFY_OK
+from cekit.cache.repository import RepositoryCache
 from cekit.config import Config
 from cekit.crypto import SUPPORTED_HASH_ALGORITHMS
 from cekit.descriptor.resource import create_resource
+from cekit.errors import CekitError
 from cekit.log import setup_logging
-from cekit.tools import Map
+from cekit.tools import Map, parse_duration, parse_size
 from cekit.version import __version__
 
 setup_logging()
@@ -32,18 +40,71 @@ def ls():
 
 
 @cli.command(name="add", short_help="Add artifact to cache")
-@click.argument('location', metavar="LOCATION")
+@click.argument('location', metavar="LOCATION", required=False)
 @click.option('--md5', metavar="CHECKSUM", help="The md5 checksum of the artifact.")
 @click.option('--sha1', metavar="CHECKSUM", help="The sha1 checksum of the artifact.")
 @click.option('--sha256', metavar="CHECKSUM", help="The sha256 checksum of the artifact.")
 @click.option('--sha512', metavar="CHECKSUM", help="The sha512 checksum of the artifact.")
-def add(location, md5, sha1, sha256, sha512):  # pylint: disable=unused-argument
+@click.option('--manifest', metavar="PATH", help="Path to a YAML file with a list of artifacts to add, in the same format as image 'artifacts'.")
+@click.option('--jobs', metavar="NUM", help="Number of artifacts added in parallel when using --manifest.", type=click.IntRange(min=1), default=4, show_default=True)
+def add(location, md5, sha1, sha256, sha512, manifest, jobs):  # pylint: disable=unused-argument
+    if manifest:
+        if location or md5 or sha1 or sha256 or sha512:
+            raise click.UsageError("LOCATION and checksums cannot be used together with --manifest")
+
+        CacheCli.prepare().add_manifest(manifest, jobs)
+        return
+
+    if not location:
+        raise click.UsageError("Either LOCATION or --manifest must be provided")
+
     if not (md5 or sha1 or sha256 or sha512):
         raise click.UsageError("At least one checksum must be provided")
 
     CacheCli.prepare().add(location, md5, sha1, sha256, sha512)
 
 
+@cli.command(name="prefetch", short_help="Add all artifacts required by an image to cache")
+@click.option('--descriptor', metavar="PATH", help="Path to image descriptor file.", default="image.yaml", show_default=True)
+@click.option('--overrides', metavar="JSON", help="Inline overrides in JSON format.", multiple=True)
+@click.option('--overrides-file', 'overrides', metavar="PATH", help="Path to overrides file in YAML format.", multiple=True)
+@click.option('--jobs', metavar="NUM", help="Number of artifacts added in parallel.", type=click.IntRange(min=1), default=4, show_default=True)
+def prefetch(descriptor, overrides, jobs):
+    CacheCli.prepare().prefetch(descriptor, overrides, jobs)
+
+
+@cli.command(name="verify", short_help="Verify integrity of cached artifacts")
+@click.option('--jobs', metavar="NUM", help="Number of artifacts verified in parallel.", type=click.IntRange(min=1), default=4, show_default=True)
+@click.option('--resume', help="Resume previously interrupted verification.", is_flag=True)
+def verify(jobs, resume):
+    CacheCli.prepare().verify(jobs, resume)
+
+
+@cli.command(name="flush-misses", short_help="Forget artifacts recently not found in cacher or Brew")
+def flush_misses():
+    CacheCli.prepare().flush_misses()
+
+
+@cli.command(name="stats", short_help="Show artifact cache statistics")
+def stats():
+    CacheCli.prepare().stats()
+
+
+@cli.command(name="export", short_help="Export artifacts required by an image to a bundle")
+@click.option('--descriptor', metavar="PATH", help="Path to image descriptor file.", default="image.yaml", show_default=True)
+@click.option('--overrides', metavar="JSON", help="Inline overrides in JSON format.", multiple=True)
+@click.option('--overrides-file', 'overrides', metavar="PATH", help="Path to overrides file in YAML format.", multiple=True)
+@click.option('-o', '--output', metavar="PATH", help="Path to the bundle (tar archive) to create.", required=True)
+def export(descriptor, overrides, output):
+    CacheCli.prepare().export(descriptor, overrides, output)
+
+
+@cli.command(name="import", short_help="Import artifacts from a bundle")
+@click.argument('bundle', metavar="BUNDLE")
+def import_bundle(bundle):
+    CacheCli.prepare().import_bundle(bundle)
+
+
 @cli.command(name="rm", short_help="Remove artifact from cache")
 @click.argument('uuid', metavar="UUID")
 def rm(uuid):
@@ -55,6 +116,14 @@ def clear():
     CacheCli.prepare().clear()
 
 
+@cli.command(name="gc", short_help="Evict least recently used artifacts from the cache")
+@click.option('--max-size', metavar="SIZE", help="Maximum size of the cache, for example: 20G. Defaults to the 'cache_max_size' configuration option.")
+@click.option('--max-age', metavar="AGE", help="Maximum time since the artifact was used, for example: 30d. Defaults to the 'cache_max_age' configuration option.")
+@click.option('--dry-run', help="Do not remove anything, just print artifacts that would be removed.", is_flag=True)
+def gc(max_size, max_age, dry_run):
+    CacheCli.prepare().gc(max_size, max_age, dry_run)
+
+
 class CacheCli:
     @staticmethod
     def prepare():
@@ -91,26 +160,197 @@ class CacheCli:
 
         artifact = create_resource(resource)
 
-        cached = artifact_cache.cached(artifact)
+        # Checking whether the artifact is cached and adding it happens under the artifact
+        # lock, so that concurrent runs adding the same artifact do not fail
+        status, message = self._add_artifact(artifact_cache, artifact, location)
+
+        if status == 'failed':
+            click.secho(message, fg='red')
+            sys.exit(1)
 
-        if cached:
-            click.echo("Artifact {} is already cached!".format(location))
-            sys.exit(0)
+        click.echo(message)
 
+    def add_manifest(self, manifest, jobs):
+        """
+        Adds all artifacts defined in the manifest file to the cache. Artifacts
+        are fetched in parallel, at most 'jobs' at the same time.
+        """
         try:
-            artifact_id = artifact_cache.add(artifact)
-            click.echo("Artifact {} cached with UUID '{}'".format(location, artifact_id))
-        except Exception as ex:  # pylint: disable=broad-except
-            click.secho("Cannot cache artifact {}: {}".format(location, str(ex)), fg='red')
+            with open(manifest, 'r') as file_:
+                descriptors = yaml.safe_load(file_)
+        except (IOError, yaml.YAMLError) as ex:
+            click.secho("Cannot read manifest '{}': {}".format(manifest, ex), fg='red')
+            sys.exit(1)
+
+        # Image descriptor can be used as a manifest too
+        if isinstance(descriptors, dict):
+            descriptors = descriptors.get('artifacts')
+
+        if not isinstance(descriptors, list):
+            click.secho("Manifest '{}' does not contain a list of artifacts".format(manifest), fg='red')
+            sys.exit(1)
+
+        directory = os.path.dirname(os.path.abspath(manifest))
+        artifacts = []
+        failed = 0
+
+        for descriptor in descriptors:
+            try:
+                artifacts.append(create_resource(descriptor, directory=directory))
+            except Exception as ex:  # pylint: disable=broad-except
+                click.secho("Invalid artifact definition {}: {}".format(descriptor, ex), fg='red')
+                failed += 1
+
+        self._add_artifacts(artifacts, jobs, failed)
+
+    def prefetch(self, descriptor, overrides, jobs):
+        """
+        Resolves all artifacts required to build the image (including artifacts
+        of builder images and modules) and adds the ones missing in the cache.
+        Nothing is generated nor built.
+        """
+        with self._resolve_artifacts(descriptor, overrides) as artifacts:
+            self._add_artifacts(artifacts, jobs)
+
+    def export(self, descriptor, overrides, output):
+        """
+        Exports all cached artifacts required to build the image into a bundle.
+        """
+        with self._resolve_artifacts(descriptor, overrides) as artifacts:
+            try:
+                exported, missing = ArtifactCache().export_bundle(artifacts, output)
+            except (CekitError, IOError, OSError) as ex:
+                click.secho("Cannot export artifacts: {}".format(ex), fg='red')
+                sys.exit(1)
+
+        if missing:
+            for artifact in missing:
+                click.secho("Artifact {} is not cached".format(artifact.name), fg='red')
+
+            click.secho("Bundle was not created, use 'cekit-cache prefetch' to add missing artifacts first",
+                        fg='red')
+            sys.exit(1)
+
+        click.echo("{} artifact(s) exported to '{}'".format(exported, output))
+
+    def import_bundle(self, bundle):
+        results = {True: 0, False: 0}
+
+        try:
+            for artifact_id, names, imported in ArtifactCache().import_bundle(bundle):
+                results[imported] += 1
+
+                if imported:
+                    click.echo("Artifact {} imported with UUID '{}'".format(", ".join(names), artifact_id))
+                else:
+                    click.echo("Artifact {} is already cached!".format(", ".join(names)))
+        except (CekitError, IOError, OSError, ValueError, tarfile.TarError) as ex:
+            click.secho("Cannot import bundle '{}': {}".format(bundle, ex), fg='red')
             sys.exit(1)
 
+        click.echo("{} artifact(s) imported, {} already cached".format(results[True], results[False]))
+
+    @staticmethod
+    @contextmanager
+    def _resolve_artifacts(descriptor, overrides):
+        """
+        Context manager providing list of all artifacts defining a checksum, required to build the image.
+
+        Image is resolved in a temporary target directory, module repositories are fetched there.
+        Artifacts defined in modules can point to files in these repositories, so the directory
+        is removed only when leaving the context.
+        """
+        # Import is delayed to keep the cache commands fast
+        from cekit.generator.base import Generator
+
+        target = tempfile.mkdtemp(prefix='cekit-')
+
+        try:
+            try:
+                generator = Generator(descriptor, target, overrides)
+                generator.init()
+            except CekitError as ex:
+                click.secho("Cannot resolve artifacts for image '{}': {}".format(descriptor, ex.message), fg='red')
+                sys.exit(1)
+
+            artifacts = []
+            checksums = set()
+
+            for image in generator.images:
+                for artifact in image.all_artifacts:
+                    if not set(SUPPORTED_HASH_ALGORITHMS).intersection(artifact):
+                        LOGGER.debug("Artifact '{}' does not define any checksum, it cannot be cached".format(
+                            artifact.name))
+                        continue
+
+                    # Same artifact can be used by multiple images
+                    key = tuple((alg, artifact[alg].lower())
+                                for alg in SUPPORTED_HASH_ALGORITHMS if artifact.get(alg))
+
+                    if key not in checksums:
+                        checksums.add(key)
+                        artifacts.append(artifact)
+
+            yield artifacts
+        finally:
+            shutil.rmtree(target, ignore_errors=True)
+
+    def _add_artifacts(self, artifacts, jobs, failed=0):
+        """
+        Adds artifacts to the cache using 'jobs' threads and prints
+        the result for every artifact. Exits with error if any of the artifacts failed.
+        """
+
+        artifact_cache = ArtifactCache()
+        results = {'cached': 0, 'existing': 0, 'failed': failed}
+        pool = ThreadPool(jobs)
+
+        try:
+            for status, message in pool.imap_unordered(
+                    lambda artifact: self._add_artifact(artifact_cache, artifact), artifacts):
+                results[status] += 1
+                click.secho(message, fg='red' if status == 'failed' else None)
+        finally:
+            pool.close()
+            pool.join()
+
+        click.echo("{} artifact(s) cached, {} already cached, {} failed".format(
+            results['cached'], results['existing'], results['failed']))
+
+        if results['failed']:
+            sys.exit(1)
+
+    @staticmethod
+    def _add_artifact(artifact_cache, artifact, label=None):
+        """
+        Adds the artifact to the cache, returns tuple of status ('cached', 'existing'
+        or 'failed') and a message describing the result. The artifact is referred
+        to in the message by the label, its name is used if not provided.
+        """
+
+        label = label or artifact.name
+
+        if not set(SUPPORTED_HASH_ALGORITHMS).intersection(artifact):
+            return 'failed', "Cannot cache artifact {}: at least one checksum must be provided".format(label)
+
+        try:
+            with artifact_cache.lock(artifact):
+                if artifact_cache.cached(artifact):
+                    return 'existing', "Artifact {} is already cached!".format(label)
+
+                artifact_id = artifact_cache.add(artifact)
+        except Exception as ex:  # pylint: disable=broad-except
+            return 'failed', "Cannot cache artifact {}: {}".format(label, ex)
+
+        return 'cached', "Artifact {} cached with UUID '{}'".format(label, artifact_id)
+
     def ls(self):
         artifact_cache = ArtifactCache()
         artifacts = artifact_cache.list()
         if artifacts:
-            for artifact_filename, artifact in artifacts.items():
+            for artifact_id, artifact in artifacts.items():
                 click.echo("\n{}:".format(click.style(
-                    artifact_filename.split('.')[0], fg='green', bold=True)))
+                    artifact_id, fg='green', bold=True)))
                 for alg in SUPPORTED_HASH_ALGORITHMS:
                     if alg in artifact and artifact[alg]:
                         click.echo("  {}: {}".format(click.style(alg, bold=True), artifact[alg]))
@@ -122,6 +362,67 @@ class CacheCli:
         else:
             click.echo('No artifacts cached!')
 
+    def verify(self, jobs, resume):
+        artifact_cache = ArtifactCache()
+        results = {VERIFY_OK: 0, VERIFY_CORRUPTED: 0, VERIFY_MISSING: 0, VERIFY_BUSY: 0}
+
+        for artifact_id, status in artifact_cache.verify(jobs=jobs, resume=resume):
+            results[status] += 1
+
+            if status == VERIFY_CORRUPTED:
+                click.secho("Artifact with UUID '{}' is corrupted, moved to quarantine".format(artifact_id), fg='red')
+            elif status == VERIFY_MISSING:
+                click.secho("Artifact with UUID '{}' is missing, removed from cache".format(artifact_id), fg='red')
+            elif status == VERIFY_BUSY:
+                click.secho("Artifact with UUID '{}' is invalid, but it is in use and cannot be removed".format(
+                    artifact_id), fg='yellow')
+
+        click.echo("{} artifact(s) verified, {} corrupted, {} missing, {} in use".format(
+            sum(results.values()), results[VERIFY_CORRUPTED], results[VERIFY_MISSING], results[VERIFY_BUSY]))
+
+        if results[VERIFY_OK] != sum(results.values()):
+            sys.exit(1)
+
+    def flush_misses(self):
+        artifact_cache = ArtifactCache()
+        click.echo("{} recorded miss(es) removed".format(artifact_cache.flush_misses()))
+
+    def stats(self):
+        artifact_cache = ArtifactCache()
+        artifacts = artifact_cache.stats()
+
+        def total(key):
+            return sum(values[key] for values in artifacts.values())
+
+        click.echo(click.style("Artifacts:", bold=True))
+        click.echo("  {} hit(s), {} miss(es)".format(total('hits'), total('misses')))
+        click.echo("  {} bytes served from cache, {} bytes downloaded".format(
+            total('bytes_served'), total('bytes_downloaded')))
+        click.echo("  {:.2f}s spent downloading, {:.2f}s spent hashing".format(
+            total('download_time'), total('hash_time')))
+
+        click.echo(click.style("Cache tiers:", bold=True))
+
+        for tier, hits, misses in artifact_cache.tier_stats():
+            click.echo("  {}: {} hit(s), {} miss(es)".format(tier, hits, misses))
+
+        repositories = RepositoryCache().usage()
+        snapshots = [path for path, _, _ in repositories if not path.endswith('.git')]
+
+        click.echo(click.style("Git repositories:", bold=True))
+        click.echo("  {} mirror(s), {} snapshot(s), {} bytes".format(
+            len(repositories) - len(snapshots), len(snapshots), sum(size for _, size, _ in repositories)))
+
+        slowest = sorted(artifacts.items(), key=lambda item: item[1]['download_time'] + item[1]['hash_time'],
+                         reverse=True)[:10]
+
+        if slowest:
+            click.echo(click.style("Slowest artifacts:", bold=True))
+
+        for name, values in slowest:
+            click.echo("  {}: {:.2f}s downloading ({} bytes), {:.2f}s hashing".format(
+                name, values['download_time'], values['bytes_downloaded'], values['hash_time']))
+
     def rm(self, uuid):
         artifact_cache = ArtifactCache()
 
@@ -132,6 +433,39 @@ class CacheCli:
             click.secho("Artifact with UUID '{}' doesn't exists in the cache".format(uuid), fg='yellow')
             sys.exit(1)
 
+    def gc(self, max_size, max_age, dry_run):
+        max_size = max_size or CONFIG.get('common', 'cache_max_size')
+        max_age = max_age or CONFIG.get('common', 'cache_max_age')
+
+        if not (max_size or max_age):
+            raise click.UsageError("At least one of --max-size or --max-age must be provided")
+
+        artifact_cache = ArtifactCache()
+
+        try:
+            evicted = artifact_cache.gc(max_size=parse_size(max_size) if max_size else None,
+                                        max_age=parse_duration(max_age) if max_age else None,
+                                        dry_run=dry_run)
+        except CekitError as ex:
+            click.secho("Cannot evict artifacts from cache: {}".format(ex.message), fg='red')
+            sys.exit(1)
+
+        for artifact_id, size in evicted:
+            # Git repositories are identified by their path in the cache directory,
+            # artifacts cached by URL by the URL
+            if artifact_id.startswith('git/'):
+                label = "Git repository '{}'"
+            elif '/' in artifact_id:
+                label = "Artifact cached by URL '{}'"
+            else:
+                label = "Artifact with UUID '{}'"
+
+            click.echo("{} ({} bytes) {}".format(
+                label.format(artifact_id), size, "would be removed" if dry_run else "removed"))
+
+        click.echo("{} artifact(s), {} bytes {}".format(
+            len(evicted), sum(size for _, size in evicted), "would be evicted" if dry_run else "evicted"))
+
     def clear(self):
         """
         Removes the artifact cache directory with all artifacts.
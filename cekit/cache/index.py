@@ -0,0 +1,537 @@
+import contextlib
+import glob
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import yaml
+
+from cekit.crypto import SUPPORTED_HASH_ALGORITHMS
+
+logger = logging.getLogger('cekit')
+
+
+class CacheIndex(object):
+    """
+    Persistent index of the artifact cache.
+
+    All cache metadata is stored in a single SQLite database located in the cache
+    directory. Every supported checksum column is indexed, so looking up an artifact
+    by its checksum does not depend on the number of cached artifacts.
+
+    Index files (UUID.yaml) written by previous versions of CEKit are imported
+    into the database when it is created.
+    """
+
+    INDEX_FILE = 'index.db'
+    SCHEMA_VERSION = 11
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_file = os.path.join(cache_dir, CacheIndex.INDEX_FILE)
+
+        self._prepare()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Opens a new connection to the index database. The transaction is committed
+        when the block finishes successfully, rolled back otherwise.
+
+        A new connection is used for every operation, this makes it safe to use
+        the index from multiple threads and processes at the same time.
+        """
+        conn = sqlite3.connect(self.index_file, timeout=60)
+        conn.row_factory = sqlite3.Row
+
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _prepare(self):
+        """
+        Makes sure the index database schema is up to date. Schema is created
+        in an exclusive transaction so that concurrent processes do not step on each other.
+        """
+
+        conn = sqlite3.connect(self.index_file, timeout=60, isolation_level=None)
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+            if version < CacheIndex.SCHEMA_VERSION:
+                logger.debug("Creating artifact cache index '{}'".format(self.index_file))
+                self._create(conn)
+                conn.execute("PRAGMA user_version = {}".format(CacheIndex.SCHEMA_VERSION))
+
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        if version < 1:
+            self._migrate()
+
+    def _create(self, conn):  # pylint: disable=no-self-use
+        conn.execute("CREATE TABLE IF NOT EXISTS artifacts ("
+                     "id TEXT PRIMARY KEY, "
+                     "cached_path TEXT NOT NULL, "
+                     "names TEXT NOT NULL, "
+                     "{})".format(", ".join("{} TEXT".format(alg) for alg in SUPPORTED_HASH_ALGORITHMS)))
+
+        # Columns added in later versions of the schema
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(artifacts)")]
+
+        for column, definition in [('size', 'INTEGER'), ('added', 'REAL'), ('accessed', 'REAL')]:
+            if column not in columns:
+                conn.execute("ALTER TABLE artifacts ADD COLUMN {} {}".format(column, definition))
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            conn.execute("CREATE INDEX IF NOT EXISTS artifacts_{0} ON artifacts ({0})".format(alg))
+
+        conn.execute("CREATE INDEX IF NOT EXISTS artifacts_cached_path ON artifacts (cached_path)")
+
+        # Checksums verified for files, together with the identity of the file at the time of verification
+        conn.execute("CREATE TABLE IF NOT EXISTS verified ("
+                     "path TEXT PRIMARY KEY, "
+                     "inode INTEGER NOT NULL, "
+                     "size INTEGER NOT NULL, "
+                     "mtime_ns INTEGER NOT NULL, "
+                     "checksums TEXT NOT NULL)")
+
+        # Number of hits and misses for every cache tier
+        conn.execute("CREATE TABLE IF NOT EXISTS tier_stats ("
+                     "tier TEXT PRIMARY KEY, "
+                     "hits INTEGER NOT NULL DEFAULT 0, "
+                     "misses INTEGER NOT NULL DEFAULT 0)")
+
+        # Artifacts already verified by the current run of cache verification
+        conn.execute("CREATE TABLE IF NOT EXISTS verify_checkpoint ("
+                     "id TEXT PRIMARY KEY, "
+                     "status TEXT NOT NULL)")
+
+        # Artifacts recently not found in a source (cacher, Brew), these are not looked up until expired
+        conn.execute("CREATE TABLE IF NOT EXISTS misses ("
+                     "source TEXT NOT NULL, "
+                     "checksum TEXT NOT NULL, "
+                     "expires REAL NOT NULL, "
+                     "PRIMARY KEY (source, checksum))")
+
+        # Statistics for every artifact (by name), see ArtifactCache.record()
+        conn.execute("CREATE TABLE IF NOT EXISTS artifact_stats ("
+                     "name TEXT PRIMARY KEY, "
+                     "hits INTEGER NOT NULL DEFAULT 0, "
+                     "misses INTEGER NOT NULL DEFAULT 0, "
+                     "bytes_served INTEGER NOT NULL DEFAULT 0, "
+                     "bytes_downloaded INTEGER NOT NULL DEFAULT 0, "
+                     "download_time REAL NOT NULL DEFAULT 0, "
+                     "hash_time REAL NOT NULL DEFAULT 0)")
+
+        # Latency of hosts serving artifacts (origins and mirrors), see ArtifactCache.rank_urls()
+        conn.execute("CREATE TABLE IF NOT EXISTS latencies ("
+                     "host TEXT PRIMARY KEY, "
+                     "latency REAL NOT NULL, "
+                     "updated REAL NOT NULL)")
+
+        # Brew download URLs of artifacts by their md5 checksum, see ArtifactCache.brew_urls()
+        conn.execute("CREATE TABLE IF NOT EXISTS brew_urls ("
+                     "md5 TEXT PRIMARY KEY, "
+                     "url TEXT NOT NULL, "
+                     "expires REAL NOT NULL)")
+
+        # Artifacts without checksums, cached by URL together with headers used for revalidation
+        conn.execute("CREATE TABLE IF NOT EXISTS urls ("
+                     "url TEXT PRIMARY KEY, "
+                     "cached_path TEXT NOT NULL, "
+                     "etag TEXT, "
+                     "last_modified TEXT, "
+                     "accessed REAL)")
+
+        # Checksums of files available at URLs, computed without keeping the file, together
+        # with headers used for revalidation, see Resource.remote_checksums()
+        conn.execute("CREATE TABLE IF NOT EXISTS url_checksums ("
+                     "url TEXT PRIMARY KEY, "
+                     "checksums TEXT NOT NULL, "
+                     "etag TEXT, "
+                     "last_modified TEXT)")
+
+    def _migrate(self):
+        """
+        Imports index files from the old cache format and removes them afterwards.
+        """
+
+        for index_file in glob.glob(os.path.join(self.cache_dir, '*.yaml')):
+            artifact_id = os.path.basename(index_file)[:-len('.yaml')]
+
+            try:
+                with open(index_file, 'r') as file_:
+                    entry = yaml.safe_load(file_)
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.warning("Could not read cache index file '{}', skipping: {}".format(index_file, ex))
+                continue
+
+            if not isinstance(entry, dict) or not entry.get('cached_path'):
+                logger.warning("Invalid cache index file '{}', skipping".format(index_file))
+                continue
+
+            logger.debug("Migrating cached artifact '{}' to the cache index".format(artifact_id))
+
+            self.add(artifact_id, entry)
+
+            try:
+                os.remove(index_file)
+            except OSError:
+                # Most probably removed by a concurrent migration
+                pass
+
+    @staticmethod
+    def _to_entry(row):
+        entry = {'names': json.loads(row['names']),
+                 'cached_path': row['cached_path']}
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            if row[alg]:
+                entry[alg] = row[alg]
+
+        return entry
+
+    def add(self, artifact_id, entry):
+        """
+        Adds (or replaces) the entry for the artifact identified by artifact_id.
+
+        Size of the cached file is recorded too. Time when the artifact was added
+        and last accessed is preserved when an existing entry is replaced.
+        """
+
+        checksums = [entry.get(alg).lower() if entry.get(alg) else None for alg in SUPPORTED_HASH_ALGORITHMS]
+        size = os.path.getsize(entry['cached_path']) if os.path.exists(entry['cached_path']) else None
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO artifacts (id, cached_path, names, size, added, accessed, {}) "
+                         "VALUES (?, ?, ?, ?, "
+                         "COALESCE((SELECT added FROM artifacts WHERE id = ?), ?), "
+                         "COALESCE((SELECT accessed FROM artifacts WHERE id = ?), ?), {})".format(
+                             ", ".join(SUPPORTED_HASH_ALGORITHMS), ", ".join("?" for _ in SUPPORTED_HASH_ALGORITHMS)),
+                         [artifact_id, entry['cached_path'], json.dumps(entry.get('names', [])), size,
+                          artifact_id, now, artifact_id, now] + checksums)
+
+    def touch(self, cached_path):
+        """
+        Records access to the cached artifact stored at the provided path.
+        """
+
+        with self._connect() as conn:
+            conn.execute("UPDATE artifacts SET accessed = ? WHERE cached_path = ?", (time.time(), cached_path))
+
+    def touch_checksum(self, algorithm, checksum):
+        """
+        Records access to the cached artifact with the provided checksum.
+        """
+
+        with self._connect() as conn:
+            conn.execute("UPDATE artifacts SET accessed = ? WHERE {} = ?".format(algorithm),
+                         (time.time(), checksum.lower()))
+
+    def usage(self):
+        """
+        Returns list of (artifact id, cached path, size, last access time) tuples
+        for all cached artifacts, least recently used artifacts first.
+
+        Size can be None for artifacts added by older versions of CEKit.
+        """
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, cached_path, size, COALESCE(accessed, added, 0) AS last_access "
+                                "FROM artifacts ORDER BY last_access, id").fetchall()
+
+        return [(row['id'], row['cached_path'], row['size'], row['last_access']) for row in rows]
+
+    def get(self, artifact_id):
+        """
+        Returns the entry for the artifact identified by artifact_id, None if there is no such artifact.
+        """
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM artifacts WHERE id = ?", (artifact_id,)).fetchone()
+
+        return self._to_entry(row) if row else None
+
+    def find(self, algorithm, checksum):
+        """
+        Returns tuple of the artifact id and entry for the artifact with
+        the provided checksum, (None, None) if such artifact is not cached.
+        """
+
+        if algorithm not in SUPPORTED_HASH_ALGORITHMS:
+            raise ValueError("Unsupported hash algorithm: '{}'".format(algorithm))
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM artifacts WHERE {} = ?".format(algorithm),
+                               (checksum.lower(),)).fetchone()
+
+        if not row:
+            return None, None
+
+        return row['id'], self._to_entry(row)
+
+    def delete(self, artifact_id):
+        """
+        Removes the entry for the artifact identified by artifact_id.
+
+        Returns True if the entry existed, False otherwise.
+        """
+
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM artifacts WHERE id = ?", (artifact_id,)).rowcount > 0
+
+    def get_verified(self, path, identity):
+        """
+        Returns dictionary of checksums verified for the file at the provided path,
+        keyed by algorithm. Checksums are returned only if the file identity
+        (a tuple of inode, size and modification time in nanoseconds) did not change
+        since the verification, otherwise an empty dictionary is returned.
+        """
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM verified WHERE path = ?", (path,)).fetchone()
+
+        if not row or (row['inode'], row['size'], row['mtime_ns']) != tuple(identity):
+            return {}
+
+        return json.loads(row['checksums'])
+
+    def set_verified(self, path, identity, checksums):
+        """
+        Records checksums verified for the file at the provided path.
+        """
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO verified (path, inode, size, mtime_ns, checksums) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         [path] + list(identity) + [json.dumps(checksums, sort_keys=True)])
+
+    def record_tier_lookup(self, tier, hit):
+        """
+        Records a hit (or a miss) of an artifact lookup in the provided cache tier.
+        """
+
+        column = 'hits' if hit else 'misses'
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO tier_stats (tier) VALUES (?)", (tier,))
+            conn.execute("UPDATE tier_stats SET {0} = {0} + 1 WHERE tier = ?".format(column), (tier,))
+
+    def tier_stats(self):
+        """
+        Returns dictionary of (hits, misses) tuples, keyed by cache tier.
+        """
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM tier_stats").fetchall()
+
+        return dict((row['tier'], (row['hits'], row['misses'])) for row in rows)
+
+    def record_artifact_stats(self, name, values):
+        """
+        Adds provided values (a dictionary keyed by column name) to statistics of the artifact.
+        """
+
+        columns = sorted(values.keys())
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO artifact_stats (name) VALUES (?)", (name,))
+            conn.execute("UPDATE artifact_stats SET {} WHERE name = ?".format(
+                ", ".join("{0} = {0} + ?".format(column) for column in columns)),
+                [values[column] for column in columns] + [name])
+
+    def artifact_stats(self):
+        """
+        Returns dictionary of statistics for every artifact, keyed by artifact name.
+        """
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM artifact_stats").fetchall()
+
+        return dict((row['name'], dict((key, row[key]) for key in row.keys() if key != 'name')) for row in rows)
+
+    def add_url(self, url, cached_path, etag, last_modified):
+        """
+        Adds (or replaces) the entry for the artifact cached by URL.
+        """
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO urls (url, cached_path, etag, last_modified, accessed) "
+                         "VALUES (?, ?, ?, ?, ?)", (url, cached_path, etag, last_modified, time.time()))
+
+    def get_url(self, url):
+        """
+        Returns the entry for the artifact cached by URL, None if there is no such entry.
+        """
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM urls WHERE url = ?", (url,)).fetchone()
+
+            if row:
+                conn.execute("UPDATE urls SET accessed = ? WHERE url = ?", (time.time(), url))
+
+        if not row:
+            return None
+
+        return {'cached_path': row['cached_path'], 'etag': row['etag'], 'last_modified': row['last_modified']}
+
+    def url_usage(self):
+        """
+        Returns list of (url, cached path, last access time) tuples for all artifacts
+        cached by URL, least recently used artifacts first.
+        """
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT url, cached_path, COALESCE(accessed, 0) AS last_access "
+                                "FROM urls ORDER BY last_access, url").fetchall()
+
+        return [(row['url'], row['cached_path'], row['last_access']) for row in rows]
+
+    def delete_url(self, url):
+        """
+        Removes the entry for the artifact cached by URL.
+        """
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM urls WHERE url = ?", (url,))
+
+    def add_url_checksums(self, url, checksums, etag, last_modified):
+        """
+        Records checksums of the file available at the URL, together with headers
+        needed to revalidate them later.
+        """
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO url_checksums (url, checksums, etag, last_modified) "
+                         "VALUES (?, ?, ?, ?)", (url, json.dumps(checksums, sort_keys=True), etag, last_modified))
+
+    def get_url_checksums(self, url):
+        """
+        Returns the entry (a dictionary with 'checksums', 'etag' and 'last_modified' keys)
+        with checksums of the file available at the URL, None if there is no such entry.
+        """
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM url_checksums WHERE url = ?", (url,)).fetchone()
+
+        if not row:
+            return None
+
+        return {'checksums': json.loads(row['checksums']), 'etag': row['etag'], 'last_modified': row['last_modified']}
+
+    def record_latency(self, host, latency, weight):
+        """
+        Records measured latency of the host. The stored value is a moving average,
+        new measurement contributes to it with the provided weight (0 - 1).
+        """
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT latency FROM latencies WHERE host = ?", (host,)).fetchone()
+
+            if row:
+                latency = row['latency'] * (1 - weight) + latency * weight
+
+            conn.execute("INSERT OR REPLACE INTO latencies (host, latency, updated) VALUES (?, ?, ?)",
+                         (host, latency, time.time()))
+
+    def latencies(self):
+        """
+        Returns dictionary of (latency, time of the last measurement) tuples keyed by host.
+        """
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM latencies").fetchall()
+
+        return dict((row['host'], (row['latency'], row['updated'])) for row in rows)
+
+    def add_miss(self, source, checksum, ttl):
+        """
+        Records that the artifact with provided checksum was not found in the source.
+        The record expires after ttl seconds.
+        """
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO misses (source, checksum, expires) VALUES (?, ?, ?)",
+                         (source, checksum, time.time() + ttl))
+
+    def is_miss(self, source, checksum):
+        """
+        Returns True if the artifact with provided checksum was recently not found in the source.
+        """
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT expires FROM misses WHERE source = ? AND checksum = ?",
+                               (source, checksum)).fetchone()
+
+        return bool(row) and row['expires'] > time.time()
+
+    def flush_misses(self):
+        """
+        Removes all recorded misses, returns number of removed records.
+        """
+
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM misses").rowcount
+
+    def add_brew_url(self, md5, url, ttl):
+        """
+        Records the Brew download URL of the artifact with provided md5 checksum.
+        The record expires after ttl seconds.
+        """
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO brew_urls (md5, url, expires) VALUES (?, ?, ?)",
+                         (md5.lower(), url, time.time() + ttl))
+
+    def get_brew_url(self, md5):
+        """
+        Returns the recorded Brew download URL of the artifact with provided md5 checksum,
+        None if there is no such record or it expired.
+        """
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT url, expires FROM brew_urls WHERE md5 = ?", (md5.lower(),)).fetchone()
+
+        return row['url'] if row and row['expires'] > time.time() else None
+
+    def add_checkpoint(self, artifact_id, status):
+        """
+        Records the result of the artifact verification in the verification checkpoint.
+        """
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO verify_checkpoint (id, status) VALUES (?, ?)",
+                         (artifact_id, status))
+
+    def checkpoint(self):
+        """
+        Returns dictionary of verification results recorded in the checkpoint, keyed by artifact id.
+        """
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM verify_checkpoint").fetchall()
+
+        return dict((row['id'], row['status']) for row in rows)
+
+    def clear_checkpoint(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM verify_checkpoint")
+
+    def list(self):
+        """
+        Returns dictionary of all cached artifacts, keyed by artifact id.
+        """
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM artifacts ORDER BY id").fetchall()
+
+        return dict((row['id'], self._to_entry(row)) for row in rows)
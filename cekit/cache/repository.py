@@ -0,0 +1,315 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+
+from cekit.config import Config
+from cekit.errors import CekitError
+from cekit.tools import FileLock
+
+logger = logging.getLogger('cekit')
+CONFIG = Config()
+
+# Directory (inside of the cache directory) with bare mirrors of Git repositories
+MIRRORS_DIR = 'git'
+
+# Directory (inside of the mirrors directory) with checkouts of commits and their module registry
+# snapshots, and the version of the snapshot format
+SNAPSHOTS_DIR = 'snapshots'
+SNAPSHOT_VERSION = 1
+
+# Abbreviated or full commit hash
+COMMIT_PATTERN = re.compile(r'^[0-9a-f]{7,40}$')
+
+
+class RepositoryCache(object):
+    """
+    Cache of Git repositories. Every repository is kept as a bare mirror in the cache
+    subdirectory of a Cekit 'work_dir', keyed by the repository URL:
+
+        cache/git/<name>-<sha256 of the URL>.git
+
+    Repositories are checked out from the local mirror, so that only new objects are
+    transferred over the network. The mirror is updated only if the requested ref could
+    have changed (it is a branch) or it is not present in the mirror yet; tags and commits
+    already in the mirror are used as they are.
+
+    Commits used as module repositories are checked out permanently, together with a snapshot
+    of modules found in them (see save_modules()):
+
+        cache/git/snapshots/<commit>/
+        cache/git/snapshots/<commit>.json
+
+    Content of a commit cannot change, so the snapshot is valid until it is evicted. Snapshots
+    do not share objects with the mirror, these stay usable even if the mirror is pruned or evicted.
+
+    Time of the last use of every mirror and snapshot is recorded as the modification time
+    of its directory, so that these can be evicted together with artifacts (see usage()).
+    """
+
+    def __init__(self):
+        self.cache_dir = os.path.expanduser(
+            os.path.join(CONFIG.get('common', 'work_dir'), 'cache'))
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def mirror_path(self, url):
+        """
+        Returns path to the bare mirror of the repository.
+        """
+
+        name = os.path.basename(url.rstrip('/')).split('.', 1)[0]
+        return os.path.join(self.cache_dir, MIRRORS_DIR, "{}-{}.git".format(name, self._key(url)[:16]))
+
+    def lock(self, url, blocking=True):
+        """
+        Returns a context manager holding an exclusive lock for the mirror of the repository.
+        """
+        return FileLock(os.path.join(self.cache_dir, 'locks', "git-{}.lock".format(self._key(url))),
+                        blocking=blocking, description="repository '{}'".format(url))
+
+    def _snapshot_lock(self, commit, blocking=True):
+        return FileLock(os.path.join(self.cache_dir, 'locks', "git-{}.lock".format(commit)),
+                        blocking=blocking, description="commit '{}'".format(commit))
+
+    @staticmethod
+    def _touch(path):
+        """
+        Records use of the mirror or snapshot at the provided path.
+        """
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            logger.debug("Cannot record use of '{}'".format(path))
+
+    @staticmethod
+    def _git(*args):
+        return subprocess.check_output(['git'] + list(args), stderr=subprocess.STDOUT)
+
+    @staticmethod
+    def _commit(mirror, ref):
+        """
+        Returns the commit the ref resolves to in the mirror, None if it is not there.
+        """
+
+        try:
+            commit = RepositoryCache._git('-C', mirror, 'rev-parse', '--verify', '--quiet',
+                                          "{}^{{commit}}".format(ref))
+        except subprocess.CalledProcessError:
+            return None
+
+        return commit.decode('utf-8').strip()
+
+    def _immutable(self, mirror, ref):
+        """
+        Returns True if the ref is a tag or a commit present in the mirror.
+        """
+
+        if self._commit(mirror, "refs/tags/{}".format(ref)):
+            return True
+
+        return bool(COMMIT_PATTERN.match(ref)) and \
+            self._commit(mirror, "refs/heads/{}".format(ref)) is None and \
+            self._commit(mirror, ref) is not None
+
+    def resolve(self, url, ref):
+        """
+        Makes sure that the mirror of the repository contains the ref and returns
+        the commit it resolves to.
+        """
+
+        mirror = self.mirror_path(url)
+
+        with self.lock(url):
+            if not os.path.isdir(mirror):
+                logger.info("Creating mirror of Git repository '{}'".format(url))
+                self._git('clone', '--mirror', '--quiet', url, mirror)
+            elif self._immutable(mirror, ref):
+                logger.debug("Ref '{}' of Git repository '{}' found in the mirror".format(ref, url))
+            else:
+                logger.info("Updating mirror of Git repository '{}'".format(url))
+                self._git('-C', mirror, 'fetch', '--quiet', '--prune', 'origin')
+
+            commit = self._commit(mirror, ref)
+            self._touch(mirror)
+
+        if not commit:
+            raise CekitError("Ref '{}' not found in Git repository '{}'".format(ref, url))
+
+        return commit
+
+    def checkout(self, url, ref, target):
+        """
+        Checks out the ref of the repository into the target directory. Objects are taken
+        from the mirror, but copied into the checkout, so that it does not depend on the cache
+        (it is a part of the image build context). Returns the checked out commit.
+        """
+
+        commit = self.resolve(url, ref)
+        mirror = self.mirror_path(url)
+
+        logger.debug("Checking out '{}' ref ({}) of Git repository '{}'".format(ref, commit, url))
+
+        self._git('clone', '--shared', '--dissociate', '--no-checkout', '--quiet', mirror, target)
+        self._git('-C', target, 'remote', 'set-url', 'origin', url)
+        self._git('-C', target, 'checkout', '--quiet', ref)
+
+        return commit
+
+    def _snapshot_path(self, commit):
+        return os.path.join(self.cache_dir, MIRRORS_DIR, SNAPSHOTS_DIR, commit)
+
+    def snapshot(self, url, ref):
+        """
+        Returns tuple of the commit the ref resolves to and path to a persistent
+        checkout of the commit, which is created if it does not exist yet.
+        """
+
+        commit = self.resolve(url, ref)
+        path = self._snapshot_path(commit)
+
+        with self._snapshot_lock(commit):
+            if not os.path.isdir(path):
+                logger.debug("Checking out commit {} of Git repository '{}'".format(commit, url))
+
+                staging = path + '.tmp'
+
+                if os.path.exists(staging):
+                    shutil.rmtree(staging)
+
+                self._git('clone', '--shared', '--dissociate', '--no-checkout', '--quiet',
+                          self.mirror_path(url), staging)
+                self._git('-C', staging, 'checkout', '--quiet', commit)
+                os.rename(staging, path)
+
+            self._touch(path)
+
+        return commit, path
+
+    def load_modules(self, commit):
+        """
+        Returns list of modules saved for the commit with save_modules(), with paths
+        pointing to the checkout of the commit. None is returned if there is no snapshot.
+        """
+
+        path = self._snapshot_path(commit)
+
+        try:
+            with open(path + '.json') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            return None
+
+        return [{'descriptor': module['descriptor'],
+                 'path': os.path.join(path, module['path']),
+                 'artifact_dir': os.path.join(path, module['artifact_dir'])} for module in snapshot['modules']]
+
+    def save_modules(self, commit, modules):
+        """
+        Saves snapshot of modules found in the checkout of the commit. Every module is a dictionary
+        with the parsed module descriptor ('descriptor'), path to the module ('path') and path
+        to the directory with the module descriptor ('artifact_dir').
+        """
+
+        path = self._snapshot_path(commit)
+        snapshot = {'version': SNAPSHOT_VERSION,
+                    'modules': [{'descriptor': module['descriptor'],
+                                 'path': os.path.relpath(module['path'], path),
+                                 'artifact_dir': os.path.relpath(module['artifact_dir'], path)}
+                                for module in modules]}
+
+        try:
+            data = json.dumps(snapshot)
+        except (TypeError, ValueError) as ex:
+            # Descriptors can contain values which cannot be represented in JSON (dates for example)
+            logger.debug("Cannot save module snapshot of commit {}: {}".format(commit, ex))
+            return
+
+        staging = "{}.json.{}".format(path, os.getpid())
+
+        with open(staging, 'w') as snapshot_file:
+            snapshot_file.write(data)
+
+        os.rename(staging, path + '.json')
+
+    @staticmethod
+    def _size(path):
+        size = 0
+
+        for root, _, files in os.walk(path):
+            for name in files:
+                size += os.lstat(os.path.join(root, name)).st_size
+
+        return size
+
+    def usage(self):
+        """
+        Returns list of (path, size, last use time) tuples for all mirrors and snapshots in the cache.
+        """
+
+        mirrors_dir = os.path.join(self.cache_dir, MIRRORS_DIR)
+        snapshots_dir = os.path.join(mirrors_dir, SNAPSHOTS_DIR)
+        paths = []
+
+        if os.path.isdir(mirrors_dir):
+            paths += [os.path.join(mirrors_dir, name) for name in os.listdir(mirrors_dir) if name.endswith('.git')]
+
+        if os.path.isdir(snapshots_dir):
+            paths += [os.path.join(snapshots_dir, name) for name in os.listdir(snapshots_dir)
+                      if COMMIT_PATTERN.match(name)]
+
+        usage = []
+
+        for path in paths:
+            if not os.path.isdir(path):
+                continue
+
+            size = self._size(path)
+
+            if os.path.exists(path + '.json'):
+                size += os.path.getsize(path + '.json')
+
+            usage.append((path, size, os.path.getmtime(path)))
+
+        return usage
+
+    def evict(self, path):
+        """
+        Removes the mirror or snapshot at the provided path (see usage()), but only if it is
+        not used at the moment. Returns True if it was removed.
+        """
+
+        if os.path.dirname(path) == os.path.join(self.cache_dir, MIRRORS_DIR, SNAPSHOTS_DIR):
+            lock = self._snapshot_lock(os.path.basename(path), blocking=False)
+        else:
+            try:
+                url = self._git('-C', path, 'config', 'remote.origin.url').decode('utf-8').strip()
+            except subprocess.CalledProcessError:
+                url = None
+
+            # Mirror which is not usable anymore is removed without locking
+            lock = self.lock(url, blocking=False) if url else None
+
+        if lock and not lock.__enter__():
+            return False
+
+        try:
+            logger.debug("Removing '{}' from the repository cache".format(path))
+
+            if os.path.exists(path + '.json'):
+                os.remove(path + '.json')
+
+            shutil.rmtree(path)
+        finally:
+            if lock:
+                lock.__exit__(None, None, None)
+
+        return True
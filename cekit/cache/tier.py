@@ -0,0 +1,263 @@
+import logging
+import os
+import re
+import shutil
+import uuid
+
+try:
+    from urllib.parse import urlparse
+    from urllib.request import Request
+    from urllib.error import HTTPError
+except ImportError:
+    from urlparse import urlparse
+    from urllib2 import Request, HTTPError
+
+from cekit.connections import urlopen
+from cekit.crypto import SUPPORTED_HASH_ALGORITHMS
+from cekit.errors import CekitError
+
+logger = logging.getLogger('cekit')
+
+
+def create_tiers(value):
+    """
+    Creates list of cache tiers from the 'cache_tiers' configuration option value.
+
+    Tiers are separated by commas or whitespace and are ordered from the one closest
+    to the local cache to the one closest to the origin. Every tier is either a path
+    to a (shared) directory, or an HTTP(S) URL.
+    """
+
+    tiers = []
+
+    for location in re.split(r'[\s,]+', value or ''):
+        if not location:
+            continue
+
+        parsed_url = urlparse(location)
+
+        if parsed_url.scheme in ['http', 'https']:
+            tiers.append(HttpTier(location))
+        elif parsed_url.scheme == 'file':
+            tiers.append(FilesystemTier(parsed_url.path))
+        elif not parsed_url.scheme:
+            tiers.append(FilesystemTier(location))
+        else:
+            raise CekitError("Unsupported cache tier: '{}'".format(location))
+
+    return tiers
+
+
+class CacheTier(object):
+    """
+    Shared artifact cache tier, located between the local cache and the origin
+    of artifacts. Artifacts are stored in a tier by their checksums, every supported
+    algorithm can be used to look up an artifact.
+    """
+
+    def __init__(self, location):
+        self.location = location
+
+    def __str__(self):
+        return self.location
+
+    def fetch(self, checksums, destination):
+        """
+        Fetches artifact with any of the provided checksums (dictionary keyed
+        by algorithm) to the destination file. Returns True if the artifact was found
+        in the tier, False otherwise.
+        """
+        raise NotImplementedError()
+
+    def publish(self, path, checksums):
+        """
+        Stores the file at the provided path in the tier. Checksums dictionary
+        contains checksums of the file for all supported algorithms.
+        """
+        raise NotImplementedError()
+
+
+class FilesystemTier(CacheTier):
+    """
+    Tier located in a directory, usually on a shared filesystem (NFS for example).
+
+    Artifacts are stored using the same layout as the content addressed local cache:
+    blobs/sha256/ab/abcdef... with aliases (symlinks) for other algorithms.
+    """
+
+    def __init__(self, location):
+        super(FilesystemTier, self).__init__(os.path.expanduser(location))
+
+    def _path(self, algorithm, checksum):
+        checksum = checksum.lower()
+        return os.path.join(self.location, 'blobs', algorithm, checksum[:2], checksum)
+
+    def fetch(self, checksums, destination):
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            if not checksums.get(alg):
+                continue
+
+            path = self._path(alg, checksums[alg])
+
+            if os.path.isfile(path):
+                logger.debug("Fetching artifact from '{}' cache tier".format(path))
+                shutil.copy(path, destination)
+                return True
+
+        return False
+
+    def publish(self, path, checksums):
+        blob_path = self._path('sha256', checksums['sha256'])
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            alias = self._path(alg, checksums[alg])
+
+            try:
+                os.makedirs(os.path.dirname(alias))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(alias)):
+                    raise
+
+            if alg == 'sha256':
+                if not os.path.exists(blob_path):
+                    # Other hosts must never see a partially written blob
+                    staging_file = "{}.{}.part".format(blob_path, uuid.uuid4())
+
+                    try:
+                        shutil.copy(path, staging_file)
+                        os.rename(staging_file, blob_path)
+                    finally:
+                        if os.path.exists(staging_file):
+                            os.remove(staging_file)
+                continue
+
+            try:
+                os.symlink(os.path.relpath(blob_path, os.path.dirname(alias)), alias)
+            except OSError:
+                # Alias could be created already by other host
+                if not os.path.lexists(alias):
+                    raise
+
+
+class HttpTier(CacheTier):
+    """
+    Tier accessed over HTTP(S). Content of an artifact is stored only once,
+    at the [URL]/sha256/[CHECKSUM] location. Other algorithms are aliases:
+    small [URL]/[ALGORITHM]/[CHECKSUM].sha256 objects with the sha256 checksum
+    of the artifact. Artifacts are published with PUT requests.
+    """
+
+    def __init__(self, location):
+        super(HttpTier, self).__init__(location.rstrip('/'))
+
+    def _url(self, algorithm, checksum):
+        return "{}/{}/{}".format(self.location, algorithm, checksum.lower())
+
+    def _alias_url(self, algorithm, checksum):
+        return "{}.sha256".format(self._url(algorithm, checksum))
+
+    @staticmethod
+    def _open(url, method=None):
+        """
+        Opens the URL, returns None if there is nothing at the location.
+        """
+
+        request = Request(url)
+
+        if method:
+            request.get_method = lambda: method
+
+        try:
+            return urlopen(request)
+        except HTTPError as ex:
+            if ex.code == 404:
+                return None
+            raise
+
+    @staticmethod
+    def _put(url, data, size):
+        request = Request(url, data=data,
+                          headers={'Content-Length': str(size),
+                                   'Content-Type': 'application/octet-stream'})
+        request.get_method = lambda: 'PUT'
+        urlopen(request).close()
+
+    def _sha256(self, algorithm, checksum):
+        """
+        Returns sha256 checksum of the artifact with the provided checksum,
+        None if there is no such artifact in the tier.
+        """
+
+        if algorithm == 'sha256':
+            return checksum
+
+        res = self._open(self._alias_url(algorithm, checksum))
+
+        if res is None:
+            return None
+
+        try:
+            sha256 = res.read().decode('utf-8').strip().lower()
+        finally:
+            res.close()
+
+        if not re.match(r'^[0-9a-f]{64}$', sha256):
+            logger.warning("Ignoring invalid alias '{}' in cache tier".format(
+                self._alias_url(algorithm, checksum)))
+            return None
+
+        return sha256
+
+    def fetch(self, checksums, destination):
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            if not checksums.get(alg):
+                continue
+
+            sha256 = self._sha256(alg, checksums[alg])
+
+            if not sha256:
+                continue
+
+            url = self._url('sha256', sha256)
+            res = self._open(url)
+
+            if res is None:
+                continue
+
+            logger.debug("Fetching artifact from '{}' cache tier".format(url))
+
+            try:
+                with open(destination, 'wb') as f:
+                    while True:
+                        chunk = res.read(1048576)  # 1 MB
+                        if not chunk:
+                            break
+                        f.write(chunk)
+            except Exception:
+                if os.path.exists(destination):
+                    os.remove(destination)
+                raise
+            finally:
+                res.close()
+
+            return True
+
+        return False
+
+    def publish(self, path, checksums):
+        blob_url = self._url('sha256', checksums['sha256'])
+        res = self._open(blob_url, method='HEAD')
+
+        if res is None:
+            with open(path, 'rb') as f:
+                self._put(blob_url, f, os.path.getsize(path))
+        else:
+            logger.debug("Artifact '{}' is already in cache tier".format(blob_url))
+            res.close()
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            if alg == 'sha256':
+                continue
+
+            alias = checksums['sha256'].lower().encode('utf-8')
+            self._put(self._alias_url(alg, checksums[alg]), alias, len(alias))
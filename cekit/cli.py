@@ -60,7 +60,9 @@ def cli(descriptor, verbose, nocolor, work_dir, config, redhat, target):  # pyli
 @click.option('--dry-run', help="Do not execute the build, just generate required files.", is_flag=True)
 @click.option('--overrides', metavar="JSON", help="Inline overrides in JSON format.", multiple=True)
 @click.option('--overrides-file', 'overrides', metavar="PATH", help="Path to overrides file in YAML format.", multiple=True)
-def build(validate, dry_run, overrides):  # pylint: disable=unused-argument
+@click.option('--paranoid', help="Always verify checksums of artifacts, even if these were verified before.", is_flag=True)
+@click.option('--fetch-jobs', metavar="NUM", help="Number of artifacts and module repositories fetched in parallel. Defaults to 4.", type=click.IntRange(min=1))
+def build(validate, dry_run, overrides, paranoid, fetch_jobs):  # pylint: disable=unused-argument
     """
     DESCRIPTION
 
@@ -310,7 +312,9 @@ class Cekit(object):
         CONFIG.configure(self.params.config,
                          {
                              'redhat': self.params.redhat,
-                             'work_dir': self.params.work_dir
+                             'work_dir': self.params.work_dir,
+                             'paranoid': self.params.paranoid,
+                             'fetch_jobs': self.params.fetch_jobs
                          })
 
     def cleanup(self):
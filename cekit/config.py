@@ -22,6 +22,10 @@ class Config(object):
         # Only allow command line overriding of these values if they are not the default value.
         if cmdline_args.get('redhat'):
             cls.cfg['common']['redhat'] = cmdline_args.get('redhat')
+        if cmdline_args.get('paranoid'):
+            cls.cfg['common']['paranoid'] = cmdline_args.get('paranoid')
+        if cmdline_args.get('fetch_jobs'):
+            cls.cfg['common']['fetch_jobs'] = cmdline_args.get('fetch_jobs')
         from cekit import cli
         if cmdline_args.get('work_dir') and cmdline_args.get('work_dir') != cli.default_work_dir:
             cls.cfg['common']['work_dir'] = cmdline_args.get('work_dir')
@@ -40,7 +44,12 @@ class Config(object):
         cls.cfg['common']['work_dir'] = cls.cfg.get('common').get('work_dir', '~/.cekit')
         cls.cfg['common']['redhat'] = yaml.safe_load(
             cls.cfg.get('common', {}).get('redhat', 'False'))
+        cls.cfg['common']['paranoid'] = yaml.safe_load(
+            cls.cfg.get('common', {}).get('paranoid', 'False'))
+        cls.cfg['common']['cache_publish'] = yaml.safe_load(
+            cls.cfg.get('common', {}).get('cache_publish', 'False'))
         cls.cfg['repositories'] = cls.cfg.get('repositories', {})
+        cls.cfg['mirrors'] = cls.cfg.get('mirrors', {})
 
     @classmethod
     def get(cls, *args):
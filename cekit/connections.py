@@ -0,0 +1,284 @@
+import io
+import logging
+import socket
+import ssl
+import threading
+
+try:
+    from http.client import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib.error import HTTPError
+    from urllib.parse import urljoin, urlparse
+    from urllib.request import Request, getproxies, proxy_bypass
+    from urllib.request import urlopen as urllib_urlopen
+except ImportError:
+    from httplib import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib import getproxies, proxy_bypass
+    from urllib2 import HTTPError, Request
+    from urllib2 import urlopen as urllib_urlopen
+    from urlparse import urljoin, urlparse
+
+from cekit.config import Config
+from cekit.errors import CekitError
+
+logger = logging.getLogger('cekit')
+CONFIG = Config()
+
+# Maximum number of connections opened to a single host, unless the
+# 'http_max_connections' option is set
+DEFAULT_MAX_CONNECTIONS = 4
+
+# Maximum number of redirects followed for a single request
+MAX_REDIRECTS = 10
+
+REDIRECT_CODES = [301, 302, 303, 307, 308]
+
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+
+def ssl_context():
+    """
+    Returns SSL context honoring the 'ssl_verify' configuration option. Contexts
+    are created only once and shared by all connections.
+    """
+
+    verify = str(CONFIG.get('common', 'ssl_verify')).lower() != 'false'
+
+    with _contexts_lock:
+        if verify not in _contexts:
+            ctx = ssl.create_default_context()
+
+            if not verify:
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+
+            _contexts[verify] = ctx
+
+        return _contexts[verify]
+
+
+class ConnectionPool(object):
+    """
+    Pool of keep-alive HTTP(S) connections. Connections are reused by subsequent requests
+    to the same host, so that every request does not pay for a new TCP and TLS handshake.
+
+    Number of connections opened to a single host at the same time is limited, requests
+    exceeding the limit wait until a connection is returned to the pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._limits = {}
+
+    def _limit(self, key):
+        with self._lock:
+            if key not in self._limits:
+                self._limits[key] = threading.BoundedSemaphore(
+                    int(CONFIG.get('common', 'http_max_connections') or DEFAULT_MAX_CONNECTIONS))
+
+            return self._limits[key]
+
+    def _acquire(self, key, context):
+        """
+        Returns tuple of a connection to the host identified by the key and a flag
+        whether the connection was used before. Blocks while the host connection limit is reached.
+        """
+
+        self._limit(key).acquire()
+
+        with self._lock:
+            idle = self._idle.get(key)
+
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port = key
+
+        if scheme == 'https':
+            return HTTPSConnection(host, port, context=context), False
+
+        return HTTPConnection(host, port), False
+
+    def _release(self, key, connection, reuse):
+        """
+        Returns the connection to the pool (if it can be reused) or closes it.
+        """
+
+        if reuse:
+            with self._lock:
+                self._idle.setdefault(key, []).append(connection)
+        else:
+            connection.close()
+
+        self._limit(key).release()
+
+    def clear(self):
+        """
+        Closes all idle connections.
+        """
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def urlopen(self, url, context=None, timeout=None):
+        """
+        Opens the URL (or urllib Request object), in the same way as urllib's urlopen does.
+        Redirects are followed and HTTPError is raised for unsuccessful responses.
+        Timeout (in seconds) applies to blocking socket operations, the default
+        socket timeout is used if not provided.
+
+        Requests which should go through a proxy (configured with the usual environment
+        variables) are handed over to urllib.
+        """
+
+        request = url if isinstance(url, Request) else Request(url)
+        url = request.get_full_url()
+        method = request.get_method()
+        headers = dict(request.header_items())
+        body = request.data if hasattr(request, 'data') else request.get_data()
+
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed_url = urlparse(url)
+
+            if parsed_url.scheme not in ['http', 'https'] or \
+                    (parsed_url.scheme in getproxies() and not proxy_bypass(parsed_url.hostname)):
+                logger.debug("Opening '{}' without the connection pool".format(url))
+                return urllib_urlopen(self._urllib_request(url, method, body, headers), context=context,
+                                      timeout=timeout or socket.getdefaulttimeout())
+
+            key = (parsed_url.scheme, parsed_url.hostname,
+                   parsed_url.port or (443 if parsed_url.scheme == 'https' else 80))
+            path = parsed_url.path or '/'
+
+            if parsed_url.query:
+                path += '?' + parsed_url.query
+
+            response = self._request(key, context, timeout, method, path, body, headers)
+
+            if response.getcode() in REDIRECT_CODES and response.info().get('Location'):
+                response.read()
+                response.close()
+
+                url = urljoin(url, response.info().get('Location'))
+                logger.debug("Following redirect to '{}'".format(url))
+
+                if response.getcode() == 303 or (response.getcode() in [301, 302] and method not in ['GET', 'HEAD']):
+                    method = 'GET'
+                    body = None
+                    headers.pop('Content-length', None)
+                    headers.pop('Content-type', None)
+                elif body is not None and hasattr(body, 'seek'):
+                    body.seek(0)
+
+                continue
+
+            if not 200 <= response.getcode() < 300:
+                error_body = response.read()
+                response.close()
+
+                raise HTTPError(url, response.getcode(), response.reason, response.info(), io.BytesIO(error_body))
+
+            return response
+
+        raise CekitError("Too many redirects while opening '{}'".format(request.get_full_url()))
+
+    @staticmethod
+    def _urllib_request(url, method, body, headers):
+        request = Request(url, data=body, headers=headers)
+        request.get_method = lambda: method
+        return request
+
+    def _request(self, key, context, timeout, method, path, body, headers):
+        connection, reused = self._acquire(key, context)
+
+        # Reused connection could be opened with a different timeout
+        connection.timeout = timeout or socket.getdefaulttimeout()
+
+        if connection.sock:
+            connection.sock.settimeout(connection.timeout)
+
+        try:
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+            except (HTTPException, socket.error):
+                # Server could close an idle connection in the meantime,
+                # the request is repeated with a new connection in such case
+                replayable = body is None or isinstance(body, bytes) or hasattr(body, 'seek')
+
+                if not reused or not replayable:
+                    raise
+
+                logger.debug("Connection to '{}' was closed, reconnecting".format(key[1]))
+                connection.close()
+
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+        except Exception:
+            self._release(key, connection, False)
+            raise
+
+        return PooledResponse(self, key, connection, response)
+
+
+class PooledResponse(object):
+    """
+    Response to a request made using the connection pool. The connection is returned
+    to the pool once the whole response is read, or closed if the response is closed
+    before that.
+    """
+
+    def __init__(self, pool, key, connection, response):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.reason = response.reason
+
+    def read(self, size=None):
+        chunk = self._response.read() if size is None else self._response.read(size)
+
+        if not chunk or size is None:
+            self.close()
+
+        return chunk
+
+    def getcode(self):
+        return self._response.status
+
+    def info(self):
+        return self._response.msg
+
+    def close(self):
+        if self._connection is None:
+            return
+
+        complete = self._response.isclosed()
+
+        self._response.close()
+        self._pool._release(self._key, self._connection, complete and not self._response.will_close)
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_pool = ConnectionPool()
+
+
+def urlopen(url, context=None, timeout=None):
+    """
+    Opens the URL using the shared connection pool, see ConnectionPool.urlopen().
+    """
+    return _pool.urlopen(url, context or ssl_context(), timeout)
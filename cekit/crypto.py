@@ -5,16 +5,63 @@ logger = logging.getLogger('cekit')
 
 SUPPORTED_HASH_ALGORITHMS = ['sha512', 'sha256', 'sha1', 'md5']
 
+# Size of the buffer used to read files when computing checksums
+BUFFER_SIZE = 1048576  # 1 MB
 
-def get_sum(target, algorithm):
-    hash_function = getattr(hashlib, algorithm)()
 
-    logger.debug("Computing {} checksum for '{}' file".format(algorithm, target))
+class Digests(object):
+    """
+    Computes digests for multiple algorithms at the same time.
+
+    Data can be provided in chunks by calling the update() method
+    multiple times, every chunk is read only once.
+    """
 
-    with open(target, "rb") as f:
-        for chunk in iter(lambda: f.read(65536), b""):
+    def __init__(self, algorithms):
+        self._hashes = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+
+    def update(self, chunk):
+        for hash_function in self._hashes.values():
             hash_function.update(chunk)
-    return hash_function.hexdigest()
+
+    def update_from_file(self, target):
+        """ Updates digests with the whole content of the target file """
+
+        buf = bytearray(BUFFER_SIZE)
+        view = memoryview(buf)
+
+        with open(target, "rb") as f:
+            while True:
+                size = f.readinto(buf)
+
+                if not size:
+                    break
+
+                self.update(view[:size])
+
+    def hexdigests(self):
+        """ Returns dictionary of computed hex digests, keyed by algorithm """
+        return dict((algorithm, hash_function.hexdigest()) for algorithm, hash_function in self._hashes.items())
+
+
+def get_sums(target, algorithms):
+    """
+    Computes checksums for all requested algorithms reading the target file only once.
+
+    Returns dictionary of hex digests keyed by algorithm.
+    """
+
+    digests = Digests(algorithms)
+
+    logger.debug("Computing {} checksum(s) for '{}' file".format(", ".join(algorithms), target))
+
+    digests.update_from_file(target)
+
+    return digests.hexdigests()
+
+
+def get_sum(target, algorithm):
+    return get_sums(target, [algorithm])[algorithm]
 
 
 def check_sum(target, algorithm, expected, name=None):
@@ -23,16 +70,26 @@ def check_sum(target, algorithm, expected, name=None):
       alg - algorithm which will be used for diget
       expected_chksum - checksum which artifact must match
     """
+    return check_sums(target, {algorithm: expected}, name)
+
+
+def check_sums(target, expected, name=None):
+    """ Check that file checksums are correct, file is read only once
+    Args:
+      target - path to the file
+      expected - dictionary of checksums which artifact must match, keyed by algorithm
+    """
     if not name:
         name = target
-    logger.debug("Checking '{}' {} hash...".format(target, algorithm))
+    logger.debug("Checking '{}' {} hash(es)...".format(target, ", ".join(expected)))
 
-    checksum = get_sum(target, algorithm)
+    checksums = get_sums(target, list(expected))
 
-    if checksum.lower() != expected.lower():
-        logger.error("The {} computed for the '{}' file ('{}') doesn't match the '{}' value".
-                     format(algorithm, target, checksum, expected))
-        return False
+    for algorithm, checksum in checksums.items():
+        if checksum.lower() != expected[algorithm].lower():
+            logger.error("The {} computed for the '{}' file ('{}') doesn't match the '{}' value".
+                         format(algorithm, target, checksum, expected[algorithm]))
+            return False
 
     logger.debug("Hash is correct.")
     return True
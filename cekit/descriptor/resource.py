@@ -1,28 +1,42 @@
 import json
 import logging
 import os
+import re
 import shutil
-import ssl
-import subprocess
+import time
 
 try:
     from urllib.parse import urlparse
-    from urllib.request import urlopen
+    from urllib.request import Request
+    from urllib.error import HTTPError
 except ImportError:
     from urlparse import urlparse
-    from urllib2 import urlopen
+    from urllib2 import Request, HTTPError
 
 from cekit.config import Config
-from cekit.crypto import SUPPORTED_HASH_ALGORITHMS, check_sum
+from cekit.connections import ssl_context, urlopen
+from cekit.crypto import BUFFER_SIZE, SUPPORTED_HASH_ALGORITHMS, Digests, check_sums
 from cekit.descriptor import Descriptor
 from cekit.errors import CekitError
-from cekit.tools import get_brew_url, Map, Chdir
+from cekit.tools import BrewArtifactNotFoundError, Map
 
 logger = logging.getLogger('cekit')
 config = Config()
 
 artifact_dest = '/tmp/artifacts/'
 
+# Source name used to record artifacts missing in Brew
+BREW_SOURCE = 'brew'
+
+# Number of attempts to download a file, if the interrupted download can be resumed
+DOWNLOAD_ATTEMPTS = 3
+
+
+class ChecksumMismatchError(CekitError):
+    """
+    Raised when checksums of a fetched artifact do not match the expected ones.
+    """
+
 
 def create_resource(descriptor, **kwargs):
     """
@@ -193,28 +207,37 @@ class Resource(Descriptor):
 
         if os.path.exists(target) and self.__verify(target):
             logger.debug("Local resource '{}' exists and is valid".format(self.name))
+            # The artifact is still in use, it should not be evicted from the cache
+            self.cache.touch(self)
             return target
 
-        cached_resource = self.cache.cached(self)
+        # Only one process at a time can fetch the artifact into the cache,
+        # others wait for it and use the cached artifact afterwards
+        with self.cache.lock(self):
+            cached_resource = self.cache.cached(self)
 
-        if cached_resource:
-            shutil.copy(cached_resource['cached_path'],
-                        target)
-            logger.info("Using cached artifact '{}'.".format(self.name))
-
-        else:
-            try:
-                self.cache.add(self)
-                cached_resource = self.cache.get(self)
-                shutil.copy(cached_resource['cached_path'],
-                            target)
+            if cached_resource:
+                self.cache.materialize(cached_resource['cached_path'], target)
+                self.cache.record(self.name, hit=True, served=os.path.getsize(cached_resource['cached_path']))
                 logger.info("Using cached artifact '{}'.".format(self.name))
-            except ValueError:
-                return self.guarded_copy(target)
+
+            else:
+                if set(SUPPORTED_HASH_ALGORITHMS).intersection(self):
+                    self.cache.record(self.name, hit=False)
+
+                try:
+                    self.cache.add(self)
+                    cached_resource = self.cache.get(self)
+                    self.cache.materialize(cached_resource['cached_path'], target)
+                    logger.info("Using cached artifact '{}'.".format(self.name))
+                except ValueError:
+                    return self.guarded_copy(target)
 
     def guarded_copy(self, target):
         try:
             self._copy_impl(target)
+        except ChecksumMismatchError:
+            raise
         except Exception as ex:
             logger.warning("Cekit is not able to fetch resource '{}' automatically. "
                            "Please use cekit-cache command to add this artifact manually.".format(self.name))
@@ -243,10 +266,23 @@ class Resource(Descriptor):
         if os.path.isdir(target):
             logger.info("Target is directory, cannot verify checksum.")
             return True
-        for algorithm in SUPPORTED_HASH_ALGORITHMS:
-            if algorithm in self and self[algorithm]:
-                if not check_sum(target, algorithm, self[algorithm], self['name']):
-                    return False
+        # All checksums are verified reading the file only once
+        expected = dict((algorithm, self[algorithm])
+                        for algorithm in SUPPORTED_HASH_ALGORITHMS if algorithm in self and self[algorithm])
+
+        if not config.get('common', 'paranoid') and self.cache.verified(target, expected):
+            logger.debug("Checksums of '{}' were already verified and the file did not change since, "
+                         "skipping verification".format(target))
+            return True
+
+        start = time.time()
+        valid = check_sums(target, expected, self['name'])
+        self.cache.record(self.name, hash_time=time.time() - start)
+
+        if not valid:
+            return False
+
+        self.cache.mark_verified(target, expected)
         return True
 
     def __substitute_cache_url(self, url):
@@ -266,11 +302,51 @@ class Resource(Descriptor):
 
         return url
 
-    def _download_file(self, url, destination, use_cache=True):
-        """ Downloads a file from url and save it as destination """
+    def _checksum_key(self):
+        """
+        Returns a string identifying the artifact by its first supported checksum,
+        None if the artifact does not define any checksum.
+        """
+
+        for algorithm in SUPPORTED_HASH_ALGORITHMS:
+            if self.get(algorithm):
+                return "{}:{}".format(algorithm, self[algorithm].lower())
+
+        return None
+
+    def _download_file(self, url, destination, use_cache=True, headers=None):
+        """
+        Downloads a file from url and save it as destination. Additional
+        request headers can be provided for HTTP(S) URLs, in such case
+        headers of the response are returned.
+        """
+        cache_url = None
+
         if use_cache:
             url = self.__substitute_cache_url(url)
+            cache_url = config.get('common', 'cache_url')
+
+        checksum_key = self._checksum_key() if cache_url else None
 
+        # Do not ask cacher again for an artifact it recently did not have
+        if checksum_key and self.cache.known_miss(cache_url, checksum_key):
+            raise CekitError("Artifact {} was recently not found in cacher, skipping".format(self.name))
+
+        try:
+            start = time.time()
+            info = self.__download(url, destination, headers)
+
+            if os.path.isfile(destination):
+                self.cache.record(self.name, downloaded=os.path.getsize(destination),
+                                  download_time=time.time() - start)
+
+            return info
+        except Exception:
+            if checksum_key:
+                self.cache.record_miss(cache_url, checksum_key)
+            raise
+
+    def __download(self, url, destination, headers=None):
         if not url:
             raise CekitError("Artifact %s cannot be downloaded, no URL provided" % self.name)
 
@@ -282,40 +358,173 @@ class Resource(Descriptor):
             if os.path.isdir(parsed_url.path):
                 shutil.copytree(parsed_url.path, destination)
             else:
-                shutil.copy(parsed_url.path, destination)
+                self._copy_file(parsed_url.path, destination)
         elif parsed_url.scheme in ['http', 'https']:
-            verify = config.get('common', 'ssl_verify')
-            if str(verify).lower() == 'false':
-                verify = False
+            attempt = 1
 
-            ctx = ssl.create_default_context()
+            while True:
+                try:
+                    return self.__download_http(url, destination, ssl_context(), headers)
+                except Exception as ex:
+                    # Only downloads which made progress that can be resumed are retried
+                    if attempt >= DOWNLOAD_ATTEMPTS or not self.cache.load_partial(destination, url):
+                        raise
 
-            if not verify:
-                ctx.check_hostname = False
-                ctx.verify_mode = ssl.CERT_NONE
+                    logger.warning("Download of '{}' was interrupted ({}), resuming...".format(url, ex))
+                    attempt += 1
+        else:
+            raise CekitError("Unsupported URL scheme: {}".format(url))
 
-            res = urlopen(url, context=ctx)
+    def __download_http(self, url, destination, ctx, headers=None):
+        """
+        Downloads the file over HTTP(S). Downloads to staging files of the cache
+        (see ArtifactCache.partial_path()) are resumable: if such download is interrupted,
+        the partially downloaded file is kept and the download continues from where it
+        stopped using a Range request, provided the server supports it and the file did
+        not change in the meantime.
+        """
 
-            if res.getcode() != 200:
-                raise CekitError("Could not download file from %s" % url)
+        resumable = self.cache.resumable(destination)
+        # Staging files belong to artifacts with checksums, a download started from one
+        # mirror can be resumed from another one, the content is verified at the end anyway
+        partial = self.cache.load_partial(destination) if resumable else None
+        request_headers = dict(headers or {})
 
-            try:
-                with open(destination, 'wb') as f:
-                    while True:
-                        chunk = res.read(1048576)  # 1 MB
-                        if not chunk:
-                            break
-                        f.write(chunk)
-            except Exception:
-                try:
-                    logger.debug("Removing incompletely downloaded '{}' file".format(destination))
-                    os.remove(destination)
-                except OSError:
-                    logger.warning("An error occurred while removing file '{}'".format(destination))
+        if partial:
+            logger.info("Resuming download of '{}' from byte {} of {}".format(
+                url, os.path.getsize(destination), partial['size']))
+            request_headers['Range'] = "bytes={}-".format(os.path.getsize(destination))
+
+            # Validators are specific to the server which provided them
+            if partial['url'] == url:
+                request_headers['If-Range'] = partial['validator']
+
+        res = urlopen(Request(url, headers=request_headers) if request_headers else url, context=ctx)
+        mode = 'wb'
+
+        if partial and res.getcode() == 206:
+            mode = 'ab'
+
+            if partial['url'] != url and self.__validator(res.info()):
+                self.cache.save_partial(destination, url, partial['size'], self.__validator(res.info()))
+        elif res.getcode() != 200:
+            res.close()
+            raise CekitError("Could not download file from %s" % url)
+        elif resumable:
+            # The whole file is sent, remember how to resume it if the download is interrupted
+            self.cache.discard_partial(destination)
+
+            info = res.info()
+
+            if info.get('Accept-Ranges') == 'bytes' and info.get('Content-Length') and self.__validator(info):
+                self.cache.save_partial(destination, url, int(info.get('Content-Length')), self.__validator(info))
+
+        digests = Digests(SUPPORTED_HASH_ALGORITHMS)
 
+        try:
+            if mode == 'ab':
+                # Digests continue from the already downloaded part of the file
+                digests.update_from_file(destination)
+
+            length = res.info().get('Content-Length')
+            self.__stream(res, destination, mode, digests, int(length) if length else None)
+        except Exception:
+            # Connection cannot be reused after an incomplete read
+            res.close()
+
+            if self.cache.load_partial(destination, url):
+                logger.debug("Keeping incompletely downloaded '{}' file to resume the download later".format(
+                    destination))
                 raise
-        else:
-            raise CekitError("Unsupported URL scheme: {}".format(url))
+
+            try:
+                logger.debug("Removing incompletely downloaded '{}' file".format(destination))
+                os.remove(destination)
+            except OSError:
+                logger.warning("An error occurred while removing file '{}'".format(destination))
+
+            raise
+
+        if resumable:
+            self.cache.discard_partial(destination)
+
+        self.__check_digests(destination, digests)
+
+        return res.info()
+
+    @staticmethod
+    def __validator(info):
+        """
+        Returns validator (strong ETag or Last-Modified value) from response headers, which
+        can be used to make sure that a resumed download continues the same file.
+        """
+
+        etag = info.get('ETag')
+
+        return etag if etag and not etag.startswith('W/') else info.get('Last-Modified')
+
+    def _copy_file(self, source, destination, copy_metadata=shutil.copymode):
+        """
+        Copies the source file to the destination, checking its checksums on the way.
+        """
+
+        with open(source, 'rb') as f:
+            digests = self.__stream(f, destination)
+
+        copy_metadata(source, destination)
+
+        self.__check_digests(destination, digests)
+
+    @staticmethod
+    def __stream(source, destination, mode='wb', digests=None, size=None):
+        """
+        Writes all data read from the source file object to the destination file,
+        feeding the digests with it. Returns the digests.
+
+        If the expected size is provided, IOError is raised when the source ends
+        before it (the connection was closed in the middle of a download for example).
+        """
+
+        digests = digests or Digests(SUPPORTED_HASH_ALGORITHMS)
+        received = 0
+
+        with open(destination, mode) as f:
+            while True:
+                chunk = source.read(BUFFER_SIZE)
+                if not chunk:
+                    break
+                digests.update(chunk)
+                f.write(chunk)
+                received += len(chunk)
+
+        if size is not None and received < size:
+            raise IOError("Incomplete read, received {} of {} bytes".format(received, size))
+
+        return digests
+
+    def __check_digests(self, target, digests):
+        """
+        Compares checksums computed while the target file was written with the expected
+        ones, so that a corrupted file is rejected right after it is fetched.
+
+        Checksums for all supported algorithms are remembered, so that the file does not
+        need to be read again to verify it or to add it to the cache.
+        """
+
+        if not set(SUPPORTED_HASH_ALGORITHMS).intersection(self):
+            return
+
+        checksums = digests.hexdigests()
+
+        if Resource.CHECK_INTEGRITY:
+            for algorithm in SUPPORTED_HASH_ALGORITHMS:
+                if self.get(algorithm) and self[algorithm].lower() != checksums[algorithm]:
+                    logger.error("The {} computed for the '{}' file ('{}') doesn't match the '{}' value".
+                                 format(algorithm, target, checksums[algorithm], self[algorithm]))
+                    os.remove(target)
+                    raise ChecksumMismatchError('Artifact checksum verification failed!')
+
+        self.cache.mark_verified(target, checksums)
 
 
 class _PathResource(Resource):
@@ -377,7 +586,7 @@ class _PathResource(Resource):
         if os.path.isdir(self.path):
             shutil.copytree(self.path, target)
         else:
-            shutil.copy2(self.path, target)
+            self._copy_file(self.path, target, shutil.copystat)
         return target
 
 
@@ -393,6 +602,8 @@ class _UrlResource(Resource):
             'dest': {'type': 'str', 'desc': 'Destination directory inside of the container', 'default': artifact_dest},
             'description': {'type': 'str', 'desc': 'Description of the resource'},
             'url': {'type': 'str', 'required': True, 'desc': 'URL where the resource can be found'},
+            'mirrors': {'type': 'seq', 'sequence': [{'type': 'str'}],
+                        'desc': 'Alternative URLs where the resource can be found'},
             'md5': {'type': 'str', 'desc': 'The md5 checksum of the resource'},
             'sha1': {'type': 'str', 'desc': 'The sha1 checksum of the resource'},
             'sha256': {'type': 'str', 'desc': 'The sha256 checksum of the resource'},
@@ -411,6 +622,62 @@ class _UrlResource(Resource):
     def download_file(self, url, destination):
         return self._download_file(url, destination, False)
 
+    def remote_checksums(self):
+        """
+        Returns dictionary of checksums (for all supported algorithms) of the file at the artifact
+        URL. The file is only streamed through the digests, it is never written to disk.
+
+        Checksums are remembered by URL and revalidated with a conditional request (using the ETag
+        and Last-Modified headers returned with the file), the file is downloaded again only if it changed.
+        """
+
+        with self.cache.lock_url(self.url):
+            cached = self.cache.get_url_checksums(self.url)
+            headers = {}
+
+            if cached:
+                if cached.get('etag'):
+                    headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'):
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+            try:
+                res = urlopen(Request(self.url, headers=headers) if headers else self.url, context=ssl_context())
+            except HTTPError as ex:
+                if not cached or ex.code != 304:
+                    raise
+
+                logger.info("Artifact '{}' did not change, using remembered checksums".format(self.name))
+                return cached['checksums']
+
+            logger.info("Computing checksums of artifact '{}' from '{}'".format(self.name, self.url))
+
+            digests = Digests(SUPPORTED_HASH_ALGORITHMS)
+            size = 0
+            start = time.time()
+
+            try:
+                while True:
+                    chunk = res.read(BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    digests.update(chunk)
+                    size += len(chunk)
+            finally:
+                res.close()
+
+            self.cache.record(self.name, downloaded=size, download_time=time.time() - start)
+
+            checksums = digests.hexdigests()
+            etag = res.info().get('ETag')
+            last_modified = res.info().get('Last-Modified')
+
+            # Without these headers the checksums could not be revalidated
+            if etag or last_modified:
+                self.cache.add_url_checksums(self.url, checksums, etag, last_modified)
+
+            return checksums
+
     def _get_default_name_value(self, descriptor):
         """
         Default identifier is the last part (most probably file name) of the URL.
@@ -418,6 +685,15 @@ class _UrlResource(Resource):
         return os.path.basename(descriptor.get('url'))
 
     def _copy_impl(self, target):
+        if not set(SUPPORTED_HASH_ALGORITHMS).intersection(self) and \
+                urlparse(self.url).scheme in ['http', 'https']:
+            return self._copy_revalidated(target)
+
+        urls = self._mirror_urls()
+
+        if len(urls) > 1:
+            return self._copy_from_mirrors(urls, target)
+
         try:
             self._download_file(self.url, target)
         except:
@@ -425,6 +701,111 @@ class _UrlResource(Resource):
             self._download_file(self.url, target, use_cache=False)
         return target
 
+    def _mirror_urls(self):
+        """
+        Returns list of URLs the artifact can be downloaded from: its URL, mirrors defined
+        for the artifact and mirrors configured in the 'mirrors' configuration section.
+
+        Every configured mirror entry is a list of URL prefixes, the first one is the prefix
+        of the origin URLs, the remaining ones are prefixes of mirror URLs replacing it.
+        """
+
+        urls = [self.url] + [url.strip() for url in self.get('mirrors') or []]
+
+        for name, value in (config.get('mirrors') or {}).items():
+            prefixes = re.split(r'[\s,]+', value.strip())
+
+            if name == '__name__' or len(prefixes) < 2:
+                continue
+
+            if self.url.startswith(prefixes[0]):
+                urls += [prefix + self.url[len(prefixes[0]):] for prefix in prefixes[1:]]
+
+        unique = []
+
+        for url in urls:
+            if url not in unique:
+                unique.append(url)
+
+        return unique
+
+    def _copy_from_mirrors(self, urls, target):
+        """
+        Downloads the artifact from the fastest mirror (the origin URL is one of them too).
+        If the download fails, even in the middle of the transfer, next fastest mirror is used.
+        """
+
+        if config.get('common', 'cache_url'):
+            try:
+                self._download_file(self.url, target)
+                return target
+            except:
+                logger.debug("Cannot hit artifact: '{}' via cache, trying mirrors.".format(self.name))
+
+        error = None
+
+        for url in self.cache.rank_urls(urls):
+            logger.info("Downloading artifact '{}' from '{}'".format(self.name, url))
+
+            try:
+                self._download_file(url, target, use_cache=False)
+                return target
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.warning("Could not download artifact '{}' from '{}': {}".format(self.name, url, ex))
+                self.cache.record_latency(url, None)
+                error = ex
+
+        raise error
+
+    def _copy_revalidated(self, target):
+        """
+        Artifacts without checksums cannot be cached by their content, these are cached by URL
+        instead. The cached file is revalidated with a conditional request (using the ETag
+        and Last-Modified headers returned with the file) and downloaded again only if it changed.
+        """
+
+        with self.cache.lock_url(self.url):
+            cached_url = self.cache.get_url(self.url)
+            headers = {}
+
+            if cached_url:
+                if cached_url.get('etag'):
+                    headers['If-None-Match'] = cached_url['etag']
+                if cached_url.get('last_modified'):
+                    headers['If-Modified-Since'] = cached_url['last_modified']
+
+            staging_file = self.cache.url_path(self.url) + '.part'
+
+            try:
+                info = self._download_file(self.url, staging_file, use_cache=False, headers=headers)
+            except HTTPError as ex:
+                if not cached_url or ex.code != 304:
+                    raise
+
+                logger.info("Artifact '{}' did not change, using cached file".format(self.name))
+            except Exception as ex:
+                if not cached_url:
+                    raise
+
+                logger.warning("Could not revalidate artifact '{}', using cached file: {}".format(self.name, ex))
+            else:
+                etag = info.get('ETag')
+                last_modified = info.get('Last-Modified')
+
+                if not (etag or last_modified):
+                    # Nothing to revalidate the file with, it cannot be cached
+                    shutil.move(staging_file, target)
+                    return target
+
+                cached_url = self.cache.add_url(self.url, staging_file, etag, last_modified)
+            finally:
+                if os.path.exists(staging_file):
+                    os.remove(staging_file)
+
+            self.cache.materialize(cached_url['cached_path'], target)
+
+        return target
+
 
 class _GitResource(Resource):
 
@@ -452,15 +833,8 @@ class _GitResource(Resource):
         return os.path.basename(descriptor.get('git', {}).get('url')).split(".", 1)[0]
 
     def _copy_impl(self, target):
-        cmd = ['git', 'clone', self.git.url, target]
-        logger.debug("Cloning Git repository: '{}'".format(' '.join(cmd)))
-        subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-
-        with Chdir(target):
-            cmd = ['git', 'checkout', self.git.ref]
-            logger.debug("Checking out '{}' ref: '{}'".format(self.git.ref, ' '.join(cmd)))
-            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-
+        from cekit.cache.repository import RepositoryCache
+        RepositoryCache().checkout(self.git.url, self.git.ref, target)
         return target
 
 
@@ -500,17 +874,27 @@ class _PlainResource(Resource):
         # Next option is to download it from Brew directly but only if the md5 checkum
         # is provided and we are running with the --redhat switch
         if self.md5 and config.get('common', 'redhat'):
-            logger.debug("Trying to download artifact '{}' from Brew directly".format(self.name))
+            # Brew is queried by the md5 checksum, misses are recorded by it too
+            brew_key = "md5:{}".format(self.md5.lower())
 
-            try:
-                # Generate the URL
-                url = get_brew_url(self.md5)
-                # Use the URL to download the file
-                self._download_file(url, target, use_cache=False)
-                return target
-            except Exception as e:
-                logger.debug(str(e))
-                logger.warning("Could not download artifact '{}' from Brew".format(self.name))
+            if self.cache.known_miss(BREW_SOURCE, brew_key):
+                logger.warning("Artifact '{}' was recently not found in Brew, skipping".format(self.name))
+            else:
+                logger.debug("Trying to download artifact '{}' from Brew directly".format(self.name))
+
+                try:
+                    # Generate the URL
+                    url = self.cache.brew_url(self.md5)
+                    # Use the URL to download the file
+                    self._download_file(url, target, use_cache=False)
+                    return target
+                except BrewArtifactNotFoundError as e:
+                    logger.debug(str(e))
+                    logger.warning("Artifact '{}' could not be found in Brew".format(self.name))
+                    self.cache.record_miss(BREW_SOURCE, brew_key)
+                except Exception as e:
+                    logger.debug(str(e))
+                    logger.warning("Could not download artifact '{}' from Brew".format(self.name))
 
         raise CekitError("Artifact {} could not be found".format(self.name))
 
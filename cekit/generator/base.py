@@ -5,20 +5,28 @@ import os
 import platform
 import re
 import shutil
+import threading
+from multiprocessing.pool import ThreadPool
 
 from jinja2 import Environment, FileSystemLoader
 from packaging.version import LegacyVersion, parse as parse_version
 
 from cekit import tools
+from cekit.cache.artifact import ArtifactCache
+from cekit.cache.repository import RepositoryCache
 from cekit.config import Config
 from cekit.descriptor import Env, Image, Label, Module, Overrides, Repository
 from cekit.errors import CekitError
+from cekit.log import log_context
 from cekit.template_helper import TemplateHelper
 from cekit.version import __version__ as cekit_version
 
 LOGGER = logging.getLogger('cekit')
 CONFIG = Config()
 
+# Number of artifacts fetched at the same time, unless the 'fetch_jobs' option is set
+DEFAULT_FETCH_JOBS = 4
+
 
 try:
     from odcs.client.odcs import ODCS, AuthMech
@@ -133,11 +141,13 @@ class Generator(object):
         self.add_build_labels()
 
     def generate(self, builder):  # pylint: disable=unused-argument
+        ArtifactCache.reset_report()
         self.copy_modules()
         self.prepare_artifacts()
         self.prepare_repositories()
         self.image.remove_none_keys()
         self.image.write(os.path.join(self.target, 'image.yaml'))
+        ArtifactCache.write_report(os.path.join(self.target, 'cache-report.json'))
         self.render_dockerfile()
         self.render_help()
 
@@ -204,26 +214,108 @@ class Generator(object):
         return repositories
 
     def build_module_registry(self):
+        """
+        Fetches all module repositories and adds modules found in them to the module registry.
+
+        Up to 'fetch_jobs' repositories are fetched at the same time. Modules are registered
+        in order of repositories, as soon as all preceding repositories are ready, so that
+        the default module versions do not depend on the order in which repositories land.
+        """
+
         base_dir = os.path.join(self.target, 'repo')
         if not os.path.exists(base_dir):
             os.makedirs(base_dir)
-        for repo in self._module_repositories():
-            LOGGER.debug("Downloading module repository: '{}'".format(repo.name))
-            repo.copy(base_dir)
-            self.load_repository(os.path.join(base_dir, repo.target))
+
+        repositories = self._module_repositories()
+        failed = threading.Event()
+
+        def fetch(repo):
+            # Repositories waiting in the queue are not fetched after a failure
+            if failed.is_set():
+                return []
+
+            with log_context(repo.name):
+                try:
+                    if repo.get('git'):
+                        return self._repository_snapshot(repo, base_dir)
+
+                    LOGGER.debug("Downloading module repository: '{}'".format(repo.name))
+                    repo.copy(base_dir)
+                    return self._find_modules(os.path.join(base_dir, repo.target))
+                except Exception:
+                    failed.set()
+                    raise
+
+        jobs = int(CONFIG.get('common', 'fetch_jobs') or DEFAULT_FETCH_JOBS)
+        pool = ThreadPool(min(jobs, len(repositories)) or 1)
+
+        try:
+            for modules in pool.imap(fetch, repositories):
+                for module in modules:
+                    self._add_module(module)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _repository_snapshot(self, repo, base_dir):
+        """
+        Returns modules found in a Git module repository. Modules found in a commit are saved
+        in the repository cache, so that every commit is scanned only once.
+
+        The checkout of the commit is linked into the base directory, where other module
+        repositories are copied, so that files from the repository root (tests) are found there too.
+        """
+
+        cache = RepositoryCache()
+        commit, repo_dir = cache.snapshot(repo.git.url, repo.git.ref)
+        link = os.path.join(base_dir, repo.target)
+
+        if os.path.islink(link) or os.path.isfile(link):
+            os.remove(link)
+        elif os.path.isdir(link):
+            shutil.rmtree(link)
+
+        os.symlink(repo_dir, link)
+        modules = cache.load_modules(commit)
+
+        if modules is None:
+            LOGGER.debug("Scanning module repository '{}' at commit {}".format(repo.name, commit))
+            modules = self._find_modules(repo_dir)
+            cache.save_modules(commit, modules)
+        else:
+            LOGGER.debug("Using snapshot of module repository '{}' at commit {}".format(repo.name, commit))
+
+        return modules
 
     def load_repository(self, repo_dir):
+        for module in self._find_modules(repo_dir):
+            self._add_module(module)
+
+    @staticmethod
+    def _find_modules(repo_dir):
+        """
+        Returns list of modules found in the directory, every module is a dictionary with
+        the module descriptor and paths expected by the Module constructor.
+        """
+
+        modules = []
+
         for modules_dir, _, files in os.walk(repo_dir):
             if 'module.yaml' in files:
 
                 module_descriptor_path = os.path.abspath(os.path.expanduser(
                     os.path.normcase(os.path.join(modules_dir, 'module.yaml'))))
 
-                module = Module(tools.load_descriptor(module_descriptor_path),
-                                modules_dir,
-                                os.path.dirname(module_descriptor_path))
-                LOGGER.debug("Adding module '{}', path: '{}'".format(module.name, module.path))
-                self._module_registry.add_module(module)
+                modules.append({'descriptor': tools.load_descriptor(module_descriptor_path),
+                                'path': modules_dir,
+                                'artifact_dir': os.path.dirname(module_descriptor_path)})
+
+        return modules
+
+    def _add_module(self, module):
+        module = Module(module['descriptor'], module['path'], module['artifact_dir'])
+        LOGGER.debug("Adding module '{}', path: '{}'".format(module.name, module.path))
+        self._module_registry.add_module(module)
 
     def get_tags(self):
         return ["%s:%s" % (self.image['name'], self.image[
@@ -491,6 +583,66 @@ class Generator(object):
     def prepare_artifacts(self):
         raise NotImplementedError("Artifacts handling is not implemented")
 
+    def fetch_artifacts(self, handler):
+        """
+        Calls the handler for every artifact defined in all images (builder images
+        as well as the target image) and returns list of results in order of artifacts.
+
+        Up to 'fetch_jobs' artifacts are handled at the same time. Identical artifacts
+        are handled only once, the first failure cancels handling of remaining artifacts.
+        """
+
+        artifacts = []
+        duplicates = {}
+
+        for image in self.images:
+            for artifact in image.all_artifacts:
+                key = tuple(sorted((name, str(value)) for name, value in artifact.items()))
+
+                if key in duplicates:
+                    LOGGER.debug("Artifact '{}' is defined multiple times, fetching it only once".format(
+                        artifact['name']))
+                    duplicates[key].append(artifact)
+                    continue
+
+                duplicates[key] = []
+                artifacts.append((key, artifact))
+
+        failed = threading.Event()
+
+        def fetch(indexed_artifact):
+            index, artifact = indexed_artifact
+
+            # Artifacts waiting in the queue are not fetched after a failure
+            if failed.is_set():
+                return index, None
+
+            with log_context(artifact['name']):
+                try:
+                    return index, handler(artifact)
+                except Exception:
+                    failed.set()
+                    raise
+
+        jobs = int(CONFIG.get('common', 'fetch_jobs') or DEFAULT_FETCH_JOBS)
+        results = [None] * len(artifacts)
+        pool = ThreadPool(min(jobs, len(artifacts)) or 1)
+
+        try:
+            for index, result in pool.imap_unordered(fetch, enumerate(artifact for _, artifact in artifacts)):
+                results[index] = result
+        finally:
+            pool.terminate()
+            pool.join()
+
+        # Handlers can modify artifacts (for example the target), apply the changes to duplicates too
+        for key, artifact in artifacts:
+            for duplicate in duplicates[key]:
+                for name, value in artifact.items():
+                    duplicate[name] = value
+
+        return results
+
 
 class ModuleRegistry(object):
     def __init__(self):
@@ -2,15 +2,16 @@ import fileinput
 import logging
 import os
 import sys
-import tempfile
 
 import yaml
 
 from cekit import crypto
+from cekit.cache.artifact import ArtifactCache
 from cekit.config import Config
 from cekit.descriptor.resource import _PlainResource, _UrlResource
+from cekit.errors import CekitError
 from cekit.generator.base import Generator
-from cekit.tools import get_brew_url, copy_recursively
+from cekit.tools import copy_recursively
 
 logger = logging.getLogger('cekit')
 config = Config()
@@ -73,53 +74,14 @@ class OSBSGenerator(Generator):
         fetch_artifacts_url = []
         url_description = {}
 
-        for image in self.images:
-            for artifact in image.all_artifacts:
-                logger.info("Preparing artifact '{}' (of type {})".format(artifact['name'], type(artifact)))
-
-                if isinstance(artifact, _UrlResource):
-                    intersected_hash = [x for x in crypto.SUPPORTED_HASH_ALGORITHMS if x in artifact]
-                    logger.debug("Found checksum markers of {}".format(intersected_hash))
-                    if not intersected_hash:
-                        logger.warning("No md5 supplied for {}, calculating from the remote artifact".format(artifact['url']))
-                        intersected_hash = ["md5"]
-                        tmpfile = tempfile.NamedTemporaryFile()
-                        try:
-                            artifact.download_file(artifact['url'], tmpfile.name)
-                            artifact["md5"] = crypto.get_sum(tmpfile.name, "md5")
-                        finally:
-                            tmpfile.close()
-
-                    fetch_artifacts_url.append({'url': artifact['url'],
-                                                'target': os.path.join(artifact['target'])})
-                    for c in intersected_hash:
-                        fetch_artifacts_url[len(fetch_artifacts_url) - 1].update({c: artifact[c]})
-                    if 'description' in artifact:
-                        url_description[artifact['url']] = artifact['description']
-                    logger.debug(
-                        "Artifact '{}' (as URL) added to fetch-artifacts-url.yaml with contents {}".format(
-                            artifact['target'], fetch_artifacts_url[len(fetch_artifacts_url) - 1]))
-                    # OSBS by default downloads all artifacts to artifacts/<target_path>
-                    artifact['target'] = os.path.join('artifacts', artifact['target'])
-                elif isinstance(artifact, _PlainResource) and config.get('common', 'redhat'):
-                    try:
-                        fetch_artifacts_url.append({'md5': artifact['md5'],
-                                                    'url': get_brew_url(artifact['md5']),
-                                                    'target': os.path.join(artifact['target'])})
-                        logger.debug(
-                            "Artifact '{}' (as plain) added to fetch-artifacts-url.yaml".format(artifact['target']))
-                        # OSBS by default downloads all artifacts to artifacts/<target_path>
-                        artifact['target'] = os.path.join('artifacts', artifact['target'])
-                    except:
-                        logger.warning("Plain artifact {} could not be found in Brew, trying to handle it using lookaside cache".
-                                       format(artifact['name']))
-                        artifact.copy(target_dir)
-                        # TODO: This is ugly, rewrite this!
-                        artifact['lookaside'] = True
-
-                else:
-                    logger.debug("Copying artifact {} to {}".format(artifact, target_dir))
-                    artifact.copy(target_dir)
+        brew_urls = self._brew_urls()
+
+        for fetch_artifact, description in self.fetch_artifacts(
+                lambda artifact: self._prepare_artifact(artifact, target_dir, brew_urls)):
+            if fetch_artifact:
+                fetch_artifacts_url.append(fetch_artifact)
+            if description:
+                url_description[fetch_artifact['url']] = description
 
         fetch_artifacts_file = os.path.join(self.target, 'image', 'fetch-artifacts-url.yaml')
 
@@ -133,3 +95,81 @@ class OSBSGenerator(Generator):
                         line = line.replace(key, key + ' # ' + value)
                         sys.stdout.write(line)
         logger.debug("Artifacts handled")
+
+    def _brew_urls(self):
+        """
+        Resolves Brew URLs of all plain artifacts at once. Returns dictionary of URLs
+        keyed by md5 checksums (see ArtifactCache.brew_urls()).
+        """
+
+        if not config.get('common', 'redhat'):
+            return {}
+
+        md5s = [artifact['md5'] for image in self.images for artifact in image.all_artifacts
+                if isinstance(artifact, _PlainResource)]
+
+        if not md5s:
+            return {}
+
+        try:
+            return ArtifactCache().brew_urls(md5s)
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.warning("Could not resolve artifacts in Brew: {}".format(ex))
+            return {}
+
+    def _prepare_artifact(self, artifact, target_dir, brew_urls):
+        """
+        Prepares single artifact. Returns tuple of the fetch-artifacts-url.yaml entry
+        (None if the artifact is not fetched by OSBS) and description of the artifact URL.
+        Brew URLs of plain artifacts are looked up in the provided dictionary.
+        """
+
+        logger.info("Preparing artifact '{}' (of type {})".format(artifact['name'], type(artifact)))
+
+        if isinstance(artifact, _UrlResource):
+            intersected_hash = [x for x in crypto.SUPPORTED_HASH_ALGORITHMS if x in artifact]
+            logger.debug("Found checksum markers of {}".format(intersected_hash))
+            if not intersected_hash:
+                logger.warning("No md5 supplied for {}, calculating from the remote artifact".format(artifact['url']))
+                intersected_hash = ["md5"]
+                artifact["md5"] = artifact.remote_checksums()["md5"]
+
+            fetch_artifact = {'url': artifact['url'],
+                              'target': os.path.join(artifact['target'])}
+            for c in intersected_hash:
+                fetch_artifact.update({c: artifact[c]})
+            logger.debug(
+                "Artifact '{}' (as URL) added to fetch-artifacts-url.yaml with contents {}".format(
+                    artifact['target'], fetch_artifact))
+            # OSBS by default downloads all artifacts to artifacts/<target_path>
+            artifact['target'] = os.path.join('artifacts', artifact['target'])
+            return fetch_artifact, artifact.get('description')
+        elif isinstance(artifact, _PlainResource) and config.get('common', 'redhat'):
+            try:
+                url = brew_urls.get(artifact['md5'])
+
+                if url is None:
+                    raise CekitError("Artifact {} was not resolved in Brew".format(artifact['name']))
+                if isinstance(url, CekitError):
+                    raise url
+
+                fetch_artifact = {'md5': artifact['md5'],
+                                  'url': url,
+                                  'target': os.path.join(artifact['target'])}
+                logger.debug(
+                    "Artifact '{}' (as plain) added to fetch-artifacts-url.yaml".format(artifact['target']))
+                # OSBS by default downloads all artifacts to artifacts/<target_path>
+                artifact['target'] = os.path.join('artifacts', artifact['target'])
+                return fetch_artifact, None
+            except:
+                logger.warning("Plain artifact {} could not be found in Brew, trying to handle it using lookaside cache".
+                               format(artifact['name']))
+                artifact.copy(target_dir)
+                # TODO: This is ugly, rewrite this!
+                artifact['lookaside'] = True
+
+        else:
+            logger.debug("Copying artifact {} to {}".format(artifact, target_dir))
+            artifact.copy(target_dir)
+
+        return None, None
@@ -1,9 +1,13 @@
 import logging
 import os
 import sys
+import threading
+from contextlib import contextmanager
 
 import colorlog
 
+_context = threading.local()
+
 
 # Source: http://stackoverflow.com/questions/1383254/logging-streamhandler-and-standard-streams
 # Adjusted
@@ -19,6 +23,34 @@ class SingleLevelFilter(logging.Filter):
             return record.levelno <= self.passlevel
 
 
+class ContextFilter(logging.Filter):
+    """
+    Adds the 'context' attribute to log records so that messages logged
+    inside of the log_context() block can be attributed to it, even if
+    multiple threads log at the same time.
+    """
+
+    def filter(self, record):
+        name = getattr(_context, 'name', None)
+        record.context = "[{}] ".format(name) if name else ""
+        return True
+
+
+@contextmanager
+def log_context(name):
+    """
+    Prefixes all messages logged by the current thread with the provided name.
+    """
+
+    previous = getattr(_context, 'name', None)
+    _context.name = name
+
+    try:
+        yield
+    finally:
+        _context.name = previous
+
+
 def setup_logging(color=True):
     handler_out = logging.StreamHandler(sys.stdout)
     handler_err = logging.StreamHandler(sys.stderr)
@@ -28,14 +60,17 @@ def setup_logging(color=True):
 
     if not color or os.environ.get('NO_COLOR'):
         formatter = logging.Formatter(
-            '%(asctime)s %(filename)s:%(lineno)-10s %(levelname)-5s %(message)s')
+            '%(asctime)s %(filename)s:%(lineno)-10s %(levelname)-5s %(context)s%(message)s')
     else:
         formatter = colorlog.ColoredFormatter(
-            '%(log_color)s%(asctime)s %(filename)s:%(lineno)-10s %(levelname)-5s %(message)s')
+            '%(log_color)s%(asctime)s %(filename)s:%(lineno)-10s %(levelname)-5s %(context)s%(message)s')
 
     handler_out.setFormatter(formatter)
     handler_err.setFormatter(formatter)
 
+    handler_out.addFilter(ContextFilter())
+    handler_err.addFilter(ContextFilter())
+
     logger = logging.getLogger("cekit")
     # Reset all handlers
     logger.handlers = []
@@ -1,8 +1,11 @@
+import errno
+import json
 import logging
 import os
 import shutil
 import subprocess
 import sys
+import threading
 
 import click
 
@@ -11,6 +14,12 @@ from yaml.representer import SafeRepresenter
 from distutils import dir_util
 from cekit.errors import CekitError
 
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, locking is not supported there
+    fcntl = None
+
 try:
     basestring
 except NameError:
@@ -18,6 +27,15 @@ except NameError:
 
 LOGGER = logging.getLogger('cekit')
 
+# ioctl request cloning content of a file on copy-on-write filesystems (btrfs, xfs), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+class BrewArtifactNotFoundError(CekitError):
+    """
+    Artifact with the requested md5 checksum does not exist in Brew.
+    """
+
 
 class Map(dict):
     """
@@ -64,51 +82,126 @@ def load_descriptor(descriptor):
     return data
 
 
+def parse_size(value):
+    """
+    Converts size provided as a number of bytes, optionally followed by
+    one of the K, M, G or T (binary) suffixes, to number of bytes.
+
+    Examples: 1024, 500M, 20G
+    """
+
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    size = str(value).strip().upper().rstrip('B')
+
+    try:
+        if size and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+        return int(size)
+    except ValueError:
+        raise CekitError("Invalid size: '{}', expected number of bytes optionally followed by "
+                         "K, M, G or T suffix".format(value))
+
+
+def parse_duration(value):
+    """
+    Converts duration provided as a number of seconds, optionally followed by
+    one of the s, m, h, d or w suffixes, to number of seconds.
+
+    Examples: 3600, 12h, 30d
+    """
+
+    units = {'S': 1, 'M': 60, 'H': 3600, 'D': 86400, 'W': 604800}
+    duration = str(value).strip().upper()
+
+    try:
+        if duration and duration[-1] in units:
+            return int(float(duration[:-1]) * units[duration[-1]])
+        return int(duration)
+    except ValueError:
+        raise CekitError("Invalid duration: '{}', expected number of seconds optionally followed by "
+                         "s, m, h, d or w suffix".format(value))
+
+
 def decision(question):
     """Asks user for a question returning True/False answed"""
     return click.confirm(question, show_default=True)
 
 
-def get_brew_url(md5):
+def _brew_multicall(method, calls):
+    """
+    Calls the Brew method once for every provided dictionary of keyword arguments, all
+    the calls are made in a single 'multiCall' request. Returns list of results in the same
+    order; a failed call results in a dictionary with 'faultCode' and 'faultString' keys,
+    a successful one in a single element list with the value returned by the method.
+    """
+
+    calls = [{'methodName': method, 'params': [dict(kwargs, __starstar=True)]} for kwargs in calls]
+    cmd = ['/usr/bin/brew', 'call', '--json-output', '--python', 'multiCall', "calls={!r}".format(calls)]
+
+    LOGGER.debug("Executing '{}'.".format(" ".join(cmd)))
+
+    return json.loads(subprocess.check_output(cmd).strip().decode("utf8"))
+
+
+def _brew_fault(result):
+    return result.get('faultString') if isinstance(result, dict) else None
+
+
+def get_brew_urls(md5s):
+    """
+    Returns dictionary of download URLs of artifacts with provided md5 checksums, resolved
+    in Brew. Instead of an URL, the dictionary contains a CekitError for every artifact which
+    cannot be downloaded from Brew (BrewArtifactNotFoundError if it does not exist there).
+
+    All the checksums are resolved with just two Brew calls: one listing archives and
+    one fetching builds of these archives.
+    """
+
+    md5s = list(md5s)
+    results = {}
+
+    if not md5s:
+        return results
+
+    LOGGER.debug("Getting brew details for artifacts with '{}' md5 sums".format(", ".join(md5s)))
+
     try:
-        LOGGER.debug("Getting brew details for an artifact with '{}' md5 sum".format(md5))
-        list_archives_cmd = ['/usr/bin/brew', 'call', '--json-output', 'listArchives',
-                             "checksum={}".format(md5), 'type=maven']
-        LOGGER.debug("Executing '{}'.".format(" ".join(list_archives_cmd)))
+        listed = _brew_multicall('listArchives', [{'checksum': md5, 'type': 'maven'} for md5 in md5s])
+    except subprocess.CalledProcessError as ex:
+        if ex.output is not None and 'AuthError' in str(ex.output):
+            LOGGER.warning(
+                "Brew authentication failed, please make sure you have a valid Kerberos ticket")
+        raise CekitError("Could not fetch archives for checksum {}".format(", ".join(md5s)), ex)
 
-        try:
-            json_archives = subprocess.check_output(list_archives_cmd).strip().decode("utf8")
-        except subprocess.CalledProcessError as ex:
-            if ex.output is not None and 'AuthError' in ex.output:
-                LOGGER.warning(
-                    "Brew authentication failed, please make sure you have a valid Kerberos ticket")
-            raise CekitError("Could not fetch archives for checksum {}".format(md5), ex)
-
-        archives = yaml.safe_load(json_archives)
-
-        if not archives:
-            raise CekitError("Artifact with md5 checksum {} could not be found in Brew".format(md5))
-
-        archive = archives[0]
-        build_id = archive['build_id']
-        filename = archive['filename']
-        group_id = archive['group_id']
-        artifact_id = archive['artifact_id']
-        version = archive['version']
+    archives = {}
 
-        get_build_cmd = ['brew', 'call', '--json-output',
-                         'getBuild', "buildInfo={}".format(build_id)]
+    for md5, result in zip(md5s, listed):
+        if _brew_fault(result):
+            results[md5] = CekitError("Could not fetch archives for checksum {}: {}".format(md5, _brew_fault(result)))
+        elif not result[0]:
+            results[md5] = BrewArtifactNotFoundError(
+                "Artifact with md5 checksum {} could not be found in Brew".format(md5))
+        else:
+            archives[md5] = result[0][0]
 
-        LOGGER.debug("Executing '{}'".format(" ".join(get_build_cmd)))
+    build_ids = sorted(set(archive['build_id'] for archive in archives.values()))
 
-        try:
-            json_build = subprocess.check_output(get_build_cmd).strip().decode("utf8")
-        except subprocess.CalledProcessError as ex:
-            raise CekitError("Could not fetch build {} from Brew".format(build_id), ex)
+    try:
+        builds = dict(zip(build_ids, _brew_multicall('getBuild', [{'buildInfo': build_id}
+                                                                  for build_id in build_ids]))) if build_ids else {}
+    except subprocess.CalledProcessError as ex:
+        raise CekitError("Could not fetch build {} from Brew".format(", ".join(str(b) for b in build_ids)), ex)
+
+    build_states = ['BUILDING', 'COMPLETE', 'DELETED', 'FAILED', 'CANCELED']
 
-        build = yaml.safe_load(json_build)
+    for md5, archive in archives.items():
+        build = builds[archive['build_id']]
 
-        build_states = ['BUILDING', 'COMPLETE', 'DELETED', 'FAILED', 'CANCELED']
+        if _brew_fault(build) or not build[0]:
+            results[md5] = CekitError("Could not fetch build {} from Brew".format(archive['build_id']))
+            continue
+
+        build = build[0]
 
         # State 1 means: COMPLETE which is the only success state. Other states are:
         #
@@ -118,21 +211,32 @@ def get_brew_url(md5):
         # 'FAILED': 3
         # 'CANCELED': 4
         if build['state'] != 1:
-            raise CekitError(
+            results[md5] = CekitError(
                 "Artifact with checksum {} was found in Koji metadata but the build is in incorrect state ({}) making "
                 "the artifact not available for downloading anymore".format(md5, build_states[build['state']]))
+            continue
+
+        version = archive['version']
 
-        package = build['package_name']
-        release = build['release']
+        results[md5] = 'http://download.devel.redhat.com/brewroot/packages/' + build['package_name'] + '/' + \
+            version.replace('-', '_') + '/' + build['release'] + '/maven/' + \
+            archive['group_id'].replace('.', '/') + '/' + \
+            archive['artifact_id'] + '/' + version + '/' + archive['filename']
+
+    return results
+
+
+def get_brew_url(md5):
+    """
+    Returns download URL of the artifact with provided md5 checksum, resolved in Brew.
+    See get_brew_urls().
+    """
+
+    url = get_brew_urls([md5])[md5]
+
+    if isinstance(url, CekitError):
+        raise url
 
-        url = 'http://download.devel.redhat.com/brewroot/packages/' + package + '/' + \
-            version.replace('-', '_') + '/' + release + '/maven/' + \
-            group_id.replace('.', '/') + '/' + \
-            artifact_id + '/' + version + '/' + filename
-    except subprocess.CalledProcessError as ex:
-        LOGGER.error("Can't fetch artifacts details from brew: '{}'.".format(
-                     ex.output))
-        raise ex
     return url
 
 
@@ -171,6 +275,29 @@ def copy_recursively(source_directory, destination_directory):
             shutil.copy2(src, dst)
 
 
+def reflink(source, destination):
+    """
+    Creates the destination file as a copy-on-write clone (reflink) of the source file.
+    No data is copied, both files share the same blocks until one of them is modified.
+
+    Raises OSError (or IOError) if the filesystem does not support reflinks.
+    """
+
+    if not fcntl:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except (IOError, OSError):
+                dst.close()
+                os.remove(destination)
+                raise
+
+    shutil.copymode(source, destination)
+
+
 class Chdir(object):
     """ Context manager for changing the current working directory """
 
@@ -186,6 +313,107 @@ class Chdir(object):
         os.chdir(self.savedPath)
 
 
+class FileLock(object):
+    """
+    Context manager holding an exclusive lock on the provided file. The lock
+    is respected by other processes as well as by other threads of the current process.
+
+    The lock is reentrant for a thread, entering it again while it is already held
+    by the current thread does nothing.
+
+    If 'blocking' is set to False, the context manager does not wait for the lock,
+    the value returned when entering it tells if the lock was acquired or not.
+
+    The lock file can be removed by the holder of the lock (see remove()), processes
+    waiting for the lock at that time lock the newly created file instead.
+    """
+
+    _held = threading.local()
+
+    def __init__(self, path, blocking=True, description=None):
+        self.path = os.path.abspath(path)
+        self.blocking = blocking
+        self.description = description or self.path
+        self._file = None
+
+    def _held_locks(self):
+        if not hasattr(FileLock._held, 'paths'):
+            FileLock._held.paths = set()
+        return FileLock._held.paths
+
+    def __enter__(self):
+        if self.path in self._held_locks():
+            return True
+
+        if not os.path.exists(os.path.dirname(self.path)):
+            try:
+                os.makedirs(os.path.dirname(self.path))
+            except OSError:
+                # Created concurrently
+                pass
+
+        while True:
+            self._file = open(self.path, 'a')
+
+            if not fcntl:
+                break
+
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError) as ex:
+                if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+
+                if not self.blocking:
+                    self._file.close()
+                    self._file = None
+                    return False
+
+                LOGGER.info("Waiting for {} to be released by other process...".format(self.description))
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+
+            if self._locked_current_file():
+                break
+
+            # Lock file was removed while waiting for it, lock the new one
+            self._file.close()
+
+        self._held_locks().add(self.path)
+        return True
+
+    def _locked_current_file(self):
+        try:
+            return os.fstat(self._file.fileno()).st_ino == os.stat(self.path).st_ino
+        except OSError:
+            return False
+
+    def remove(self):
+        """
+        Removes the lock file. Nothing is done unless the lock was acquired by this object
+        (and not just entered again by the thread already holding it).
+        """
+
+        if not self._file:
+            return
+
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __exit__(self, etype, value, traceback):
+        if not self._file:
+            return
+
+        self._held_locks().discard(self.path)
+
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+        self._file.close()
+        self._file = None
+
+
 class DependencyHandler(object):
     """
     External dependency manager. Understands on what platform are we currently
@@ -555,6 +555,7 @@ def test_osbs_builder_add_files_to_dist_git_when_it_is_a_directory(tmpdir, mocke
 
     res = mocker.Mock()
     res.getcode.return_value = 200
+    res.info.return_value = {}
     res.read.side_effect = [b'test', None]
 
     mocker.patch('cekit.descriptor.resource.urlopen', return_value=res)
@@ -594,6 +595,7 @@ def test_osbs_builder_add_artifact_directory_to_dist_git_when_it_already_exists(
 
     res = mocker.Mock()
     res.getcode.return_value = 200
+    res.info.return_value = {}
     res.read.side_effect = [b'test', None]
 
     mocker.patch('cekit.descriptor.resource.urlopen', return_value=res)
@@ -638,6 +640,7 @@ def test_osbs_builder_add_files_to_dist_git_without_dotgit_directory(tmpdir, moc
 
     res = mocker.Mock()
     res.getcode.return_value = 200
+    res.info.return_value = {}
     res.read.side_effect = [b'test', None]
 
     mocker.patch('cekit.descriptor.resource.urlopen', return_value=res)
@@ -713,7 +716,8 @@ def test_osbs_builder_with_fetch_artifacts_plain_file_creation(tmpdir, mocker, c
 
     mocker.patch('cekit.tools.decision', return_value=True)
     mocker.patch('cekit.descriptor.resource.urlopen')
-    mocker.patch('cekit.generator.osbs.get_brew_url', return_value='http://random.url/path')
+    mocker.patch('cekit.generator.osbs.ArtifactCache.brew_urls',
+                 side_effect=lambda md5s: dict.fromkeys(md5s, 'http://random.url/path'))
     mocker.patch.object(subprocess, 'check_output')
     mocker.patch('cekit.builders.osbs.DistGit.push')
 
@@ -879,6 +883,7 @@ def test_osbs_builder_with_fetch_artifacts_url_file_creation_4(tmpdir, mocker, c
 
     res = mocker.Mock()
     res.getcode.return_value = 200
+    res.info.return_value = {}
     res.read.side_effect = [b'test', None]
 
     mocker.patch('cekit.descriptor.resource.urlopen', return_value=res)
@@ -966,6 +971,7 @@ def test_osbs_builder_with_fetch_artifacts_url_file_creation_multiple_hash(tmpdi
 
     res = mocker.Mock()
     res.getcode.return_value = 200
+    res.info.return_value = {}
     res.read.side_effect = [b'test', None]
 
     mocker.patch('cekit.descriptor.resource.urlopen', return_value=res)
@@ -1010,6 +1016,7 @@ def test_osbs_builder_with_fetch_artifacts_url_file_creation_naming(tmpdir, mock
 
     res = mocker.Mock()
     res.getcode.return_value = 200
+    res.info.return_value = {}
     res.read.side_effect = [b'test', None]
 
     mocker.patch('cekit.descriptor.resource.urlopen', return_value=res)
@@ -1054,6 +1061,7 @@ def test_osbs_builder_with_fetch_artifacts_url_file_creation_naming_with_target(
 
     res = mocker.Mock()
     res.getcode.return_value = 200
+    res.info.return_value = {}
     res.read.side_effect = [b'test', None]
 
     mocker.patch('cekit.descriptor.resource.urlopen', return_value=res)
@@ -1098,6 +1106,7 @@ def test_osbs_builder_with_fetch_artifacts_url_validate_dockerfile(tmpdir, mocke
 
     res = mocker.Mock()
     res.getcode.return_value = 200
+    res.info.return_value = {}
     res.read.side_effect = [b'test', None]
 
     mocker.patch('cekit.descriptor.resource.urlopen', return_value=res)
@@ -1149,7 +1158,8 @@ def test_osbs_builder_with_fetch_artifacts_file_removal(tmpdir, mocker, caplog):
 
     mocker.patch('cekit.tools.decision', return_value=True)
     mocker.patch('cekit.descriptor.resource.urlopen')
-    mocker.patch('cekit.generator.osbs.get_brew_url', return_value='http://random.url/path')
+    mocker.patch('cekit.generator.osbs.ArtifactCache.brew_urls',
+                 side_effect=lambda md5s: dict.fromkeys(md5s, 'http://random.url/path'))
     mocker.patch.object(subprocess, 'check_output')
     mocker.patch('cekit.builders.osbs.DistGit.push')
 
@@ -1182,7 +1192,8 @@ def test_osbs_builder_container_yaml_existence(tmpdir, mocker, caplog, flag):
 
     mocker.patch('cekit.tools.decision', return_value=True)
     mocker.patch('cekit.descriptor.resource.urlopen')
-    mocker.patch('cekit.generator.osbs.get_brew_url', return_value='http://random.url/path')
+    mocker.patch('cekit.generator.osbs.ArtifactCache.brew_urls',
+                 side_effect=lambda md5s: dict.fromkeys(md5s, 'http://random.url/path'))
     mocker.patch.object(subprocess, 'check_output')
     mocker.patch('cekit.builders.osbs.DistGit.push')
 
@@ -1219,7 +1230,8 @@ def test_osbs_builder_with_cachito_enabled(tmpdir, mocker, caplog):
 
     mocker.patch('cekit.tools.decision', return_value=True)
     mocker.patch('cekit.descriptor.resource.urlopen')
-    mocker.patch('cekit.generator.osbs.get_brew_url', return_value='http://random.url/path')
+    mocker.patch('cekit.generator.osbs.ArtifactCache.brew_urls',
+                 side_effect=lambda md5s: dict.fromkeys(md5s, 'http://random.url/path'))
     mocker.patch.object(subprocess, 'check_output')
     mocker.patch('cekit.builders.osbs.DistGit.push')
 
@@ -23,7 +23,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.docker_builder.DockerBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config', 'redhat': True,
-            'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'pull': False,
+            'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'pull': False,
             'no_squash': False, 'tags': ()
         }
     ),
@@ -33,7 +33,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.docker_builder.DockerBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config', 'redhat': False,
-            'target': 'custom-target', 'validate': False, 'dry_run': False, 'overrides': (), 'pull': False,
+            'target': 'custom-target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'pull': False,
             'no_squash': False, 'tags': ()
         }
     ),
@@ -43,7 +43,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.docker_builder.DockerBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': 'custom-workdir', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'pull': False,
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'pull': False,
             'no_squash': False, 'tags': ()
         }
     ),
@@ -53,7 +53,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.docker_builder.DockerBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': 'custom-config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (),  'pull': False,
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (),  'pull': False,
             'no_squash': False, 'tags': ()
         }
     ),
@@ -63,7 +63,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.docker_builder.DockerBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'pull': False,
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'pull': False,
             'no_squash': False, 'tags': ()
         }
     ),
@@ -73,7 +73,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.docker_builder.DockerBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': ('foo', 'bar'),
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': ('foo', 'bar'),
             'pull': False, 'no_squash': False, 'tags': ()
         }
     ),
@@ -83,7 +83,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.osbs.OSBSBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'nowait': False,
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'nowait': False,
             'release': False, 'user': None, 'stage': False, 'sync_only': False, 'commit_message': None, 'assume_yes': False
         }
     ),
@@ -93,7 +93,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.osbs.OSBSBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'nowait': False,
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'nowait': False,
             'release': False, 'user': 'SOMEUSER', 'stage': False, 'sync_only': False,
             'commit_message': None, 'assume_yes': False
         }
@@ -104,7 +104,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.osbs.OSBSBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'nowait': False,
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'nowait': False,
             'release': False, 'user': None, 'stage': True, 'sync_only': False, 'commit_message': None, 'assume_yes': False
         }
     ),
@@ -114,7 +114,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.osbs.OSBSBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'nowait': True,
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'nowait': True,
             'release': False, 'user': None, 'stage': False, 'sync_only': False, 'commit_message': None, 'assume_yes': False
         }
     ),
@@ -132,7 +132,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.docker_builder.DockerBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'pull': True,
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'pull': True,
             'no_squash': False, 'tags': ()
         }
     ),
@@ -141,7 +141,7 @@ def _get_class_by_name(clazz):
         'cekit.builders.osbs.OSBSBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'release': False,
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'release': False,
             'user': None, 'nowait': False, 'stage': False, 'sync_only': False, 'commit_message': None, 'assume_yes': False
         }),
     (
@@ -149,16 +149,34 @@ def _get_class_by_name(clazz):
         'cekit.builders.docker_builder.DockerBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'pull': False,
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'pull': False,
             'no_squash': False, 'tags': ()
         }
     ),
+    (
+        ['build', '--paranoid', 'docker'],
+        'cekit.builders.docker_builder.DockerBuilder',
+        {
+            'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': True, 'fetch_jobs': None, 'overrides': (),
+            'pull': False, 'no_squash': False, 'tags': ()
+        }
+    ),
+    (
+        ['build', '--fetch-jobs', '8', 'docker'],
+        'cekit.builders.docker_builder.DockerBuilder',
+        {
+            'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': 8, 'overrides': (),
+            'pull': False, 'no_squash': False, 'tags': ()
+        }
+    ),
     (
         ['build', 'buildah'],
         'cekit.builders.buildah.BuildahBuilder',
         {
             'descriptor': 'image.yaml', 'verbose': False, 'nocolor': False, 'work_dir': '~/.cekit', 'config': '~/.cekit/config',
-            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'overrides': (), 'pull': False, 'tags': (), 'no_squash': False
+            'redhat': False, 'target': 'target', 'validate': False, 'dry_run': False, 'paranoid': False, 'fetch_jobs': None, 'overrides': (), 'pull': False, 'tags': (), 'no_squash': False
         }
     )
 ])
@@ -0,0 +1,829 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+import pytest
+import yaml
+
+try:
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import HTTPError
+
+from cekit.cache.artifact import ArtifactCache
+from cekit.cache.index import CacheIndex
+from cekit.cache.repository import RepositoryCache
+from cekit.cache.tier import FilesystemTier, HttpTier, create_tiers
+from cekit.config import Config
+from cekit.crypto import SUPPORTED_HASH_ALGORITHMS, get_sums
+from cekit.descriptor.resource import create_resource
+from cekit.errors import CekitError
+from cekit.tools import FileLock
+
+config = Config()
+
+
+@pytest.fixture
+def cache_dir(tmpdir):
+    config.cfg['common'] = {'work_dir': str(tmpdir)}
+    return os.path.join(str(tmpdir), 'cache')
+
+
+def test_index_find_by_checksum(tmpdir):
+    index = CacheIndex(str(tmpdir))
+    index.add('1234', {'names': ['foo.jar'],
+                       'cached_path': '/some/path',
+                       'md5': 'ABCD',
+                       'sha1': 'efgh'})
+
+    assert index.find('md5', 'abcd') == ('1234', {'names': ['foo.jar'],
+                                                  'cached_path': '/some/path',
+                                                  'md5': 'abcd',
+                                                  'sha1': 'efgh'})
+    assert index.find('sha1', 'abcd') == (None, None)
+
+
+def test_index_delete(tmpdir):
+    index = CacheIndex(str(tmpdir))
+    index.add('1234', {'names': ['foo.jar'], 'cached_path': '/some/path', 'md5': 'abcd'})
+
+    assert index.delete('1234') is True
+    assert index.delete('1234') is False
+    assert index.list() == {}
+
+
+def test_index_migrates_yaml_index_files(tmpdir):
+    with open(os.path.join(str(tmpdir), '1234.yaml'), 'w') as file_:
+        yaml.safe_dump({'names': ['foo.jar'],
+                        'cached_path': os.path.join(str(tmpdir), '1234'),
+                        'md5': 'abcd'}, file_)
+
+    index = CacheIndex(str(tmpdir))
+
+    assert not os.path.exists(os.path.join(str(tmpdir), '1234.yaml'))
+    assert index.get('1234') == {'names': ['foo.jar'],
+                                 'cached_path': os.path.join(str(tmpdir), '1234'),
+                                 'md5': 'abcd'}
+
+    # Opening the index again should not change anything
+    assert CacheIndex(str(tmpdir)).list() == {'1234': index.get('1234')}
+
+
+def test_artifact_cache_delete(cache_dir):
+    cache = ArtifactCache()
+
+    artifact_file = os.path.join(cache_dir, '1234')
+    open(artifact_file, 'a').close()
+
+    cache.index.add('1234', {'names': ['foo.jar'], 'cached_path': artifact_file, 'md5': 'abcd'})
+    assert cache.get({'md5': 'abcd'})['cached_path'] == artifact_file
+
+    cache.delete('1234')
+
+    assert not os.path.exists(artifact_file)
+    assert not cache.cached({'md5': 'abcd'})
+
+    with pytest.raises(CekitError, match="Artifact with UUID '1234' is not cached."):
+        cache.delete('1234')
+
+
+def create_artifact(directory, name, content):
+    path = os.path.join(directory, name)
+
+    with open(path, 'w') as file_:
+        file_.write(content)
+
+    return create_resource({'name': name, 'path': path, 'md5': hashlib.md5(content.encode()).hexdigest()},
+                           directory=directory)
+
+
+def test_artifact_cache_unsupported_layout(cache_dir):
+    config.cfg['common']['cache_layout'] = 'foo'
+
+    with pytest.raises(CekitError, match="Unsupported artifact cache layout: 'foo'"):
+        ArtifactCache()
+
+
+def test_artifact_cache_content_layout(tmpdir, cache_dir):
+    config.cfg['common']['cache_layout'] = 'content'
+
+    artifact = create_artifact(str(tmpdir), 'foo.jar', 'foo')
+    sha256 = hashlib.sha256(b'foo').hexdigest()
+    blob = os.path.join(cache_dir, 'blobs', 'sha256', sha256[:2], sha256)
+
+    cache = ArtifactCache()
+    artifact_id = cache.add(artifact)
+
+    assert os.path.isfile(blob)
+    assert cache.list()[artifact_id]['cached_path'] == blob
+    assert cache.get({'md5': artifact['md5']}) == {'cached_path': blob, 'md5': artifact['md5']}
+    assert cache.get({'sha256': sha256}) == {'cached_path': blob, 'sha256': sha256}
+
+    cache.delete(artifact_id)
+
+    assert not os.path.exists(blob)
+    assert not os.path.lexists(os.path.join(cache_dir, 'blobs', 'md5', artifact['md5'][:2], artifact['md5']))
+    assert not cache.cached(artifact)
+
+
+def test_artifact_cache_content_layout_symlinked_work_dir(tmpdir):
+    os.mkdir(str(tmpdir.join('real')))
+    os.symlink(str(tmpdir.join('real')), str(tmpdir.join('work')))
+    config.cfg['common'] = {'work_dir': str(tmpdir.join('work')), 'cache_layout': 'content'}
+
+    artifact = create_artifact(str(tmpdir), 'foo.jar', 'foo')
+
+    cache = ArtifactCache()
+    artifact_id = cache.add(artifact)
+    cached_path = cache.list()[artifact_id]['cached_path']
+
+    with cache.index._connect() as conn:
+        conn.execute("UPDATE artifacts SET accessed = 1000 WHERE id = ?", (artifact_id,))
+
+    # Path is returned (and the access is recorded) as it is stored in the index
+    assert cache.get({'md5': artifact['md5']}) == {'cached_path': cached_path, 'md5': artifact['md5']}
+
+    with cache.index._connect() as conn:
+        assert conn.execute("SELECT accessed FROM artifacts WHERE id = ?", (artifact_id,)).fetchone()[0] > 1000
+
+
+@pytest.mark.parametrize('layout', ['uuid', 'content'])
+def test_artifact_cache_deduplicates_content(mocker, tmpdir, cache_dir, layout):
+    config.cfg['common']['cache_layout'] = layout
+
+    cache = ArtifactCache()
+    artifact_id = cache.add(create_artifact(str(tmpdir), 'foo.jar', 'foo'))
+
+    # Same content under a different name, added as if the cache lookup did not find it
+    # (for example when it was added by other process in the meantime)
+    mocker.patch.object(cache, 'cached', return_value=False)
+
+    assert cache.add(create_artifact(str(tmpdir), 'bar.jar', 'foo')) == artifact_id
+    assert cache.list()[artifact_id]['names'] == ['foo.jar', 'bar.jar']
+
+    stored = [name for root, _, files in os.walk(cache_dir) for name in files
+              if name != 'index.db' and os.path.basename(root) != 'locks']
+
+    # Only one copy of the content (plus aliases in case of the content layout)
+    assert len(stored) == (1 if layout == 'uuid' else len(SUPPORTED_HASH_ALGORITHMS))
+
+
+def test_artifact_cache_verified(tmpdir, cache_dir):
+    artifact = tmpdir.join('artifact')
+    artifact.write('foo')
+
+    cache = ArtifactCache()
+
+    assert not cache.verified(str(artifact), {'md5': 'abcd'})
+
+    cache.mark_verified(str(artifact), {'md5': 'ABCD'})
+    cache.mark_verified(str(artifact), {'sha1': 'efgh'})
+
+    assert cache.verified(str(artifact), {'md5': 'abcd', 'sha1': 'efgh'})
+    assert not cache.verified(str(artifact), {'md5': 'other'})
+    assert not cache.verified(str(artifact), {'sha256': 'abcd'})
+
+    # Content changed, checksums need to be verified again
+    artifact.write('bar-with-different-size')
+
+    assert not cache.verified(str(artifact), {'md5': 'abcd'})
+    assert not cache.verified(str(tmpdir.join('missing')), {'md5': 'abcd'})
+
+
+def add_cached_artifacts(cache, cache_dir, sizes):
+    """ Adds artifacts of provided sizes directly to the cache index, first one is the least recently used """
+    for i, size in enumerate(sizes):
+        cached_path = os.path.join(cache_dir, str(i))
+
+        with open(cached_path, 'w') as file_:
+            file_.write('x' * size)
+
+        cache.index.add(str(i), {'names': [str(i)], 'cached_path': cached_path, 'md5': str(i)})
+
+        with cache.index._connect() as conn:
+            conn.execute("UPDATE artifacts SET accessed = ? WHERE id = ?", (1000 + i, str(i)))
+
+
+def test_artifact_cache_gc_max_size(cache_dir):
+    cache = ArtifactCache()
+    add_cached_artifacts(cache, cache_dir, [10, 20, 30, 40])
+
+    # Access the oldest artifact, it should not be evicted now
+    cache.get({'md5': '0'})
+
+    assert cache.gc(max_size=75) == [('1', 20), ('2', 30)]
+    assert sorted(cache.list().keys()) == ['0', '3']
+    assert not os.path.exists(os.path.join(cache_dir, '1'))
+
+
+def test_artifact_cache_gc_max_age(cache_dir):
+    cache = ArtifactCache()
+    add_cached_artifacts(cache, cache_dir, [10, 20, 30])
+    cache.get({'md5': '2'})
+
+    assert cache.gc(max_age=3600, dry_run=True) == [('0', 10), ('1', 20)]
+    assert len(cache.list()) == 3
+    assert cache.gc(max_age=3600) == [('0', 10), ('1', 20)]
+    assert list(cache.list().keys()) == ['2']
+
+
+def test_artifact_cache_gc_after_add(tmpdir, cache_dir):
+    config.cfg['common']['cache_max_size'] = '50'
+
+    cache = ArtifactCache()
+    add_cached_artifacts(cache, cache_dir, [30, 30])
+
+    artifact_id = cache.add(create_artifact(str(tmpdir), 'foo.jar', 'x' * 40))
+
+    # Newly added artifact is never evicted
+    assert list(cache.list().keys()) == [artifact_id]
+
+
+def test_artifact_cache_reused_target_is_touched(tmpdir, cache_dir):
+    artifact = create_artifact(str(tmpdir), 'foo.jar', 'foo')
+    target = str(tmpdir.join('target', 'foo.jar'))
+    os.mkdir(str(tmpdir.join('target')))
+
+    artifact.copy(target)
+
+    with artifact.cache.index._connect() as conn:
+        conn.execute("UPDATE artifacts SET accessed = 1000")
+
+    # Target is valid already, nothing is copied from the cache, but the artifact is still used
+    artifact.copy(target)
+
+    assert artifact.cache.gc(max_age=3600) == []
+
+
+def test_artifact_cache_gc_urls(tmpdir, cache_dir):
+    cache = ArtifactCache()
+
+    for name in ['old', 'used']:
+        tmpdir.join(name).write(name)
+        cache.add_url("http://server.org/{}".format(name), str(tmpdir.join(name)), '"1"', None)
+
+    with cache.index._connect() as conn:
+        conn.execute("UPDATE urls SET accessed = 1000")
+
+    # Reused (for example after the server responded with 304 Not Modified)
+    cached_path = cache.get_url('http://server.org/used')['cached_path']
+    old_path = cache.url_path('http://server.org/old')
+
+    assert cache.gc(max_age=3600) == [('http://server.org/old', 3)]
+    assert cache.get_url('http://server.org/old') is None
+    assert not os.path.exists(old_path)
+    assert os.path.exists(cached_path)
+
+    assert cache.gc(max_size=0) == [('http://server.org/used', 4)]
+    assert not os.path.exists(cached_path)
+
+
+def test_artifact_cache_gc_removes_stale_files(tmpdir, cache_dir):
+    cache = ArtifactCache()
+    stale = [cache.partial_path({'md5': 'aaaa'}), cache.partial_path({'md5': 'aaaa'}) + '.json',
+             cache.url_path('http://server.org/foo') + '.part']
+    fresh = cache.partial_path({'md5': 'bbbb'})
+    in_use = cache.partial_path({'md5': 'cccc'})
+
+    for path in stale + [fresh, in_use]:
+        with open(path, 'w') as file_:
+            file_.write('foo')
+
+        if path != fresh:
+            os.utime(path, (1000, 1000))
+
+    # Lock file left behind by a finished run
+    with FileLock(cache._lock_file('md5', 'dddd')):
+        pass
+
+    # Download of the artifact is in progress in other thread
+    with FileLock(cache._lock_file('md5', 'cccc')):
+        thread = threading.Thread(target=cache.gc, kwargs={'max_age': 3600})
+        thread.start()
+        thread.join()
+
+        assert [path for path in stale if os.path.exists(path)] == []
+        assert os.path.exists(fresh)
+        assert os.path.exists(in_use)
+        assert os.listdir(os.path.join(cache_dir, 'locks')) == ['md5-cccc.lock']
+
+
+def test_artifact_cache_gc_git_repositories(tmpdir, cache_dir):
+    origin = str(tmpdir.join('origin'))
+
+    def git(*args):
+        return subprocess.check_output(['git'] + list(args)).decode('utf-8').strip()
+
+    git('init', '--quiet', origin)
+    tmpdir.join('origin', 'module.yaml').write('name: foo')
+    git('-C', origin, 'add', 'module.yaml')
+    git('-C', origin, '-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '--quiet', '-m', 'foo')
+
+    repositories = RepositoryCache()
+    commit, snapshot = repositories.snapshot(origin, 'HEAD')
+    mirror = repositories.mirror_path(origin)
+
+    # Snapshot does not depend on objects in the mirror
+    assert not os.path.exists(os.path.join(snapshot, '.git', 'objects', 'info', 'alternates'))
+
+    cache = ArtifactCache()
+    add_cached_artifacts(cache, cache_dir, [10])
+
+    os.utime(snapshot, (500, 500))
+    os.utime(mirror, (2000, 2000))
+
+    evicted = cache.gc(max_age=3600)
+
+    assert [entry_id for entry_id, _ in evicted] == \
+        ['git/snapshots/{}'.format(commit), '0', 'git/{}'.format(os.path.basename(mirror))]
+    assert all(size > 0 for _, size in evicted)
+    assert not os.path.exists(snapshot)
+    assert not os.path.exists(mirror)
+
+
+def test_artifact_cache_single_flight(mocker, tmpdir, cache_dir):
+    cache = ArtifactCache()
+    artifact = create_artifact(str(tmpdir), 'foo.jar', 'foo')
+
+    # Artifact is added by other process while this one was waiting for the lock
+    with cache.lock(artifact):
+        artifact_id = ArtifactCache().add(create_artifact(str(tmpdir), 'foo.jar', 'foo'))
+
+    with pytest.raises(CekitError, match='Artifact is already cached!'):
+        cache.add(artifact)
+
+    assert list(cache.list().keys()) == [artifact_id]
+
+
+def test_artifact_cache_gc_skips_artifacts_in_use(cache_dir):
+    cache = ArtifactCache()
+    add_cached_artifacts(cache, cache_dir, [10, 20])
+
+    locked = threading.Event()
+    release = threading.Event()
+
+    def use_artifact():
+        with FileLock(cache._lock_file('md5', '0')):
+            locked.set()
+            release.wait()
+
+    # Artifact is used by other thread (or process) while the cache is cleaned up
+    thread = threading.Thread(target=use_artifact)
+    thread.start()
+    locked.wait()
+
+    try:
+        assert cache.gc(max_size=0) == [('1', 20)]
+    finally:
+        release.set()
+        thread.join()
+
+    assert list(cache.list().keys()) == ['0']
+
+
+def test_artifact_cache_concurrent_add(tmpdir, cache_dir):
+    config.cfg['common']['cache_layout'] = 'content'
+
+    artifacts = [create_artifact(str(tmpdir), 'foo-{}.jar'.format(i), 'foo') for i in range(4)]
+
+    def add(artifact):
+        cache = ArtifactCache()
+
+        with cache.lock(artifact):
+            if not cache.cached(artifact):
+                cache.add(artifact)
+
+        return cache.get(artifact)['cached_path']
+
+    pool = ThreadPool(4)
+
+    try:
+        cached_paths = pool.map(add, artifacts)
+    finally:
+        pool.close()
+
+    assert len(set(cached_paths)) == 1
+    assert len(ArtifactCache().list()) == 1
+
+
+def test_artifact_cache_unsupported_materialization(cache_dir):
+    config.cfg['common']['cache_materialize'] = 'foo'
+
+    with pytest.raises(CekitError, match="Unsupported artifact materialization strategy: 'foo'"):
+        ArtifactCache()
+
+
+@pytest.mark.parametrize('strategy', ['hardlink', 'reflink', 'copy'])
+def test_artifact_cache_materialize(mocker, tmpdir, cache_dir, strategy):
+    config.cfg['common']['cache_materialize'] = strategy
+
+    cached_path = str(tmpdir.join('cached'))
+    target = str(tmpdir.join('target'))
+
+    with open(cached_path, 'w') as file_:
+        file_.write('foo')
+
+    # Target left from a previous build must be replaced, not written into
+    with open(target, 'w') as file_:
+        file_.write('old')
+
+    reflink = mocker.patch('cekit.cache.artifact.reflink', side_effect=lambda src, dst: shutil.copy(src, dst))
+
+    assert ArtifactCache().materialize(cached_path, target) == strategy
+    assert open(target).read() == 'foo'
+    assert os.path.samefile(cached_path, target) == (strategy == 'hardlink')
+    assert reflink.called == (strategy == 'reflink')
+
+
+def test_artifact_cache_materialize_fallback(mocker, tmpdir, cache_dir):
+    config.cfg['common']['cache_materialize'] = 'hardlink'
+
+    cached_path = str(tmpdir.join('cached'))
+    target = str(tmpdir.join('target'))
+
+    with open(cached_path, 'w') as file_:
+        file_.write('foo')
+
+    mocker.patch('os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link'))
+    mocker.patch('cekit.cache.artifact.reflink', side_effect=OSError(errno.EOPNOTSUPP, 'Operation not supported'))
+
+    assert ArtifactCache().materialize(cached_path, target) == 'copy'
+    assert open(target).read() == 'foo'
+    assert not os.path.samefile(cached_path, target)
+
+
+def test_create_tiers(tmpdir):
+    tiers = create_tiers("/mnt/cache, file:///srv/cache\n  https://cache.example.com/artifacts/")
+
+    assert [type(tier) for tier in tiers] == [FilesystemTier, FilesystemTier, HttpTier]
+    assert [str(tier) for tier in tiers] == ['/mnt/cache', '/srv/cache', 'https://cache.example.com/artifacts']
+    assert create_tiers(None) == []
+
+    with pytest.raises(CekitError, match="Unsupported cache tier: 'ftp://foo'"):
+        create_tiers('ftp://foo')
+
+
+def test_artifact_cache_fetch_from_tier(tmpdir, cache_dir):
+    tier = FilesystemTier(str(tmpdir.join('tier')))
+    source = str(tmpdir.join('source'))
+
+    with open(source, 'w') as file_:
+        file_.write('foo')
+
+    tier.publish(source, get_sums(source, SUPPORTED_HASH_ALGORITHMS))
+
+    config.cfg['common']['cache_tiers'] = "{} {}".format(str(tmpdir.join('empty')), str(tier))
+
+    # Artifact not available anywhere else
+    artifact = create_resource({'name': 'foo.jar', 'md5': hashlib.md5(b'foo').hexdigest()})
+    cache = ArtifactCache()
+    artifact_id = cache.add(artifact)
+
+    assert open(cache.get(artifact)['cached_path']).read() == 'foo'
+    assert cache.list()[artifact_id]['names'] == ['foo.jar']
+    assert cache.tier_stats() == [('local', 0, 0), (str(tmpdir.join('empty')), 0, 1), (str(tier), 1, 0)]
+
+
+def test_artifact_cache_tier_with_corrupted_artifact(mocker, tmpdir, cache_dir):
+    tier = FilesystemTier(str(tmpdir.join('tier')))
+    source = str(tmpdir.join('source'))
+
+    with open(source, 'w') as file_:
+        file_.write('bar')
+
+    # Content stored under a wrong checksum
+    checksums = get_sums(source, SUPPORTED_HASH_ALGORITHMS)
+    checksums['md5'] = hashlib.md5(b'foo').hexdigest()
+    tier.publish(source, checksums)
+
+    config.cfg['common']['cache_tiers'] = str(tier)
+
+    artifact = create_artifact(str(tmpdir), 'foo.jar', 'foo')
+    cache = ArtifactCache()
+    cache.add(artifact)
+
+    assert open(cache.get(artifact)['cached_path']).read() == 'foo'
+    assert cache.tier_stats() == [('local', 0, 0), (str(tier), 0, 1)]
+
+
+def test_artifact_cache_publish_to_tiers(tmpdir, cache_dir):
+    config.cfg['common']['cache_tiers'] = str(tmpdir.join('tier'))
+    config.cfg['common']['cache_publish'] = True
+
+    artifact = create_artifact(str(tmpdir), 'foo.jar', 'foo')
+    ArtifactCache().add(artifact)
+
+    checksums = get_sums(str(tmpdir.join('foo.jar')), SUPPORTED_HASH_ALGORITHMS)
+    destination = str(tmpdir.join('fetched'))
+
+    for alg in SUPPORTED_HASH_ALGORITHMS:
+        assert FilesystemTier(str(tmpdir.join('tier'))).fetch({alg: checksums[alg]}, destination)
+        assert open(destination).read() == 'foo'
+
+
+def test_http_tier(mocker, tmpdir):
+    urlopen = mocker.patch('cekit.cache.tier.urlopen',
+                           side_effect=HTTPError('https://cache/md5/abcd.sha256', 404, 'Not Found', {}, None))
+
+    tier = HttpTier('https://cache/')
+
+    assert not tier.fetch({'md5': 'ABCD'}, str(tmpdir.join('destination')))
+    assert urlopen.call_args[0][0].get_full_url() == 'https://cache/md5/abcd.sha256'
+
+    source = tmpdir.join('source')
+    source.write('foo')
+    urlopen.reset_mock()
+    # Artifact is not in the tier yet
+    urlopen.side_effect = [urlopen.side_effect] + [mocker.Mock()] * len(SUPPORTED_HASH_ALGORITHMS)
+
+    tier.publish(str(source), get_sums(str(source), SUPPORTED_HASH_ALGORITHMS))
+
+    requests = [call[0][0] for call in urlopen.call_args_list]
+
+    # Content is uploaded only once, other algorithms are small aliases
+    assert [request.get_method() for request in requests] == ['HEAD', 'PUT'] + \
+        ['PUT'] * (len(SUPPORTED_HASH_ALGORITHMS) - 1)
+    assert requests[1].get_full_url() == \
+        'https://cache/sha256/2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae'
+    assert requests[-1].get_full_url() == 'https://cache/md5/acbd18db4cc2f85cedef654fccc4a4d8.sha256'
+    assert requests[-1].data == b'2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae'
+
+
+def test_http_tier_round_trip(mocker, tmpdir):
+    stored = {}
+
+    class Response(object):
+        def __init__(self, data):
+            self.data = data
+
+        def read(self, size=-1):
+            data, self.data = self.data, b''
+            return data
+
+        def close(self):
+            pass
+
+    def urlopen(request):
+        url = request.get_full_url()
+
+        if request.get_method() == 'PUT':
+            data = request.data if isinstance(request.data, bytes) else request.data.read()
+            stored[url] = data
+            return Response(b'')
+
+        if url not in stored:
+            raise HTTPError(url, 404, 'Not Found', {}, None)
+
+        return Response(b'' if request.get_method() == 'HEAD' else stored[url])
+
+    urlopen = mocker.patch('cekit.cache.tier.urlopen', side_effect=urlopen)
+
+    source = tmpdir.join('source')
+    source.write('foo')
+    checksums = get_sums(str(source), SUPPORTED_HASH_ALGORITHMS)
+    destination = str(tmpdir.join('fetched'))
+
+    tier = HttpTier('https://cache')
+    tier.publish(str(source), checksums)
+
+    for alg in SUPPORTED_HASH_ALGORITHMS:
+        assert tier.fetch({alg: checksums[alg]}, destination)
+        assert open(destination).read() == 'foo'
+
+    urlopen.reset_mock()
+
+    # Content already in the tier is not uploaded again
+    tier.publish(str(source), checksums)
+
+    assert [call[0][0].get_full_url() for call in urlopen.call_args_list
+            if call[0][0].get_method() == 'PUT' and '/sha256/' in call[0][0].get_full_url()] == []
+
+
+@pytest.mark.parametrize('layout', ['uuid', 'content'])
+def test_artifact_cache_verify(tmpdir, cache_dir, layout):
+    config.cfg['common']['cache_layout'] = layout
+
+    cache = ArtifactCache()
+    valid_id = cache.add(create_artifact(str(tmpdir), 'foo.jar', 'foo'))
+    corrupted_id = cache.add(create_artifact(str(tmpdir), 'bar.jar', 'bar'))
+    missing_id = cache.add(create_artifact(str(tmpdir), 'baz.jar', 'baz'))
+
+    with open(cache.list()[corrupted_id]['cached_path'], 'w') as file_:
+        file_.write('bit rot')
+
+    os.remove(cache.list()[missing_id]['cached_path'])
+
+    assert sorted(cache.verify(jobs=2), key=lambda result: result[1]) == [
+        (corrupted_id, 'corrupted'), (missing_id, 'missing'), (valid_id, 'ok')]
+    assert list(cache.list().keys()) == [valid_id]
+    assert open(os.path.join(cache_dir, 'quarantine', corrupted_id)).read() == 'bit rot'
+    assert not cache.cached({'md5': hashlib.md5(b'bar').hexdigest()})
+    assert cache.index.checkpoint() == {}
+
+
+def test_artifact_cache_verify_resume(tmpdir, cache_dir):
+    cache = ArtifactCache()
+    artifact_ids = [cache.add(create_artifact(str(tmpdir), name, name)) for name in ['foo', 'bar', 'baz']]
+
+    # Interrupted after the first artifact
+    for _ in cache.verify():
+        break
+
+    verified = list(cache.index.checkpoint().keys())
+
+    assert len(verified) == 1
+
+    resumed = [artifact_id for artifact_id, _ in cache.verify(resume=True)]
+
+    assert sorted(resumed + verified) == sorted(artifact_ids)
+    assert len(cache.list()) == 3
+    assert cache.index.checkpoint() == {}
+
+
+def test_artifact_cache_export_import_bundle(tmpdir, cache_dir):
+    artifacts = [create_artifact(str(tmpdir), 'foo.jar', 'foo'), create_artifact(str(tmpdir), 'bar.jar', 'bar')]
+
+    cache = ArtifactCache()
+
+    for artifact in artifacts:
+        cache.add(artifact)
+
+    # Same content under other name is exported only once
+    artifacts.append(create_artifact(str(tmpdir), 'baz.jar', 'foo'))
+
+    bundle = str(tmpdir.join('bundle.tar'))
+
+    assert cache.export_bundle(artifacts, bundle) == (2, [])
+
+    with tarfile.open(bundle) as tar:
+        assert tar.getnames()[0] == 'index.json'
+        assert len(tar.getnames()) == 3
+
+    config.cfg['common']['work_dir'] = str(tmpdir.join('other'))
+
+    other = ArtifactCache()
+
+    assert sorted((names, imported) for _, names, imported in other.import_bundle(bundle)) == [
+        (['bar.jar'], True), (['foo.jar'], True)]
+    assert sorted(imported for _, _, imported in other.import_bundle(bundle)) == [False, False]
+
+    for artifact in artifacts[:2]:
+        assert open(other.get(artifact)['cached_path']).read() == open(cache.get(artifact)['cached_path']).read()
+
+
+def test_artifact_cache_export_missing_artifact(tmpdir, cache_dir):
+    artifact = create_artifact(str(tmpdir), 'foo.jar', 'foo')
+
+    assert ArtifactCache().export_bundle([artifact], str(tmpdir.join('bundle.tar'))) == (0, [artifact])
+    assert not tmpdir.join('bundle.tar').exists()
+
+
+def test_artifact_cache_import_bundle_directory(tmpdir, cache_dir):
+    cache = ArtifactCache()
+    artifact = create_artifact(str(tmpdir), 'foo.jar', 'foo')
+    cache.add(artifact)
+    cache.export_bundle([artifact], str(tmpdir.join('bundle.tar')))
+
+    with tarfile.open(str(tmpdir.join('bundle.tar'))) as tar:
+        tar.extractall(str(tmpdir.join('bundle')))
+
+    config.cfg['common']['work_dir'] = str(tmpdir.join('other'))
+
+    other = ArtifactCache()
+    list(other.import_bundle(str(tmpdir.join('bundle'))))
+
+    blob = str(tmpdir.join('bundle', 'blobs', hashlib.sha256(b'foo').hexdigest()))
+
+    # Files are hard linked, not copied
+    assert os.path.samefile(other.get(artifact)['cached_path'], blob)
+
+
+def test_artifact_cache_import_corrupted_bundle(tmpdir, cache_dir):
+    cache = ArtifactCache()
+    artifact = create_artifact(str(tmpdir), 'foo.jar', 'foo')
+    cache.add(artifact)
+    cache.export_bundle([artifact], str(tmpdir.join('bundle.tar')))
+
+    with tarfile.open(str(tmpdir.join('bundle.tar'))) as tar:
+        tar.extractall(str(tmpdir.join('bundle')))
+
+    with open(str(tmpdir.join('bundle', 'blobs', hashlib.sha256(b'foo').hexdigest())), 'w') as file_:
+        file_.write('bar')
+
+    config.cfg['common']['work_dir'] = str(tmpdir.join('other'))
+
+    other = ArtifactCache()
+
+    with pytest.raises(CekitError, match="does not match its"):
+        list(other.import_bundle(str(tmpdir.join('bundle'))))
+
+    assert other.list() == {}
+    assert [name for name in os.listdir(other.cache_dir) if name not in ['index.db', 'locks']] == []
+
+
+def test_index_artifact_stats(tmpdir):
+    index = CacheIndex(str(tmpdir))
+    index.record_artifact_stats('foo.jar', {'hits': 1, 'bytes_served': 3})
+    index.record_artifact_stats('foo.jar', {'misses': 1, 'bytes_downloaded': 3, 'download_time': 0.5})
+
+    assert index.artifact_stats() == {'foo.jar': {'hits': 1,
+                                                  'misses': 1,
+                                                  'bytes_served': 3,
+                                                  'bytes_downloaded': 3,
+                                                  'download_time': 0.5,
+                                                  'hash_time': 0.0}}
+
+
+def test_artifact_cache_records_stats(tmpdir, cache_dir):
+    ArtifactCache.reset_report()
+
+    artifact = create_artifact(str(tmpdir), 'foo.jar', 'foo')
+
+    # First copy is a miss, second one is served from the cache
+    artifact.copy(str(tmpdir.join('first.jar')))
+    artifact.copy(str(tmpdir.join('second.jar')))
+
+    stats = ArtifactCache().stats()['foo.jar']
+
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['bytes_served'] == 3
+    assert ArtifactCache().tier_stats() == [('local', 1, 1)]
+
+    ArtifactCache.write_report(str(tmpdir.join('report.json')))
+
+    with open(str(tmpdir.join('report.json'))) as report_file:
+        report = json.load(report_file)
+
+    assert report['artifacts']['foo.jar'] == stats
+    assert report['totals']['hits'] == 1
+    assert report['totals']['bytes_served'] == 3
+
+    # Persisted statistics survive the report reset
+    ArtifactCache.reset_report()
+    ArtifactCache.write_report(str(tmpdir.join('report.json')))
+
+    with open(str(tmpdir.join('report.json'))) as report_file:
+        assert json.load(report_file)['artifacts'] == {}
+
+    assert ArtifactCache().stats()['foo.jar'] == stats
+
+
+def test_index_latencies(tmpdir):
+    index = CacheIndex(str(tmpdir))
+    index.record_latency('server.org', 1.0, 0.5)
+    index.record_latency('server.org', 3.0, 0.5)
+
+    assert index.latencies()['server.org'][0] == 2.0
+
+
+def test_artifact_cache_ranks_urls_by_latency(mocker, cache_dir):
+    cache = ArtifactCache()
+    cache.record_latency('http://slow.org/foo.jar', 2.0)
+    cache.record_latency('http://fast.org/foo.jar', 0.1)
+    cache.record_latency('http://down.org/foo.jar', None)
+
+    probe = mocker.patch.object(ArtifactCache, '_probe',
+                                side_effect=lambda url: cache.record_latency(url, 0.5))
+
+    assert cache.rank_urls(['http://slow.org/foo.jar', 'http://down.org/foo.jar',
+                            'http://new.org/foo.jar', 'http://fast.org/foo.jar']) == \
+        ['http://fast.org/foo.jar', 'http://new.org/foo.jar', 'http://slow.org/foo.jar',
+         'http://down.org/foo.jar']
+
+    # Only hosts without recent measurement are probed
+    probe.assert_called_once_with('http://new.org/foo.jar')
+
+
+def test_artifact_cache_remembers_brew_urls(mocker, cache_dir):
+    get_brew_urls = mocker.patch('cekit.cache.artifact.get_brew_urls', side_effect=lambda md5s: dict(
+        (md5, CekitError('not found') if md5 == 'missing' else 'http://brew/' + md5) for md5 in md5s))
+
+    cache = ArtifactCache()
+
+    assert cache.brew_urls(['aa', 'missing'])['aa'] == 'http://brew/aa'
+    assert cache.brew_urls(['aa', 'bb', 'missing', 'bb'])['bb'] == 'http://brew/bb'
+
+    # Only URLs not known yet are resolved, failures are not remembered
+    assert get_brew_urls.call_args_list == [mocker.call(['aa', 'missing']), mocker.call(['bb', 'missing'])]
+
+    with pytest.raises(CekitError, match='not found'):
+        cache.brew_url('missing')
+
+
+def test_artifact_cache_brew_urls_expire(mocker, cache_dir):
+    config.cfg['common']['brew_url_ttl'] = '0'
+    get_brew_urls = mocker.patch('cekit.cache.artifact.get_brew_urls',
+                                 side_effect=lambda md5s: dict((md5, 'http://brew/' + md5) for md5 in md5s))
+
+    cache = ArtifactCache()
+    cache.brew_url('aa')
+    cache.brew_url('aa')
+
+    assert get_brew_urls.call_count == 2
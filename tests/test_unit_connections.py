@@ -0,0 +1,163 @@
+import ssl
+import threading
+
+import pytest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.error import HTTPError
+    from urllib.request import Request
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import HTTPError, Request
+
+from cekit.config import Config
+from cekit.connections import ConnectionPool, ssl_context
+
+config = Config()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.server.clients.add(self.client_address)
+        self.server.headers.append(self.headers)
+
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/foo')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path == '/foo':
+            self.send_response(200)
+            self.send_header('Content-Length', '3')
+            self.end_headers()
+            self.wfile.write(b'foo')
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '9')
+            self.end_headers()
+            self.wfile.write(b'not found')
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture(autouse=True)
+def common_config():
+    common = config.cfg.get('common')
+    config.cfg['common'] = {}
+
+    yield
+
+    config.cfg['common'] = common
+
+
+@pytest.fixture
+def server(monkeypatch):
+    for variable in ['http_proxy', 'HTTP_PROXY', 'https_proxy', 'HTTPS_PROXY']:
+        monkeypatch.delenv(variable, raising=False)
+
+    httpd = Server(('127.0.0.1', 0), Handler)
+    httpd.clients = set()
+    httpd.headers = []
+
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield httpd
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path):
+    return "http://127.0.0.1:{}{}".format(server.server_address[1], path)
+
+
+def test_connections_are_reused(server):
+    pool = ConnectionPool()
+
+    for _ in range(3):
+        response = pool.urlopen(url(server, '/foo'))
+
+        assert response.getcode() == 200
+        assert response.read() == b'foo'
+
+    assert len(server.clients) == 1
+
+    pool.clear()
+
+
+def test_unread_response_closes_connection(server):
+    pool = ConnectionPool()
+
+    pool.urlopen(url(server, '/foo')).close()
+    assert pool.urlopen(url(server, '/foo')).read() == b'foo'
+
+    assert len(server.clients) == 2
+
+
+def test_redirects_are_followed(server):
+    pool = ConnectionPool()
+    response = pool.urlopen(Request(url(server, '/redirect'), headers={'X-Test': 'yes'}))
+
+    assert response.read() == b'foo'
+    assert [headers.get('X-Test') for headers in server.headers] == ['yes', 'yes']
+
+
+def test_error_responses_raise_http_error(server):
+    pool = ConnectionPool()
+
+    with pytest.raises(HTTPError) as excinfo:
+        pool.urlopen(url(server, '/missing'))
+
+    assert excinfo.value.code == 404
+    assert excinfo.value.read() == b'not found'
+
+    # Connection is returned to the pool after an error response too
+    assert pool.urlopen(url(server, '/foo')).read() == b'foo'
+    assert len(server.clients) == 1
+
+
+def test_connection_limit_per_host(server):
+    config.cfg['common']['http_max_connections'] = 1
+
+    pool = ConnectionPool()
+    first = pool.urlopen(url(server, '/foo'))
+    opened = threading.Event()
+
+    def open_second():
+        pool.urlopen(url(server, '/foo')).read()
+        opened.set()
+
+    thread = threading.Thread(target=open_second)
+    thread.start()
+
+    # Second request waits until the first connection is returned to the pool
+    assert not opened.wait(0.2)
+
+    first.read()
+    thread.join()
+
+    assert opened.is_set()
+    assert len(server.clients) == 1
+
+
+def test_ssl_context_is_shared():
+    config.cfg['common']['ssl_verify'] = False
+
+    assert ssl_context() is ssl_context()
+    assert ssl_context().verify_mode == ssl.CERT_NONE
+
+    config.cfg['common']['ssl_verify'] = True
+
+    assert ssl_context().verify_mode == ssl.CERT_REQUIRED
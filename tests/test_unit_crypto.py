@@ -0,0 +1,35 @@
+import hashlib
+
+from cekit import crypto
+
+
+def test_get_sums_reads_file_once(mocker, tmpdir):
+    artifact = tmpdir.join('artifact')
+    artifact.write_binary(b'a' * (crypto.BUFFER_SIZE + 10))
+
+    open_mock = mocker.patch('cekit.crypto.open', side_effect=open, create=True)
+    sums = crypto.get_sums(str(artifact), crypto.SUPPORTED_HASH_ALGORITHMS)
+
+    for alg in crypto.SUPPORTED_HASH_ALGORITHMS:
+        assert sums[alg] == hashlib.new(alg, b'a' * (crypto.BUFFER_SIZE + 10)).hexdigest()
+
+    open_mock.assert_called_once_with(str(artifact), 'rb')
+
+
+def test_check_sums(tmpdir):
+    artifact = tmpdir.join('artifact')
+    artifact.write_binary(b'')
+
+    assert crypto.check_sums(str(artifact), {'md5': 'D41D8CD98F00B204E9800998ECF8427E',
+                                             'sha1': 'da39a3ee5e6b4b0d3255bfef95601890afd80709'})
+    assert not crypto.check_sums(str(artifact), {'md5': 'd41d8cd98f00b204e9800998ecf8427e',
+                                                 'sha1': 'wrong'})
+
+
+def test_digests_can_be_updated_in_chunks():
+    digests = crypto.Digests(['md5', 'sha256'])
+    digests.update(b'fo')
+    digests.update(b'o')
+
+    assert digests.hexdigests() == {'md5': hashlib.md5(b'foo').hexdigest(),
+                                    'sha256': hashlib.sha256(b'foo').hexdigest()}
@@ -4,15 +4,19 @@
 
 import logging
 import os
+import subprocess
+import threading
 
 from contextlib import contextmanager
 
 import pytest
 import yaml
 
+import cekit.tools
 from cekit.config import Config
 from cekit.errors import CekitError
 from cekit.generator.docker import DockerGenerator
+from cekit.test.collector import BehaveTestCollector
 from cekit.descriptor import Image
 
 
@@ -191,3 +195,140 @@ def test_prepare_content_sets_should_handle_incorrect_state(tmpdir, mocker):
 
     mock_odcs_new_compose.assert_called_once_with('ca1 cs2', 'pulp', flags=[])
     mock_odcs_wait_for_compose.assert_called_once_with(1, timeout=600)
+
+
+def image_with_artifacts(tmpdir, *names):
+    Config.cfg['common']['work_dir'] = str(tmpdir)
+
+    return Image({'name': 'foo', 'version': '1.0', 'from': 'bar',
+                  'artifacts': [{'name': name, 'path': name, 'md5': '098f6bcd4621d373cade4e832627b4f6'}
+                                for name in names]}, str(tmpdir))
+
+
+def test_fetch_artifacts_deduplicates_artifacts(tmpdir):
+    fetched = []
+
+    with docker_generator(tmpdir) as generator:
+        generator.images = [image_with_artifacts(tmpdir, 'a.jar', 'b.jar'),
+                            image_with_artifacts(tmpdir, 'b.jar', 'c.jar')]
+
+        def handler(artifact):
+            fetched.append(artifact['name'])
+            artifact['target'] = os.path.join('artifacts', artifact['target'])
+            return artifact['name']
+
+        # Results are returned in order of artifacts
+        assert generator.fetch_artifacts(handler) == ['a.jar', 'b.jar', 'c.jar']
+
+    assert sorted(fetched) == ['a.jar', 'b.jar', 'c.jar']
+
+    # Changes made by the handler are applied to duplicates too
+    for image in generator.images:
+        for artifact in image.all_artifacts:
+            assert artifact['target'] == os.path.join('artifacts', artifact['name'])
+
+
+def test_fetch_artifacts_stops_on_first_failure(tmpdir):
+    fetched = []
+
+    with docker_generator(tmpdir) as generator:
+        generator.images = [image_with_artifacts(tmpdir, 'a.jar', 'b.jar', 'c.jar')]
+
+        def handler(artifact):
+            fetched.append(artifact['name'])
+            raise CekitError("Cannot fetch '{}'".format(artifact['name']))
+
+        Config.cfg['common']['fetch_jobs'] = 1
+
+        with pytest.raises(CekitError, match="Cannot fetch 'a.jar'"):
+            generator.fetch_artifacts(handler)
+
+    assert fetched == ['a.jar']
+
+
+def git_module_repository(tmpdir):
+    def git(*args):
+        subprocess.check_output(['git', '-C', str(tmpdir.join('modules'))] + list(args), stderr=subprocess.STDOUT)
+
+    tmpdir.mkdir('modules').mkdir('foo').join('module.yaml').write(
+        yaml.dump({'name': 'foo', 'version': '1.0'}))
+    tmpdir.join('modules').mkdir('tests').mkdir('features').join('foo.feature').write('Feature: foo')
+    git('init', '--quiet')
+    git('add', 'foo', 'tests')
+    git('-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '--quiet', '-m', 'foo')
+    git('tag', '1.0')
+
+    return str(tmpdir.join('modules'))
+
+
+def test_module_registry_is_loaded_from_snapshot(tmpdir, mocker):
+    Config.cfg['common']['work_dir'] = str(tmpdir.join('work'))
+    url = git_module_repository(tmpdir)
+
+    image = Image({'name': 'foo', 'version': '1.0', 'from': 'bar',
+                   'modules': {'repositories': [{'name': 'modules', 'git': {'url': url, 'ref': '1.0'}}]}},
+                  str(tmpdir))
+
+    load_descriptor = mocker.spy(cekit.tools, 'load_descriptor')
+
+    with docker_generator(tmpdir) as generator:
+        generator.images = [image]
+        generator.build_module_registry()
+
+    assert load_descriptor.call_count == 1
+
+    # Second run does not scan the repository again, modules come from the snapshot
+    with docker_generator(tmpdir) as generator:
+        generator.images = [image]
+        generator.build_module_registry()
+
+        module = generator._module_registry.get_module('foo', '1.0')
+
+    assert load_descriptor.call_count == 1
+    assert module.path.startswith(str(tmpdir.join('work', 'cache', 'git', 'snapshots')))
+    assert os.path.isfile(os.path.join(module.path, 'module.yaml'))
+
+
+def test_module_repositories_are_registered_in_order(tmpdir, mocker):
+    Config.cfg['common']['work_dir'] = str(tmpdir)
+    released = threading.Event()
+
+    def repository(name, copy):
+        repo = mocker.Mock(target=name)
+        repo.name = name
+        repo.get.return_value = None
+        repo.copy.side_effect = copy
+        return repo
+
+    # First repository is ready only after the second one was fetched
+    repositories = [repository('first', lambda _: released.wait(5)),
+                    repository('second', lambda _: released.set())]
+
+    with docker_generator(tmpdir) as generator:
+        mocker.patch.object(generator, '_module_repositories', return_value=repositories)
+        mocker.patch.object(generator, '_find_modules', side_effect=lambda repo_dir: [os.path.basename(repo_dir)])
+        add_module = mocker.patch.object(generator, '_add_module')
+
+        generator.build_module_registry()
+
+    assert released.is_set()
+    assert add_module.call_args_list == [mocker.call('first'), mocker.call('second')]
+
+
+def test_tests_are_collected_from_git_module_repository(tmpdir, mocker):
+    Config.cfg['common']['work_dir'] = str(tmpdir.join('work'))
+    url = git_module_repository(tmpdir)
+
+    image = Image({'name': 'foo', 'version': '1.0', 'from': 'bar',
+                   'modules': {'repositories': [{'name': 'modules', 'git': {'url': url, 'ref': '1.0'}}]}},
+                  str(tmpdir))
+
+    with docker_generator(tmpdir) as generator:
+        generator.images = [image]
+        generator.build_module_registry()
+
+    mocker.patch.object(BehaveTestCollector, '_fetch_steps')
+    collector = BehaveTestCollector(str(tmpdir.mkdir('image')), str(tmpdir.join('target')))
+
+    assert collector.collect('1', 'https://github.com/cekit/behave-test-steps')
+    assert tmpdir.join('target', 'test', 'features', 'modules', 'foo.feature').check(file=1)
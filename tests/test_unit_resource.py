@@ -1,19 +1,28 @@
 import logging
 import pytest
 import os
+import shutil
+import ssl
+import subprocess
 import yaml
 
+import cekit.descriptor.resource
 from cekit.descriptor import Image, Overrides
 from cekit.descriptor.resource import create_resource
 from cekit.config import Config
 from cekit.errors import CekitError
-from cekit.tools import Chdir
+from cekit.tools import BrewArtifactNotFoundError
 
 try:
     from unittest.mock import call
 except ImportError:
     from mock import call
 
+try:
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import HTTPError
+
 config = Config()
 
 
@@ -27,7 +36,6 @@ def setup_function(function):
 def test_repository_dir_is_constructed_properly(mocker):
     mocker.patch('subprocess.check_output')
     mocker.patch('os.path.isdir', ret='True')
-    mocker.patch('cekit.descriptor.resource.Chdir', autospec=True)
 
     res = create_resource({'git': {'url': 'http://host.com/url/repo.git', 'ref': 'ref'}})
 
@@ -37,7 +45,6 @@ def test_repository_dir_is_constructed_properly(mocker):
 def test_repository_dir_uses_name_if_defined(mocker):
     mocker.patch('subprocess.check_output')
     mocker.patch('os.path.isdir', ret='True')
-    mocker.patch('cekit.descriptor.resource.Chdir', autospec=True)
 
     res = create_resource(
         {'name': 'some-id', 'git': {'url': 'http://host.com/url/repo.git', 'ref': 'ref'}})
@@ -47,7 +54,6 @@ def test_repository_dir_uses_name_if_defined(mocker):
 def test_repository_dir_uses_target_if_defined(mocker):
     mocker.patch('subprocess.check_output')
     mocker.patch('os.path.isdir', ret='True')
-    mocker.patch('cekit.descriptor.resource.Chdir', autospec=True)
 
     res = create_resource(
         {'target': 'some-name', 'git': {'url': 'http://host.com/url/repo.git', 'ref': 'ref'}})
@@ -57,16 +63,49 @@ def test_repository_dir_uses_target_if_defined(mocker):
 def test_git_clone(mocker):
     mock = mocker.patch('subprocess.check_output')
     mocker.patch('os.path.isdir', ret='True')
-    mocker.patch('cekit.descriptor.resource.Chdir', autospec=True)
 
     res = create_resource({'git': {'url': 'http://host.com/url/path.git', 'ref': 'ref'}})
     res.copy('dir')
     mock.assert_has_calls([
-        call(['git', 'clone', 'http://host.com/url/path.git', 'dir/path'], stderr=-2),
-        call(['git', 'checkout', 'ref'], stderr=-2)
+        call(['git', 'clone', '--shared', '--dissociate', '--no-checkout', '--quiet', mocker.ANY, 'dir/path'],
+             stderr=-2),
+        call(['git', '-C', 'dir/path', 'remote', 'set-url', 'origin', 'http://host.com/url/path.git'],
+             stderr=-2),
+        call(['git', '-C', 'dir/path', 'checkout', '--quiet', 'ref'], stderr=-2)
     ])
 
 
+def git(*args):
+    return subprocess.check_output(['git'] + list(args), stderr=subprocess.STDOUT).decode('utf-8').strip()
+
+
+def test_git_clone_uses_mirror(tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir.join('work'))
+
+    origin = str(tmpdir.join('origin'))
+    git('init', '--quiet', origin)
+    tmpdir.join('origin', 'module.yaml').write('name: foo')
+    git('-C', origin, 'add', 'module.yaml')
+    git('-C', origin, '-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '--quiet', '-m', 'foo')
+    git('-C', origin, 'tag', '1.0')
+
+    res = create_resource({'git': {'url': origin, 'ref': '1.0'}})
+    res.copy(str(tmpdir.join('first')))
+
+    # Origin is not available anymore, the tag is checked out from the mirror
+    shutil.rmtree(origin)
+    res.copy(str(tmpdir.join('second')))
+
+    assert tmpdir.join('second', 'module.yaml').read() == 'name: foo'
+    assert git('-C', str(tmpdir.join('second')), 'remote', 'get-url', 'origin') == origin
+
+    # Checkout is a part of the build context, it must not depend on the cache
+    shutil.rmtree(str(tmpdir.join('work')))
+
+    assert not tmpdir.join('second', '.git', 'objects', 'info', 'alternates').exists()
+    assert git('-C', str(tmpdir.join('second')), 'cat-file', '-p', 'HEAD:module.yaml') == 'name: foo'
+
+
 def get_res(mocker):
     res = mocker.Mock()
     res.status_code = 200
@@ -86,14 +125,12 @@ def get_mock_urlopen(mocker):
 
 
 def get_mock_ssl(mocker, ctx):
-    return mocker.patch('cekit.descriptor.resource.ssl.create_default_context',
+    return mocker.patch('cekit.descriptor.resource.ssl_context',
                         return_value=ctx)
 
 
 def test_fetching_with_ssl_verify(mocker):
     config.cfg['common']['ssl_verify'] = True
-    ctx = get_ctx(mocker)
-    get_mock_ssl(mocker, ctx)
     mock_urlopen = get_mock_urlopen(mocker)
 
     res = create_resource({'name': 'file', 'url': 'https:///dummy'})
@@ -103,17 +140,17 @@ def test_fetching_with_ssl_verify(mocker):
     except:
         pass
 
-    mock_urlopen.assert_called_with('https:///dummy', context=ctx)
+    mock_urlopen.assert_called_with('https:///dummy', context=mocker.ANY)
+
+    ctx = mock_urlopen.call_args[1]['context']
+
     assert ctx.check_hostname is True
-    assert ctx.verify_mode == 1
+    assert ctx.verify_mode == ssl.CERT_REQUIRED
 
 
 def test_fetching_disable_ssl_verify(mocker):
     config.cfg['common']['ssl_verify'] = False
-
     mock_urlopen = get_mock_urlopen(mocker)
-    ctx = get_ctx(mocker)
-    get_mock_ssl(mocker, ctx)
 
     res = create_resource({'name': 'file', 'url': 'https:///dummy'})
 
@@ -122,10 +159,12 @@ def test_fetching_disable_ssl_verify(mocker):
     except:
         pass
 
-    mock_urlopen.assert_called_with('https:///dummy', context=ctx)
+    mock_urlopen.assert_called_with('https:///dummy', context=mocker.ANY)
+
+    ctx = mock_urlopen.call_args[1]['context']
 
     assert ctx.check_hostname is False
-    assert ctx.verify_mode == 0
+    assert ctx.verify_mode == ssl.CERT_NONE
 
 
 def test_fetching_bad_status_code():
@@ -198,11 +237,11 @@ def test_generated_url_without_cacher():
 
 
 def test_resource_verify(mocker):
-    mock = mocker.patch('cekit.descriptor.resource.check_sum')
+    mock = mocker.patch('cekit.descriptor.resource.check_sums')
     res = create_resource({'url': 'dummy',
                            'sha256': 'justamocksum'})
     res._Resource__verify('dummy')
-    mock.assert_called_with('dummy', 'sha256', 'justamocksum', 'dummy')
+    mock.assert_called_with('dummy', {'sha256': 'justamocksum'}, 'dummy')
 
 
 def test_generated_url_with_cacher():
@@ -228,16 +267,16 @@ def test_path_resource_relative():
 def test_path_local_existing_resource_no_cacher_use(mocker):
     config.cfg['common']['cache_url'] = '#filename#,#algorithm#,#hash#'
     mocker.patch('os.path.exists', return_value=True)
-    shutil_mock = mocker.patch('shutil.copy2')
 
     res = create_resource({'name': 'foo',
                            'path': 'bar'}, directory='/foo')
 
+    copy_mock = mocker.patch.object(res, '_copy_file')
     mocker.spy(res, '_download_file')
 
     res.guarded_copy('target')
 
-    shutil_mock.assert_called_with('/foo/bar', 'target')
+    copy_mock.assert_called_with('/foo/bar', 'target', shutil.copystat)
     assert res._download_file.call_count == 0
 
 
@@ -332,7 +371,7 @@ def test_copy_plain_resource_from_brew(mocker, tmpdir):
     mocker.spy(res, '_Resource__substitute_cache_url')
 
     mock_get_brew_url = mocker.patch(
-        'cekit.descriptor.resource.get_brew_url', return_value='http://cache/abc')
+        'cekit.cache.artifact.ArtifactCache.brew_url', return_value='http://cache/abc')
 
     res.copy(str(tmpdir))
 
@@ -367,3 +406,366 @@ def test_overide_resource_remove_chksum():
     assert 'sha1' not in overrides['artifacts'][0]
     assert 'sha256' not in overrides['artifacts'][0]
     assert 'sha512' not in overrides['artifacts'][0]
+
+
+def test_resource_verify_skipped_when_already_verified(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    target = tmpdir.join('foo.jar')
+    target.write('')
+
+    check_sums_spy = mocker.spy(cekit.descriptor.resource, 'check_sums')
+
+    res = create_resource({'name': 'foo.jar', 'url': 'dummy',
+                           'md5': 'd41d8cd98f00b204e9800998ecf8427e'})
+
+    assert res._Resource__verify(str(target))
+    assert res._Resource__verify(str(target))
+    assert check_sums_spy.call_count == 1
+
+    # Verification is forced in paranoid mode
+    config.cfg['common']['paranoid'] = True
+
+    assert res._Resource__verify(str(target))
+    assert check_sums_spy.call_count == 2
+
+
+def test_cacher_miss_is_remembered(mocker, tmpdir):
+    config.cfg['common']['cache_url'] = 'http://cache/#algorithm#/#hash#'
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    urlopen_class_mock = mocker.patch('cekit.descriptor.resource.urlopen', side_effect=Exception('timeout'))
+
+    res = create_resource({'name': 'foo', 'md5': '5b9164ad6f496d9dee12ec7634ce253f'})
+
+    for _ in range(2):
+        with pytest.raises(CekitError, match="Artifact foo could not be found"):
+            res._copy_impl(str(tmpdir.join('foo')))
+
+    # Cacher is asked only once
+    urlopen_class_mock.assert_called_once_with('http://cache/md5/5b9164ad6f496d9dee12ec7634ce253f', context=mocker.ANY)
+
+    res.cache.flush_misses()
+
+    with pytest.raises(CekitError, match="Artifact foo could not be found"):
+        res._copy_impl(str(tmpdir.join('foo')))
+
+    assert urlopen_class_mock.call_count == 2
+
+
+def test_brew_miss_is_remembered(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+    config.cfg['common']['redhat'] = True
+
+    mock_get_brew_url = mocker.patch('cekit.cache.artifact.ArtifactCache.brew_url',
+                                     side_effect=BrewArtifactNotFoundError('not found'))
+
+    res = create_resource({'name': 'foo', 'md5': '5b9164ad6f496d9dee12ec7634ce253f', 'sha1': 'abcd'})
+
+    for _ in range(2):
+        with pytest.raises(CekitError, match="Artifact foo could not be found"):
+            res._copy_impl(str(tmpdir.join('foo')))
+
+    mock_get_brew_url.assert_called_once_with('5b9164ad6f496d9dee12ec7634ce253f')
+
+    # Brew is queried by the md5 checksum, the miss is recorded by it
+    assert res.cache.known_miss('brew', 'md5:5b9164ad6f496d9dee12ec7634ce253f')
+
+
+def test_brew_download_failure_is_not_remembered_as_miss(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+    config.cfg['common']['redhat'] = True
+
+    mocker.patch('cekit.cache.artifact.ArtifactCache.brew_url', return_value='http://brew/foo.jar')
+    mock_download = mocker.patch('cekit.descriptor.resource.Resource._download_file',
+                                 side_effect=IOError('Connection reset by peer'))
+
+    res = create_resource({'name': 'foo', 'md5': '5B9164AD6F496D9DEE12EC7634CE253F', 'sha1': 'abcd'})
+
+    for _ in range(2):
+        with pytest.raises(CekitError, match="Artifact foo could not be found"):
+            res._copy_impl(str(tmpdir.join('foo')))
+
+    # Artifact exists in Brew, the download is tried again
+    assert mock_download.call_count == 2
+    assert not res.cache.known_miss('brew', 'md5:5b9164ad6f496d9dee12ec7634ce253f')
+
+
+def test_brew_miss_is_not_remembered_with_zero_ttl(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+    config.cfg['common']['redhat'] = True
+    config.cfg['common']['cache_negative_ttl'] = '0'
+
+    mock_get_brew_url = mocker.patch('cekit.cache.artifact.ArtifactCache.brew_url',
+                                     side_effect=BrewArtifactNotFoundError('not found'))
+
+    res = create_resource({'name': 'foo', 'md5': '5b9164ad6f496d9dee12ec7634ce253f'})
+
+    for _ in range(2):
+        with pytest.raises(CekitError, match="Artifact foo could not be found"):
+            res._copy_impl(str(tmpdir.join('foo')))
+
+    assert mock_get_brew_url.call_count == 2
+
+
+def get_mock_response(mocker, content, headers):
+    response = mocker.Mock()
+    response.getcode.return_value = 200
+    response.read.side_effect = [content, None]
+    response.info.return_value = headers
+    return response
+
+
+def test_url_resource_without_checksum_is_revalidated(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    urlopen_class_mock = mocker.patch('cekit.descriptor.resource.urlopen', side_effect=[
+        get_mock_response(mocker, b'foo', {'ETag': '"1"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}),
+        HTTPError('http://server.org/foo.repo', 304, 'Not Modified', {}, None),
+        get_mock_response(mocker, b'bar', {'ETag': '"2"'})])
+
+    target = str(tmpdir.join('foo.repo'))
+
+    for expected in ['foo', 'foo', 'bar']:
+        res = create_resource({'url': 'http://server.org/foo.repo'})
+        res.copy(target)
+
+        with open(target) as f:
+            assert f.read() == expected
+
+    first, second, third = [c[0][0] for c in urlopen_class_mock.call_args_list]
+
+    # Nothing to revalidate the first time, plain URL is requested
+    assert first == 'http://server.org/foo.repo'
+    assert second.get_header('If-none-match') == '"1"'
+    assert second.get_header('If-modified-since') == 'Wed, 21 Oct 2015 07:28:00 GMT'
+    assert third.get_header('If-none-match') == '"1"'
+    assert res.cache.get_url('http://server.org/foo.repo')['etag'] == '"2"'
+
+
+def test_url_resource_without_validators_is_not_cached(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    urlopen_class_mock = mocker.patch('cekit.descriptor.resource.urlopen', side_effect=[
+        get_mock_response(mocker, b'foo', {}), get_mock_response(mocker, b'foo', {})])
+
+    target = str(tmpdir.join('foo.repo'))
+
+    for _ in range(2):
+        create_resource({'url': 'http://server.org/foo.repo'}).copy(target)
+
+        with open(target) as f:
+            assert f.read() == 'foo'
+
+    assert [c[0][0] for c in urlopen_class_mock.call_args_list] == ['http://server.org/foo.repo'] * 2
+
+
+def get_interrupted_response(mocker, content, headers):
+    response = get_mock_response(mocker, content, headers)
+    response.read.side_effect = [content, IOError('Connection reset by peer')]
+    return response
+
+
+def test_url_resource_download_is_resumed(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    headers = {'ETag': '"1"', 'Accept-Ranges': 'bytes', 'Content-Length': '6'}
+    resumed = get_mock_response(mocker, b'bar', {})
+    resumed.getcode.return_value = 206
+
+    urlopen_class_mock = mocker.patch('cekit.descriptor.resource.urlopen', side_effect=[
+        get_interrupted_response(mocker, b'foo', headers), resumed])
+
+    res = create_resource({'url': 'http://server.org/foo.jar', 'md5': '3858f62230ac3c915f300c664312c63f'})
+    res.copy(str(tmpdir.join('foo.jar')))
+
+    with open(str(tmpdir.join('foo.jar'))) as f:
+        assert f.read() == 'foobar'
+
+    request = urlopen_class_mock.call_args_list[1][0][0]
+
+    assert request.get_header('Range') == 'bytes=3-'
+    assert request.get_header('If-range') == '"1"'
+    assert os.listdir(os.path.join(str(tmpdir), 'cache', 'partial')) == []
+
+
+def test_url_resource_download_closed_early_is_resumed(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    # Server closes the connection before all announced bytes are sent
+    headers = {'ETag': '"1"', 'Accept-Ranges': 'bytes', 'Content-Length': '6'}
+    resumed = get_mock_response(mocker, b'bar', {'Content-Length': '3'})
+    resumed.getcode.return_value = 206
+
+    urlopen_class_mock = mocker.patch('cekit.descriptor.resource.urlopen', side_effect=[
+        get_mock_response(mocker, b'foo', headers), resumed])
+
+    res = create_resource({'url': 'http://server.org/foo.jar', 'md5': '3858f62230ac3c915f300c664312c63f'})
+    res.copy(str(tmpdir.join('foo.jar')))
+
+    with open(str(tmpdir.join('foo.jar'))) as f:
+        assert f.read() == 'foobar'
+
+    assert urlopen_class_mock.call_args_list[1][0][0].get_header('Range') == 'bytes=3-'
+    assert os.listdir(os.path.join(str(tmpdir), 'cache', 'partial')) == []
+
+
+def test_url_resource_partial_download_is_kept_for_later_runs(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+    mocker.patch('cekit.descriptor.resource.DOWNLOAD_ATTEMPTS', 1)
+
+    headers = {'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT', 'Accept-Ranges': 'bytes', 'Content-Length': '6'}
+    resumed = get_mock_response(mocker, b'bar', {})
+    resumed.getcode.return_value = 206
+
+    urlopen_class_mock = mocker.patch('cekit.descriptor.resource.urlopen', side_effect=[
+        get_interrupted_response(mocker, b'foo', headers),
+        HTTPError('http://server.org/foo.jar', 503, 'Service Unavailable', {}, None),
+        resumed])
+
+    res = create_resource({'url': 'http://server.org/foo.jar', 'md5': '3858f62230ac3c915f300c664312c63f'})
+
+    with pytest.raises(CekitError, match="Error copying resource"):
+        res.copy(str(tmpdir.join('foo.jar')))
+
+    partial = os.path.join(str(tmpdir), 'cache', 'partial', 'md5-3858f62230ac3c915f300c664312c63f')
+
+    with open(partial) as f:
+        assert f.read() == 'foo'
+
+    res.copy(str(tmpdir.join('foo.jar')))
+
+    with open(str(tmpdir.join('foo.jar'))) as f:
+        assert f.read() == 'foobar'
+
+    assert urlopen_class_mock.call_args_list[2][0][0].get_header('Range') == 'bytes=3-'
+    assert not os.path.exists(partial)
+
+
+def test_url_resource_download_restarts_if_file_changed(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    headers = {'ETag': '"1"', 'Accept-Ranges': 'bytes', 'Content-Length': '6'}
+
+    # Server ignores the range, because the file changed
+    mocker.patch('cekit.descriptor.resource.urlopen', side_effect=[
+        get_interrupted_response(mocker, b'foo', headers),
+        get_mock_response(mocker, b'foobar', {'ETag': '"2"'})])
+
+    res = create_resource({'url': 'http://server.org/foo.jar', 'md5': '3858f62230ac3c915f300c664312c63f'})
+    res.copy(str(tmpdir.join('foo.jar')))
+
+    with open(str(tmpdir.join('foo.jar'))) as f:
+        assert f.read() == 'foobar'
+
+
+def test_url_resource_checksums_are_computed_while_downloading(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    mocker.patch('cekit.descriptor.resource.urlopen', return_value=get_mock_response(mocker, b'foobar', {}))
+    get_sums = mocker.patch('cekit.cache.artifact.get_sums')
+    check_sums = mocker.patch('cekit.descriptor.resource.check_sums')
+
+    res = create_resource({'url': 'http://server.org/foo.jar', 'md5': '3858f62230ac3c915f300c664312c63f'})
+    res.copy(str(tmpdir.join('foo.jar')))
+
+    # Downloaded file is never read again to verify it or to add it to the cache
+    get_sums.assert_not_called()
+    check_sums.assert_not_called()
+
+    cached = res.cache.get(res)
+
+    assert cached['sha256'] == 'c3ab8ff13720e8ad9047dd39466b3c8974e592c2fa383d4a3960714caef0c4f2'
+    assert cached['md5'] == '3858f62230ac3c915f300c664312c63f'
+
+
+def test_url_resource_download_with_wrong_checksum_fails(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    mocker.patch('cekit.descriptor.resource.urlopen', side_effect=[
+        get_mock_response(mocker, b'foo', {}), get_mock_response(mocker, b'foo', {})])
+
+    res = create_resource({'url': 'http://server.org/foo.jar', 'md5': '3858f62230ac3c915f300c664312c63f'})
+
+    with pytest.raises(CekitError, match="Artifact checksum verification failed!"):
+        res.copy(str(tmpdir.join('foo.jar')))
+
+    assert os.listdir(os.path.join(str(tmpdir), 'cache', 'partial')) == []
+
+
+def test_url_resource_mirror_urls(mocker):
+    config.cfg['mirrors'] = {'__name__': 'mirrors',
+                             'central': 'https://repo1.maven.org/ https://mirror.example.com/maven/'}
+
+    res = create_resource({'url': 'https://repo1.maven.org/org/foo.jar',
+                           'mirrors': ['https://other.example.com/foo.jar'],
+                           'md5': '3858f62230ac3c915f300c664312c63f'})
+
+    try:
+        assert res._mirror_urls() == ['https://repo1.maven.org/org/foo.jar',
+                                      'https://other.example.com/foo.jar',
+                                      'https://mirror.example.com/maven/org/foo.jar']
+    finally:
+        config.cfg['mirrors'] = {}
+
+
+def test_url_resource_download_fails_over_to_next_mirror(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    headers = {'ETag': '"1"', 'Accept-Ranges': 'bytes', 'Content-Length': '6'}
+    resumed = get_mock_response(mocker, b'bar', {'ETag': '"2"'})
+    resumed.getcode.return_value = 206
+
+    mocker.patch('cekit.descriptor.resource.DOWNLOAD_ATTEMPTS', 1)
+    mocker.patch('cekit.cache.artifact.ArtifactCache.rank_urls', side_effect=lambda urls: urls)
+    record_latency = mocker.patch('cekit.cache.artifact.ArtifactCache.record_latency')
+    urlopen_class_mock = mocker.patch('cekit.descriptor.resource.urlopen', side_effect=[
+        get_interrupted_response(mocker, b'foo', headers), resumed])
+
+    res = create_resource({'url': 'http://server.org/foo.jar',
+                           'mirrors': ['http://mirror.org/foo.jar'],
+                           'md5': '3858f62230ac3c915f300c664312c63f'})
+    res.copy(str(tmpdir.join('foo.jar')))
+
+    with open(str(tmpdir.join('foo.jar'))) as f:
+        assert f.read() == 'foobar'
+
+    request = urlopen_class_mock.call_args_list[1][0][0]
+
+    # Download continues from the mirror, validator of the first server is not sent to it
+    assert request.get_full_url() == 'http://mirror.org/foo.jar'
+    assert request.get_header('Range') == 'bytes=3-'
+    assert request.get_header('If-range') is None
+    record_latency.assert_called_once_with('http://server.org/foo.jar', None)
+
+
+def test_url_resource_remote_checksums_are_remembered(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    urlopen_class_mock = mocker.patch('cekit.descriptor.resource.urlopen', side_effect=[
+        get_mock_response(mocker, b'foobar', {'ETag': '"1"'}),
+        HTTPError('http://server.org/foo.jar', 304, 'Not Modified', {}, None)])
+
+    res = create_resource({'url': 'http://server.org/foo.jar'})
+
+    assert res.remote_checksums()['md5'] == '3858f62230ac3c915f300c664312c63f'
+
+    # Nothing is written to disk, neither to the cache nor to a temporary file
+    assert not os.path.exists(os.path.join(str(tmpdir), 'cache', 'urls'))
+
+    # File did not change, it is not downloaded again
+    assert res.remote_checksums()['md5'] == '3858f62230ac3c915f300c664312c63f'
+    assert urlopen_class_mock.call_args_list[1][0][0].get_header('If-none-match') == '"1"'
+
+
+def test_url_resource_remote_checksums_without_validators_are_not_remembered(mocker, tmpdir):
+    config.cfg['common']['work_dir'] = str(tmpdir)
+
+    urlopen_class_mock = mocker.patch('cekit.descriptor.resource.urlopen', side_effect=[
+        get_mock_response(mocker, b'foobar', {}), get_mock_response(mocker, b'foo', {})])
+
+    res = create_resource({'url': 'http://server.org/foo.jar'})
+
+    assert res.remote_checksums()['md5'] == '3858f62230ac3c915f300c664312c63f'
+    assert res.remote_checksums()['md5'] == 'acbd18db4cc2f85cedef654fccc4a4d8'
+    assert [c[0][0] for c in urlopen_class_mock.call_args_list] == ['http://server.org/foo.jar'] * 2
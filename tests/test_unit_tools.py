@@ -1,6 +1,10 @@
+import ast
+import errno
+import json
 import logging
 import subprocess
 import sys
+import threading
 from contextlib import contextmanager
 
 import pytest
@@ -250,6 +254,19 @@ def test_merge_run_cmd():
     assert override['user'] == 'foo'
 
 
+def multicall(brew_call):
+    """
+    Returns a mock of a 'brew call multiCall' command, answering every call
+    in the batch with the response of the provided brew_call function.
+    """
+
+    def call(cmd, *args, **kwargs):
+        calls = ast.literal_eval(cmd[-1][len('calls='):])
+        return json.dumps([[yaml.safe_load(brew_call([c['methodName']]))] for c in calls]).encode("utf8")
+
+    return call
+
+
 def brew_call_ok(*args, **kwargs):
     if 'listArchives' in args[0]:
         return """
@@ -388,13 +405,13 @@ def brew_call_removed(*args, **kwargs):
 
 
 def test_get_brew_url(mocker):
-    mocker.patch('subprocess.check_output', side_effect=brew_call_ok)
+    mocker.patch('subprocess.check_output', side_effect=multicall(brew_call_ok))
     url = tools.get_brew_url('aa')
     assert url == "http://download.devel.redhat.com/brewroot/packages/net.oauth.core-oauth/20100527/1/maven/net/oauth/core/oauth/20100527/oauth-20100527.jar"
 
 
 def test_get_brew_url_when_build_was_removed(mocker):
-    mocker.patch('subprocess.check_output', side_effect=brew_call_removed)
+    mocker.patch('subprocess.check_output', side_effect=multicall(brew_call_removed))
 
     with pytest.raises(CekitError) as excinfo:
         tools.get_brew_url('aa')
@@ -403,6 +420,30 @@ def test_get_brew_url_when_build_was_removed(mocker):
         excinfo.value)
 
 
+def test_get_brew_urls_resolves_all_checksums_at_once(mocker):
+    check_output = mocker.patch('subprocess.check_output', side_effect=multicall(brew_call_ok))
+    urls = tools.get_brew_urls(['aa', 'bb', 'cc'])
+
+    assert urls == dict.fromkeys(['aa', 'bb', 'cc'], "http://download.devel.redhat.com/brewroot/packages/"
+                                 "net.oauth.core-oauth/20100527/1/maven/net/oauth/core/oauth/20100527/oauth-20100527.jar")
+
+    # One call listing archives and one fetching the (single) build
+    assert check_output.call_count == 2
+    assert check_output.call_args_list[0][0][0][:5] == ['/usr/bin/brew', 'call', '--json-output', '--python', 'multiCall']
+
+
+def test_get_brew_urls_reports_missing_artifacts(mocker):
+    def brew_call(cmd, *args, **kwargs):
+        calls = ast.literal_eval(cmd[-1][len('calls='):])
+        return json.dumps([[[]] for _ in calls]).encode("utf8")
+
+    mocker.patch('subprocess.check_output', side_effect=brew_call)
+    urls = tools.get_brew_urls(['aa'])
+
+    assert isinstance(urls['aa'], CekitError)
+    assert 'Artifact with md5 checksum aa could not be found in Brew' in str(urls['aa'])
+
+
 # https://github.com/cekit/cekit/issues/502
 def test_get_brew_url_no_kerberos(mocker, caplog):
     caplog.set_level(logging.DEBUG, logger="cekit")
@@ -421,7 +462,7 @@ def test_get_brew_url_no_kerberos(mocker, caplog):
 
 # https://github.com/cekit/cekit/issues/531
 def test_get_brew_url_with_artifact_containing_dot(mocker):
-    mocker.patch('subprocess.check_output', side_effect=brew_call_ok_with_dot)
+    mocker.patch('subprocess.check_output', side_effect=multicall(brew_call_ok_with_dot))
     url = tools.get_brew_url('aa')
     assert url == "http://download.devel.redhat.com/brewroot/packages/org.glassfish-javax.json/1.0.4/1/maven/org/glassfish/javax.json/1.0.4/javax.json-1.0.4.jar"
 
@@ -645,3 +686,111 @@ def test_handle_core_dependencies_with_certifi(mocker, caplog):
 
     assert "The certifi library (https://certifi.io/) was found, depending on the operating system configuration this may result in certificate validation issues" in caplog.text
     assert "Certificate Authority (CA) bundle in use: 'a/path.pem'" in caplog.text
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('1024', 1024),
+    (2048, 2048),
+    ('1K', 1024),
+    ('1.5M', 1572864),
+    ('20G', 21474836480),
+    ('20gb', 21474836480),
+    ('1T', 1099511627776)
+])
+def test_parse_size(value, expected):
+    assert tools.parse_size(value) == expected
+
+
+def test_parse_size_invalid():
+    with pytest.raises(CekitError, match=r"^Invalid size: '20X'"):
+        tools.parse_size('20X')
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('3600', 3600),
+    ('30s', 30),
+    ('5m', 300),
+    ('12h', 43200),
+    ('30d', 2592000),
+    ('1w', 604800)
+])
+def test_parse_duration(value, expected):
+    assert tools.parse_duration(value) == expected
+
+
+def test_parse_duration_invalid():
+    with pytest.raises(CekitError, match=r"^Invalid duration: 'soon'"):
+        tools.parse_duration('soon')
+
+
+def test_file_lock(tmpdir):
+    lock_file = str(tmpdir.join('locks', 'foo.lock'))
+
+    with tools.FileLock(lock_file) as acquired:
+        assert acquired
+
+        # Reentrant within the same thread
+        with tools.FileLock(lock_file, blocking=False) as acquired_again:
+            assert acquired_again
+
+    with tools.FileLock(lock_file, blocking=False) as acquired:
+        assert acquired
+
+
+def test_file_lock_held_by_other_thread(tmpdir):
+    lock_file = str(tmpdir.join('foo.lock'))
+    results = []
+
+    def try_lock():
+        with tools.FileLock(lock_file, blocking=False) as acquired:
+            results.append(acquired)
+
+    with tools.FileLock(lock_file):
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+
+    try_lock()
+
+    assert results == [False, True]
+
+
+def test_file_lock_removed_while_waiting(tmpdir):
+    lock_file = str(tmpdir.join('foo.lock'))
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def wait_for_lock():
+        with tools.FileLock(lock_file):
+            acquired.set()
+            release.wait()
+
+    holder = tools.FileLock(lock_file)
+    holder.__enter__()
+
+    thread = threading.Thread(target=wait_for_lock)
+    thread.start()
+
+    holder.remove()
+    holder.__exit__(None, None, None)
+
+    assert acquired.wait(5)
+
+    # Waiting thread locked the newly created lock file, not the removed one
+    with tools.FileLock(lock_file, blocking=False) as locked:
+        assert not locked
+
+    release.set()
+    thread.join()
+
+
+def test_reflink_not_supported(mocker, tmpdir):
+    source = tmpdir.join('source')
+    source.write('foo')
+
+    mocker.patch('fcntl.ioctl', side_effect=IOError(errno.EOPNOTSUPP, 'Operation not supported'))
+
+    with pytest.raises((IOError, OSError)):
+        tools.reflink(str(source), str(tmpdir.join('target')))
+
+    assert not tmpdir.join('target').exists()
@@ -677,8 +677,8 @@ def test_run_override_artifact_with_custom_override_destination(tmpdir):
 
 def test_run_override_artifact_with_custom_override_example1(tmpdir, mocker, caplog):
     # Ignore checksum verification.
-    mocker.patch('cekit.crypto.get_sum', return_value='123456')
-    mocker.patch('cekit.cache.artifact.get_sum', return_value='123456')
+    mocker.patch('cekit.crypto.get_sums', side_effect=lambda _, algs: dict((alg, '123456') for alg in algs))
+    mocker.patch('cekit.cache.artifact.get_sums', side_effect=lambda _, algs: dict((alg, '123456') for alg in algs))
 
     cache_id = uuid.uuid4()
     mocker.patch('uuid.uuid4', return_value=cache_id)
@@ -739,8 +739,8 @@ def test_run_override_artifact_with_custom_override_example1(tmpdir, mocker, cap
 
 def test_run_override_artifact_with_custom_override_example2(tmpdir, mocker, caplog):
     # Ignore checksum verification.
-    mocker.patch('cekit.crypto.get_sum', return_value='123456')
-    mocker.patch('cekit.cache.artifact.get_sum', return_value='123456')
+    mocker.patch('cekit.crypto.get_sums', side_effect=lambda _, algs: dict((alg, '123456') for alg in algs))
+    mocker.patch('cekit.cache.artifact.get_sums', side_effect=lambda _, algs: dict((alg, '123456') for alg in algs))
 
     cache_id = uuid.uuid4()
     mocker.patch('uuid.uuid4', return_value=cache_id)
@@ -3,9 +3,11 @@ import re
 import sys
 
 import pytest
+import yaml
 
 from click.testing import CliRunner
 
+from cekit.cache.artifact import ArtifactCache
 from cekit.cache.cli import cli
 from cekit.crypto import SUPPORTED_HASH_ALGORITHMS
 
@@ -81,6 +83,38 @@ def test_cekit_cache_add_artifact_existing(tmpdir):
     assert 'is already cached!' in result.output
 
 
+def test_cekit_cache_add_artifact_added_concurrently(tmpdir, mocker):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+
+    artifact = os.path.join(work_dir, 'artifact')
+    open(artifact, 'a').close()
+
+    args = ['-v',
+            '--work-dir',
+            work_dir,
+            'add',
+            artifact,
+            '--md5',
+            'd41d8cd98f00b204e9800998ecf8427e']
+
+    lock = ArtifactCache.lock
+    added = []
+
+    def concurrent_add(cache, resource):
+        # Other process adds the artifact while this one is waiting for the lock
+        if not added:
+            added.append(resource)
+            cache.add(resource)
+
+        return lock(cache, resource)
+
+    mocker.patch.object(ArtifactCache, 'lock', autospec=True, side_effect=concurrent_add)
+
+    result = run_cekit_cache(args)
+
+    assert 'is already cached!' in result.output
+
+
 def test_cekit_cache_delete_artifact(tmpdir):
     work_dir = str(tmpdir.mkdir('work_dir'))
     artifact = os.path.join(work_dir, 'artifact')
@@ -225,6 +259,305 @@ def test_cekit_cache_clear_with_error(mocker, tmpdir):
         os.path.join(work_dir, 'cache')) in result.output
 
 
+def test_cekit_cache_gc(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+
+    artifact = os.path.join(work_dir, 'artifact')
+
+    with open(artifact, 'w') as fd:
+        fd.write('foo')
+
+    result = run_cekit_cache(['-v',
+                              '--work-dir',
+                              work_dir,
+                              'add',
+                              artifact,
+                              '--md5',
+                              'acbd18db4cc2f85cedef654fccc4a4d8'])
+
+    artifact_uuid = re.search(r'\'(.*)\'$', result.output).group(1)
+
+    result = run_cekit_cache(['-v',
+                              '--work-dir',
+                              work_dir,
+                              'gc',
+                              '--max-age',
+                              '1d'])
+
+    assert "0 artifact(s), 0 bytes evicted" in result.output
+
+    result = run_cekit_cache(['-v',
+                              '--work-dir',
+                              work_dir,
+                              'gc',
+                              '--max-size',
+                              '0'])
+
+    assert "Artifact with UUID '{}' (3 bytes) removed".format(artifact_uuid) in result.output
+    assert "1 artifact(s), 3 bytes evicted" in result.output
+
+    result = run_cekit_cache(['-v',
+                              '--work-dir',
+                              work_dir,
+                              'ls'])
+
+    assert 'No artifacts cached!' in result.output
+
+
+def test_cekit_cache_gc_without_limits(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'gc'], 2)
+
+    assert "At least one of --max-size or --max-age must be provided" in result.output
+
+
+def test_cekit_cache_add_manifest(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+
+    with open(os.path.join(work_dir, 'foo'), 'w') as fd:
+        fd.write('foo')
+
+    with open(os.path.join(work_dir, 'bar'), 'w') as fd:
+        fd.write('bar')
+
+    manifest = os.path.join(work_dir, 'manifest.yaml')
+
+    with open(manifest, 'w') as fd:
+        yaml.safe_dump([{'path': 'foo', 'md5': 'acbd18db4cc2f85cedef654fccc4a4d8'},
+                        {'path': 'bar', 'md5': '37b51d194a7513e45b56f6524f2d51f2'},
+                        {'path': 'bar', 'name': 'baz', 'md5': 'd41d8cd98f00b204e9800998ecf8427e'},
+                        {'path': 'missing'}], fd)
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'add',
+                              '--manifest',
+                              manifest,
+                              '--jobs',
+                              '2'], 1)
+
+    assert "Artifact foo cached with UUID" in result.output
+    assert "Artifact bar cached with UUID" in result.output
+    assert "Cannot cache artifact baz" in result.output
+    assert "Cannot cache artifact missing: at least one checksum must be provided" in result.output
+    assert "2 artifact(s) cached, 0 already cached, 2 failed" in result.output
+
+    with open(manifest, 'w') as fd:
+        yaml.safe_dump({'artifacts': [{'path': 'foo', 'md5': 'acbd18db4cc2f85cedef654fccc4a4d8'}]}, fd)
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'add',
+                              '--manifest',
+                              manifest])
+
+    assert "Artifact foo is already cached!" in result.output
+    assert "0 artifact(s) cached, 1 already cached, 0 failed" in result.output
+
+
+def test_cekit_cache_add_manifest_with_location(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'add',
+                              'artifact',
+                              '--manifest',
+                              'manifest.yaml'], 2)
+
+    assert "LOCATION and checksums cannot be used together with --manifest" in result.output
+
+
+def test_cekit_cache_prefetch(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+    image_dir = str(tmpdir.mkdir('image'))
+
+    for name, content in [('foo', 'foo'), ('bar', 'bar'), ('baz', '')]:
+        with open(os.path.join(image_dir, name), 'w') as fd:
+            fd.write(content)
+
+    descriptor = os.path.join(image_dir, 'image.yaml')
+
+    with open(descriptor, 'w') as fd:
+        yaml.safe_dump([{'name': 'builder', 'version': '1.0', 'from': 'centos:7',
+                         'artifacts': [{'path': 'foo', 'md5': 'acbd18db4cc2f85cedef654fccc4a4d8'}]},
+                        {'name': 'image', 'version': '1.0', 'from': 'centos:7',
+                         'artifacts': [{'path': 'foo', 'md5': 'acbd18db4cc2f85cedef654fccc4a4d8'},
+                                       {'path': 'baz'}]}], fd)
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'prefetch',
+                              '--descriptor',
+                              descriptor,
+                              '--overrides',
+                              '{"artifacts": [{"path": "bar", "md5": "37b51d194a7513e45b56f6524f2d51f2"}]}'])
+
+    assert "Artifact foo cached with UUID" in result.output
+    assert "Artifact bar cached with UUID" in result.output
+    assert "Artifact baz" not in result.output
+    assert "2 artifact(s) cached, 0 already cached, 0 failed" in result.output
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'prefetch',
+                              '--descriptor',
+                              descriptor])
+
+    assert "0 artifact(s) cached, 1 already cached, 0 failed" in result.output
+
+
+def test_cekit_cache_export_import(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+    other_work_dir = str(tmpdir.mkdir('other_work_dir'))
+    image_dir = str(tmpdir.mkdir('image'))
+
+    with open(os.path.join(image_dir, 'foo'), 'w') as fd:
+        fd.write('foo')
+
+    descriptor = os.path.join(image_dir, 'image.yaml')
+    bundle = os.path.join(str(tmpdir), 'bundle.tar')
+
+    with open(descriptor, 'w') as fd:
+        yaml.safe_dump({'name': 'image', 'version': '1.0', 'from': 'centos:7',
+                        'artifacts': [{'path': 'foo', 'md5': 'acbd18db4cc2f85cedef654fccc4a4d8'}]}, fd)
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'export',
+                              '--descriptor',
+                              descriptor,
+                              '-o',
+                              bundle], 1)
+
+    assert "Artifact foo is not cached" in result.output
+
+    run_cekit_cache(['--work-dir',
+                     work_dir,
+                     'prefetch',
+                     '--descriptor',
+                     descriptor])
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'export',
+                              '--descriptor',
+                              descriptor,
+                              '-o',
+                              bundle])
+
+    assert "1 artifact(s) exported to '{}'".format(bundle) in result.output
+
+    result = run_cekit_cache(['--work-dir',
+                              other_work_dir,
+                              'import',
+                              bundle])
+
+    assert "Artifact foo imported with UUID" in result.output
+    assert "1 artifact(s) imported, 0 already cached" in result.output
+
+    result = run_cekit_cache(['--work-dir',
+                              other_work_dir,
+                              'ls'])
+
+    assert "md5: acbd18db4cc2f85cedef654fccc4a4d8" in result.output
+
+
+def test_cekit_cache_prefetch_invalid_descriptor(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'prefetch',
+                              '--descriptor',
+                              os.path.join(work_dir, 'missing.yaml')], 1)
+
+    assert "Cannot resolve artifacts for image" in result.output
+
+
+def test_cekit_cache_verify(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+
+    artifact = os.path.join(work_dir, 'artifact')
+
+    with open(artifact, 'w') as fd:
+        fd.write('foo')
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'add',
+                              artifact,
+                              '--md5',
+                              'acbd18db4cc2f85cedef654fccc4a4d8'])
+
+    artifact_uuid = re.search(r'\'(.*)\'$', result.output).group(1)
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'verify'])
+
+    assert "1 artifact(s) verified, 0 corrupted, 0 missing, 0 in use" in result.output
+
+    with open(os.path.join(work_dir, 'cache', artifact_uuid), 'w') as fd:
+        fd.write('bar')
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'verify',
+                              '--jobs',
+                              '2'], 1)
+
+    assert "Artifact with UUID '{}' is corrupted, moved to quarantine".format(artifact_uuid) in result.output
+    assert "1 artifact(s) verified, 1 corrupted, 0 missing, 0 in use" in result.output
+    assert os.path.exists(os.path.join(work_dir, 'cache', 'quarantine', artifact_uuid))
+
+
+def test_cekit_cache_flush_misses(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'flush-misses'])
+
+    assert "0 recorded miss(es) removed" in result.output
+
+
+def test_cekit_cache_stats(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'stats'])
+
+    assert "0 hit(s), 0 miss(es)" in result.output
+    assert "0 bytes served from cache, 0 bytes downloaded" in result.output
+    assert "local: 0 hit(s), 0 miss(es)" in result.output
+    assert "Slowest artifacts:" not in result.output
+
+
+def test_cekit_cache_stats_with_artifacts(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+    artifact = os.path.join(work_dir, 'artifact')
+    open(artifact, 'a').close()
+
+    run_cekit_cache(['--work-dir',
+                     work_dir,
+                     'add',
+                     artifact,
+                     '--md5',
+                     'd41d8cd98f00b204e9800998ecf8427e'])
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'stats'])
+
+    assert "Slowest artifacts:" in result.output
+    assert "  artifact: " in result.output
+
+
 def run_cekit_cache(args, return_code=0, i=None):
     result = CliRunner().invoke(cli, args, input=i, catch_exceptions=False)
     sys.stdout.write("\n")
@@ -233,3 +566,30 @@ def run_cekit_cache(args, return_code=0, i=None):
     assert result.exit_code == return_code
 
     return result
+
+
+def test_cekit_cache_prefetch_module_artifacts(tmpdir):
+    work_dir = str(tmpdir.mkdir('work_dir'))
+    image_dir = tmpdir.mkdir('image')
+    module_dir = image_dir.mkdir('modules').mkdir('foo')
+
+    module_dir.join('data.txt').write('foo')
+    module_dir.join('module.yaml').write(yaml.safe_dump(
+        {'name': 'foo', 'version': '1.0',
+         'artifacts': [{'path': 'data.txt', 'md5': 'acbd18db4cc2f85cedef654fccc4a4d8'}]}))
+
+    descriptor = str(image_dir.join('image.yaml'))
+
+    with open(descriptor, 'w') as fd:
+        yaml.safe_dump({'name': 'image', 'version': '1.0', 'from': 'centos:7',
+                        'modules': {'repositories': [{'path': 'modules'}], 'install': [{'name': 'foo'}]}}, fd)
+
+    result = run_cekit_cache(['--work-dir',
+                              work_dir,
+                              'prefetch',
+                              '--descriptor',
+                              descriptor])
+
+    # Module artifact points into the module repository fetched into the temporary target directory
+    assert "Artifact data.txt cached with UUID" in result.output
+    assert "1 artifact(s) cached, 0 already cached, 0 failed" in result.output